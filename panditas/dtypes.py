@@ -0,0 +1,139 @@
+import logging
+
+from .lazy import lazy_import
+
+np = lazy_import("numpy")
+pd = lazy_import("pandas")
+
+logger = logging.getLogger(__name__)
+
+# Strings are stored as categoricals when distinct values are at most this
+# fraction of the rows
+CATEGORICAL_MAX_RATIO = 0.5
+
+
+def _optimize_float(series):
+    """Downcast a float column only when no value changes.
+
+    Whole numbers are kept as floats, so later steps and exports see the same
+    values as the source (1.0 is not written as 1).
+
+    Parameters
+    ----------
+    series : Series
+        Float column.
+
+    Returns
+    -------
+    Series
+        The column as float32 if that is lossless, unchanged otherwise.
+
+    """
+    values = series.to_numpy()
+    downcast = series.astype(np.float32)
+    if np.array_equal(downcast.to_numpy().astype(np.float64), values, equal_nan=True):
+        return downcast
+    return series
+
+
+def _optimize_integer(series):
+    """Downcast an integer column to the smallest type holding its values.
+
+    Parameters
+    ----------
+    series : Series
+        Integer column.
+
+    Returns
+    -------
+    Series
+        The downcast column, flags (0 and 1 values) become int8.
+
+    """
+    return pd.to_numeric(series, downcast="integer")
+
+
+def _optimize_object(series, categorical_max_ratio):
+    """Store low cardinality string columns as categoricals.
+
+    Parameters
+    ----------
+    series : Series
+        Object column.
+    categorical_max_ratio : float
+        Maximum ratio of distinct values to rows to use a categorical.
+
+    Returns
+    -------
+    Series
+        The column as a categorical if it only holds strings with few distinct
+        values and that takes less memory, unchanged otherwise.
+
+    """
+    if pd.api.types.infer_dtype(series, skipna=True) != "string":
+        return series
+    if series.nunique(dropna=True) > categorical_max_ratio * len(series):
+        return series
+    categorical = series.astype("category")
+    # On small columns the categories can take more space than the strings
+    if categorical.memory_usage(deep=True) < series.memory_usage(deep=True):
+        return categorical
+    return series
+
+
+def get_memory_usage(df):
+    """Measure the memory used by the columns of a Data Frame.
+
+    Parameters
+    ----------
+    df : Data Frame
+        Data Frame to measure.
+
+    Returns
+    -------
+    int
+        Bytes used by the Data Frame including the contents of strings.
+
+    """
+    return int(df.memory_usage(deep=True, index=False).sum())
+
+
+def optimize_dtypes(df, categorical_max_ratio=CATEGORICAL_MAX_RATIO):
+    """Convert the columns of a Data Frame to the most compact safe dtypes.
+
+    - Strings with few distinct values become categoricals.
+    - Integers are downcast to the smallest integer holding all the values.
+    - Floats become float32 when that does not change any value.
+    - Integer flag columns (only 0 and 1) become int8.
+
+    Parameters
+    ----------
+    df : Data Frame
+        Data Frame to optimize, it is not modified.
+    categorical_max_ratio : float
+        Maximum ratio of distinct values to rows to use a categorical.
+
+    Returns
+    -------
+    Data Frame
+        The Data Frame with compact dtypes.
+
+    """
+    columns = {}
+    for column_name, series in df.items():
+        if pd.api.types.is_bool_dtype(series) or isinstance(
+            series.dtype, (pd.CategoricalDtype, pd.SparseDtype)
+        ):
+            continue
+        elif pd.api.types.is_integer_dtype(series):
+            columns[column_name] = _optimize_integer(series)
+        elif pd.api.types.is_float_dtype(series):
+            columns[column_name] = _optimize_float(series)
+        elif series.dtype == object:
+            columns[column_name] = _optimize_object(series, categorical_max_ratio)
+    if not columns:
+        return df
+    df = df.copy(deep=False)
+    for column_name, series in columns.items():
+        df[column_name] = series
+    return df
@@ -0,0 +1,61 @@
+import importlib
+import importlib.util
+
+
+class LazyModule:
+    """Module imported the first time one of its attributes is used.
+
+    Building, validating and pickling Data Flows does not need pandas, numpy or
+    pyarrow, so they are only imported when a step runs. Once imported, the
+    attributes of the module are served from its own namespace.
+    """
+
+    def __init__(self, name):
+        """Short summary.
+
+        Parameters
+        ----------
+        name : str
+            Absolute name of the module, e.g. pyarrow.parquet.
+
+        Returns
+        -------
+        None
+
+        """
+        self.__dict__["_name"] = name
+        self.__dict__["_module"] = None
+
+    def __repr__(self):
+        return "LazyModule {0}, imported: {1}".format(
+            self._name, self._module is not None
+        )
+
+    def __getattr__(self, attribute):
+        if self._module is None:
+            self.__dict__["_module"] = importlib.import_module(self._name)
+        return getattr(self._module, attribute)
+
+    def __setattr__(self, attribute, value):
+        raise AttributeError("{0} is a read only module".format(self._name))
+
+
+def lazy_import(name, optional=False):
+    """Get a module that is imported on first use.
+
+    Parameters
+    ----------
+    name : str
+        Absolute name of the module.
+    optional : bool
+        If True, None is returned when the module is not installed.
+
+    Returns
+    -------
+    LazyModule
+        Proxy of the module, None if it is optional and not installed.
+
+    """
+    if optional and importlib.util.find_spec(name.split(".")[0]) is None:
+        return None
+    return LazyModule(name)
@@ -1,26 +1,478 @@
 import datetime
+import glob
+import hashlib
+import json
 import logging
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
 
-import pandas as pd
+from .dtypes import get_memory_usage, optimize_dtypes
+from .lazy import lazy_import
+from .sketches import BloomFilter
 
+# Only imported when a step runs, see panditas.lazy
+np = lazy_import("numpy")
+pd = lazy_import("pandas")
+pa = lazy_import("pyarrow")
+pa_csv = lazy_import("pyarrow.csv")
+pq = lazy_import("pyarrow.parquet")
 
 logger = logging.getLogger(__name__)
 
+# Key of the panditas metadata in the schema of the saved Data Sets
+METADATA_KEY = b"panditas"
+
+# File extensions read for each file based source when given a directory
+SOURCE_EXTENSIONS = {"csv": (".csv",), "excel": (".xlsx", ".xlsm")}
+
+# Metadata that describes the rows, kept by steps that do not change them
+PROPERTY_KEYS = ("column_formats", "partition_keys", "sort_keys", "unique_keys")
+
+# Exported file formats by extension
+EXPORT_FORMATS = {".csv": "csv", ".htm": "html", ".html": "html", ".xlsx": "excel"}
+
+# Engines (and their connection pools) by provider, host, port, database and user
+SQL_ENGINES = {}
+
+# Attributes set while running a step, not part of its fingerprint
+RUN_ATTRIBUTES = (
+    "depends_on",
+    "input_data_sets",
+    "job_id",
+    "memory_saved",
+    "name",
+    "output_data_set",
+    "position",
+    "preview_data_set",
+)
+
+# Keys of the smaller side of a merge are kept as an exact set up to this many
+# distinct values, as a Bloom filter beyond that
+SEMI_JOIN_EXACT_MAX_KEYS = 100000
+
+# String columns with at most this many distinct values per block are read as
+# categoricals by the arrow reader
+ARROW_DICTIONARY_MAX_CARDINALITY = 1000
+
+
+def virtual_constant(value, index):
+    """Build a constant column that stores only its value, not one per row.
+
+    The column is a sparse array without points, so it takes no memory for the
+    rows and is saved as metadata of the Data Set.
+
+    Parameters
+    ----------
+    value : scalar
+        Value of every row.
+    index : Index
+        Index of the Data Frame the column belongs to.
+
+    Returns
+    -------
+    Series
+        The virtual constant column.
+
+    """
+    dtype = pd.Series([value]).dtype
+    # The index of a broadcast boolean array, which is never copied row by row
+    no_points = pd.arrays.SparseArray(
+        np.broadcast_to(False, len(index)), fill_value=False
+    )
+    sparse_array = pd.arrays.SparseArray(
+        np.array([], dtype=dtype), fill_value=value, sparse_index=no_points.sp_index
+    )
+    return pd.Series(sparse_array, index=index)
+
+
+def is_virtual_constant(series):
+    """Check if a column is a virtual constant.
+
+    Parameters
+    ----------
+    series : Series
+        Column to check.
+
+    Returns
+    -------
+    bool
+        Whether the column is a virtual constant built by `virtual_constant`.
+
+    """
+    return isinstance(series.dtype, pd.SparseDtype) and series.sparse.npoints == 0
+
+
+def is_virtual_constant_value(value):
+    """Check if a constant value can be kept as a virtual constant.
+
+    Parameters
+    ----------
+    value : any
+        Value of a constant column.
+
+    Returns
+    -------
+    bool
+        Whether the value can be kept as a virtual constant, only scalars that
+        survive being saved as metadata can. None can not, sparse arrays keep
+        it as NaN.
+
+    """
+    return isinstance(value, (bool, int, float, str, np.number))
+
+
+def _to_json_scalar(value):
+    return value.item() if isinstance(value, np.generic) else value
+
+
+def _is_datetime_type(data_type):
+    return str(data_type) in ("date", "datetime") or str(data_type).startswith(
+        "datetime64"
+    )
+
+
+def keep_valid_properties(properties, columns):
+    """Keep the physical properties of a Data Set that are still valid.
+
+    Parameters
+    ----------
+    properties : dict
+        sort_keys, partition_keys and unique_keys of the Data Set, and the
+        column_formats used when it is exported.
+    columns : list
+        Columns of the Data Set.
+
+    Returns
+    -------
+    dict
+        The properties whose columns are all present, sort keys are cut
+        before the first missing column.
+
+    """
+    columns = set(columns)
+    valid_properties = {}
+    sort_keys = []
+    for column, ascending in properties.get("sort_keys", []):
+        if column not in columns:
+            break
+        sort_keys.append([column, ascending])
+    if sort_keys:
+        valid_properties["sort_keys"] = sort_keys
+    partition_keys = properties.get("partition_keys")
+    if partition_keys and set(partition_keys) <= columns:
+        valid_properties["partition_keys"] = partition_keys
+    unique_keys = [
+        keys for keys in properties.get("unique_keys", []) if set(keys) <= columns
+    ]
+    if unique_keys:
+        valid_properties["unique_keys"] = unique_keys
+    column_formats = properties.get("column_formats")
+    if isinstance(column_formats, dict):
+        column_formats = {
+            column: column_format
+            for column, column_format in column_formats.items()
+            if column in columns
+        }
+    if column_formats:
+        valid_properties["column_formats"] = column_formats
+    return valid_properties
+
+
+def _get_key_dtype(series):
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        return series.dtype.categories.dtype
+    return series.dtype
+
+
+def get_semi_join_mask(build_df, build_keys, probe_df, probe_keys):
+    """Find the rows of a Data Frame whose merge keys may be in another one.
+
+    Parameters
+    ----------
+    build_df : Data Frame
+        Side of the merge whose keys are collected.
+    build_keys : list
+        Merge columns of build_df.
+    probe_df : Data Frame
+        Side of the merge to prune.
+    probe_keys : list
+        Merge columns of probe_df, in the same order.
+
+    Returns
+    -------
+    ndarray
+        False for the rows of probe_df that can not match any row of
+        build_df, some rows kept may not match either. None if the keys have
+        different types, pandas would still match them (e.g. 1 and 1.0) but
+        their hashes would differ.
+
+    """
+    for build_key, probe_key in zip(build_keys, probe_keys):
+        if _get_key_dtype(build_df[build_key]) != _get_key_dtype(probe_df[probe_key]):
+            return None
+    build_hashes = np.unique(
+        pd.util.hash_pandas_object(build_df[build_keys], index=False).to_numpy()
+    )
+    probe_hashes = pd.util.hash_pandas_object(
+        probe_df[probe_keys], index=False
+    ).to_numpy()
+    if len(build_hashes) <= SEMI_JOIN_EXACT_MAX_KEYS:
+        return np.isin(probe_hashes, build_hashes)
+    return BloomFilter(len(build_hashes)).add(build_hashes).contains(probe_hashes)
+
+
+def _can_filter_by(values, field_type):
+    """Check if a parquet column can be filtered by a list of values.
+
+    Parameters
+    ----------
+    values : Series
+        Values to keep.
+    field_type : pyarrow.DataType
+        Type of the parquet column.
+
+    Returns
+    -------
+    bool
+        True for integers and strings of matching types without empty values.
+
+    """
+    if values.hasnans:
+        return False
+    if pa.types.is_dictionary(field_type):
+        field_type = field_type.value_type
+    dtype = _get_key_dtype(values)
+    if pd.api.types.is_integer_dtype(dtype):
+        return pa.types.is_integer(field_type)
+    return pd.api.types.infer_dtype(values, skipna=False) == "string" and (
+        pa.types.is_string(field_type) or pa.types.is_large_string(field_type)
+    )
+
+
+def read_semi_joined(step_name, probe_keys, build_df, build_keys):
+    """Read the rows of a Data Set that may match the keys of another one.
+
+    A single key with few distinct values is pushed down to the parquet reader,
+    row groups whose statistics can not match are skipped. Otherwise the rows
+    are pruned by the hashes of their keys. Only used when the Data Set has
+    more rows than build_df.
+
+    Parameters
+    ----------
+    step_name : str
+        Name of the Data Set to read.
+    probe_keys : list or str
+        Merge columns of the Data Set.
+    build_df : Data Frame
+        Other side of the merge.
+    build_keys : list or str
+        Merge columns of build_df, in the same order.
+
+    Returns
+    -------
+    Data Frame
+        The rows of the Data Set, without those that can not be merged.
+
+    """
+    if isinstance(probe_keys, str):
+        probe_keys, build_keys = [probe_keys], [build_keys]
+    if not probe_keys or (
+        DataFlow.get_output_metadata(step_name)["row_count"] <= len(build_df)
+    ):
+        return DataFlow.get_output_df(step_name)
+    schema = pq.read_schema(DataFlow.get_output_path(step_name))
+    if len(probe_keys) == 1 and probe_keys[0] in schema.names:
+        values = build_df[build_keys[0]]
+        if _can_filter_by(values, schema.field(probe_keys[0]).type):
+            key_values = pd.unique(values.astype(object))
+            if len(key_values) <= SEMI_JOIN_EXACT_MAX_KEYS:
+                return DataFlow.get_output_df(
+                    step_name, filters=[(probe_keys[0], "in", key_values.tolist())]
+                )
+    df = DataFlow.get_output_df(step_name)
+    mask = get_semi_join_mask(build_df, build_keys, df, probe_keys)
+    if mask is None or mask.all():
+        return df
+    logger.info(
+        "Pruned {0} of {1} rows of {2} before merging".format(
+            len(mask) - np.count_nonzero(mask), len(mask), step_name
+        )
+    )
+    return df[mask]
+
+
+def are_groups_contiguous(metadata, columns):
+    """Check if the rows with equal values in some columns are next to each other.
+
+    Parameters
+    ----------
+    metadata : dict
+        Metadata of a Data Set, see `DataFlow.get_output_metadata`.
+    columns : list
+        Columns that define the groups.
+
+    Returns
+    -------
+    bool
+        True if the columns are the first sort keys or the partitioning keys
+        (in any order), or if they include a unique key.
+
+    """
+    columns = set(columns)
+    if not columns:
+        return False
+    if any(set(keys) <= columns for keys in metadata.get("unique_keys", [])):
+        return True
+    if set(metadata.get("partition_keys", [])) == columns:
+        return True
+    sort_columns = [column for column, _ in metadata.get("sort_keys", [])]
+    return set(sort_columns[: len(columns)]) == columns
+
+
+def has_unique_key(metadata, columns):
+    """Check if some columns include a key known to be unique.
+
+    Parameters
+    ----------
+    metadata : dict
+        Metadata of a Data Set, see `DataFlow.get_output_metadata`.
+    columns : list
+        Columns to check.
+
+    Returns
+    -------
+    bool
+        True if no two rows can have the same values in the columns.
+
+    """
+    return any(set(keys) <= set(columns) for keys in metadata.get("unique_keys", []))
+
+
+def is_sorted_by(metadata, columns):
+    """Check if a Data Set is sorted in ascending order by some columns.
+
+    Parameters
+    ----------
+    metadata : dict
+        Metadata of a Data Set, see `DataFlow.get_output_metadata`.
+    columns : list
+        Columns in order of significance.
+
+    Returns
+    -------
+    bool
+        True if the columns are the first sort keys, all ascending.
+
+    """
+    return bool(columns) and metadata.get("sort_keys", [])[: len(columns)] == [
+        [column, True] for column in columns
+    ]
+
+
+def _format_values(series, column_format):
+    """Format the values of a column as text.
+
+    Parameters
+    ----------
+    series : Series
+        Column to format.
+    column_format : str
+        Format string, e.g. "{:,.2f}".
+
+    Returns
+    -------
+    Series
+        The formatted values, empty values stay empty.
+
+    """
+    codes, uniques = pd.factorize(series)
+    formatted = np.array(
+        [column_format.format(value) for value in uniques] + [None], dtype=object
+    )
+    return pd.Series(formatted[codes], index=series.index)
+
+
+def _get_step_parameters(step):
+    return {
+        parameter: value
+        for parameter, value in vars(step).items()
+        if not parameter.startswith("_") and parameter not in RUN_ATTRIBUTES
+    }
+
+
+def _get_fingerprint_value(value):
+    """Make a parameter of a step JSON serializable for its fingerprint.
+
+    Parameters
+    ----------
+    value : any
+        Value json can not serialize.
+
+    Returns
+    -------
+    any
+        Steps (e.g. filters) as their type and parameters, numpy values as
+        Python ones. Other objects, like functions, as their identity so they
+        are only equal to themselves.
+
+    """
+    if isinstance(value, DataFlowStep):
+        return [type(value).__name__, _get_step_parameters(value)]
+    if isinstance(value, (np.generic, np.ndarray)):
+        return value.tolist()
+    if isinstance(value, (set, frozenset)):
+        return sorted(value, key=repr)
+    return "{0}:{1}".format(type(value).__name__, id(value))
+
+
+def _get_arrow_type(data_type):
+    """Translate a pandas / numpy dtype name to an arrow type.
+
+    Parameters
+    ----------
+    data_type : str or dtype
+        The declared type, e.g. category, str, bool, datetime64[ns] or any
+        numpy dtype name.
+
+    Returns
+    -------
+    pyarrow.DataType
+        The arrow type to use when parsing.
+
+    """
+    if str(data_type) == "category":
+        return pa.dictionary(pa.int32(), pa.string())
+    elif str(data_type) in ("str", "string", "object"):
+        return pa.string()
+    elif _is_datetime_type(data_type):
+        return pa.timestamp("ns")
+    return pa.from_numpy_dtype(np.dtype(data_type))
+
 
 class DataFlow:
     custom_params = {}
     datasets = []
+    memory_report = {}
     name = None
+    optimize_dtypes = False
     output_data_set = None
     steps = []
 
-    def __init__(self, name=None, steps=[]):
+    def __init__(self, name=None, optimize=False, optimize_dtypes=False, steps=[]):
         """Short summary.
 
         Parameters
         ----------
         name : type
             Description of parameter `name`.
+        optimize : bool
+            If True the steps are rewritten into cheaper equivalent steps, e.g.
+            chains of ConditionalFill on a column become a single CaseWhen.
+        optimize_dtypes : bool
+            If True every step stores its output with compact dtypes
+            (categoricals, downcast numbers and int8 flags) and the memory saved
+            by each step is kept in `memory_report`.
         steps : type
             Description of parameter `steps`.
 
@@ -30,15 +482,53 @@ class DataFlow:
             Description of returned object.
 
         """
+        self.memory_report = {}
         self.name = name
+        self.optimize_dtypes = optimize_dtypes
         self.steps = steps
+        if optimize:
+            from .optimizer import optimize_steps
+
+            self.steps = optimize_steps(self.steps)
         if not self.name:
             self.name = "data_flow_{0}".format(
                 datetime.datetime.now().strftime("%Y%m%d%H%M%S")
             )
         for key, step in enumerate(self.steps):
             self.steps[key].position = key
+            self.steps[key].optimize_dtypes = optimize_dtypes
             self._set_dependencies(step)
+        self._push_down_filters()
+
+    def _push_down_filters(self):
+        """Give the filters that directly follow a Data Set to the Data Set.
+
+        The Data Set then skips the partitions that can not match and keeps
+        only the matching rows. Filters are only pushed down when no other step
+        uses the unfiltered Data Set.
+
+        Parameters
+        ----------
+
+
+        Returns
+        -------
+        None
+
+        """
+        for step in self.steps[1:]:
+            previous_step = self.steps[step.position - 1]
+            if not hasattr(step, "filter_df") or not isinstance(previous_step, DataSet):
+                continue
+            if not previous_step.name:
+                continue
+            dependents = [
+                other_step
+                for other_step in self.steps
+                if previous_step.name in other_step.depends_on
+            ]
+            if dependents == [step] and step not in previous_step.filters:
+                previous_step.filters = previous_step.filters + [step]
 
     def _set_dependencies(self, step):
         """Short summary.
@@ -54,31 +544,32 @@ class DataFlow:
             Description of returned object.
 
         """
-        step_type = type(step).__name__
         # Multiple Merge have dependencies on all the data sets
-        if step_type == "MergeMultipleRule":
-            self.steps[step.position].depends_on = step.data_sets
+        if isinstance(step, MergeMultipleRule):
+            step.depends_on = step.data_sets
         # Single Merge have dependencies on the left and right data sets
-        elif step_type == "MergeRule":
-            self.steps[step.position].depends_on = [
-                step.left_data_set,
-                step.right_data_set,
-            ]
+        elif isinstance(step, MergeRule):
+            step.depends_on = [step.left_data_set, step.right_data_set]
         # Data Sets do not have dependencies (unless manually specified)
-        elif step_type != "DataSet":
-            previous_step = self.steps[step.position - 1]
-            self.steps[step.position].depends_on = [previous_step.name]
-        elif step_type == "DataSet" and not self.steps[step.position].depends_on:
-            self.steps[step.position].depends_on = []
+        elif not isinstance(step, DataSet):
+            step.depends_on = [self.steps[step.position - 1].name]
+        elif not step.depends_on:
+            step.depends_on = []
 
     @staticmethod
-    def get_output_df(step_name):
+    def get_output_df(step_name, virtual_columns=False, filters=None):
         """Short summary.
 
         Parameters
         ----------
         step_name : type
             Description of parameter `step_name`.
+        virtual_columns : bool
+            If True constant columns are returned as virtual constants (see
+            `virtual_constant`) instead of full length arrays.
+        filters : list
+            pyarrow filters on the saved columns, e.g. [("policyId", "in",
+            ["Policy1"])], the index of the rows is not kept.
 
         Returns
         -------
@@ -86,16 +577,300 @@ class DataFlow:
             Description of returned object.
 
         """
-        # TODO: Check from setting and save to s3
-        df = pd.read_parquet("/tmp/{0}.parquet".format(step_name), engine="pyarrow")
+        table = pq.read_table(DataFlow.get_output_path(step_name), filters=filters)
+        df = table.to_pandas()
+        metadata = DataFlow._read_metadata(table.schema)
+        constants = metadata.get("constants")
+        if constants:
+            for column, value in constants.items():
+                if virtual_columns:
+                    df[column] = virtual_constant(value, df.index)
+                else:
+                    df[column] = value
+            df = df[metadata["columns"]]
         return df
 
-    def run(self):
-        """Short summary.
+    @staticmethod
+    def iter_output_df(step_name, chunk_size=100000, columns=None):
+        """Read the output of a step in chunks of rows.
+
+        Virtual constant columns are not included, they are in the metadata
+        (see `get_output_metadata`).
+
+        Parameters
+        ----------
+        step_name : str
+            Name of the Data Set.
+        chunk_size : int
+            Maximum number of rows of each chunk.
+        columns : list
+            Columns to read, all of them if empty.
+
+        Yields
+        ------
+        Data Frame
+            The next chunk, with the index labels of the full Data Set.
+
+        """
+        parquet_file = pq.ParquetFile(DataFlow.get_output_path(step_name))
+        pandas_metadata = parquet_file.schema_arrow.pandas_metadata or {}
+        index_columns = pandas_metadata.get("index_columns", [])
+        range_index = None
+        if len(index_columns) == 1 and isinstance(index_columns[0], dict):
+            range_index = index_columns[0]
+        elif columns is not None:
+            columns = list(columns) + index_columns
+        position = 0
+        for batch in parquet_file.iter_batches(batch_size=chunk_size, columns=columns):
+            df = batch.to_pandas()
+            if range_index is not None:
+                step = range_index["step"]
+                start = range_index["start"] + position * step
+                df.index = pd.RangeIndex(start, start + batch.num_rows * step, step)
+            position += batch.num_rows
+            yield df
+
+    @staticmethod
+    def get_output_metadata(step_name):
+        """Read the metadata saved with a Data Set without loading its data.
+
+        Parameters
+        ----------
+        step_name : str
+            Name of the Data Set.
+
+        Returns
+        -------
+        dict
+            The metadata, with the physical properties of the rows (sort_keys,
+            partition_keys, unique_keys) when known and the row_count.
+
+        """
+        file_metadata = pq.read_metadata(DataFlow.get_output_path(step_name))
+        metadata = DataFlow._read_metadata(file_metadata.schema.to_arrow_schema())
+        metadata["row_count"] = file_metadata.num_rows
+        return metadata
+
+    @staticmethod
+    def export_output_df(step_name, path, export_format=None):
+        """Write a Data Set to a CSV, Excel or HTML file.
+
+        The column formats recorded by FormatColumns are only applied here,
+        each distinct value is formatted once.
+
+        Parameters
+        ----------
+        step_name : str
+            Name of the Data Set.
+        path : str
+            Path of the file to write.
+        export_format : str
+            One of csv, excel or html, by default taken from the extension.
+
+        Returns
+        -------
+        str
+            The path of the file.
+
+        """
+        if export_format is None:
+            export_format = EXPORT_FORMATS.get(os.path.splitext(path)[1].lower())
+        if export_format not in EXPORT_FORMATS.values():
+            raise Exception(
+                "{0} is an invalid export format, needs to be one of {1}".format(
+                    export_format, ", ".join(sorted(set(EXPORT_FORMATS.values())))
+                )
+            )
+        df = DataFlow.get_output_df(step_name)
+        column_formats = DataFlow.get_output_metadata(step_name).get("column_formats")
+        if isinstance(column_formats, str):
+            # A single format applies to the numeric columns
+            column_formats = {
+                column: column_formats
+                for column in df.columns
+                if pd.api.types.is_numeric_dtype(df[column])
+                and not pd.api.types.is_bool_dtype(df[column])
+            }
+        for column, column_format in (column_formats or {}).items():
+            df[column] = _format_values(df[column], column_format)
+        if export_format == "csv":
+            df.to_csv(path, index=False)
+        elif export_format == "excel":
+            df.to_excel(path, index=False)
+        else:
+            df.to_html(path, index=False)
+        return path
+
+    @staticmethod
+    def get_output_columns(step_name):
+        """Get the columns of a Data Set without loading its data.
+
+        Parameters
+        ----------
+        step_name : str
+            Name of the Data Set.
+
+        Returns
+        -------
+        list
+            The columns, including virtual constants.
+
+        """
+        schema = pq.read_schema(DataFlow.get_output_path(step_name))
+        metadata = DataFlow._read_metadata(schema)
+        if "columns" in metadata:
+            return metadata["columns"]
+        index_columns = (schema.pandas_metadata or {}).get("index_columns", [])
+        return [name for name in schema.names if name not in index_columns]
+
+    @staticmethod
+    def get_output_path(step_name):
+        """Get where the output of a step is saved.
+
+        Parameters
+        ----------
+        step_name : str
+            Name of the Data Set.
+
+        Returns
+        -------
+        str
+            Path of the parquet file holding the Data Set.
+
+        """
+        # TODO: Check from setting and save to s3
+        return "/tmp/{0}.parquet".format(step_name)
+
+    @staticmethod
+    def get_history_path(step_name):
+        """Get the directory holding the history of an incremental step.
+
+        Parameters
+        ----------
+        step_name : str
+            Name of the Data Set.
+
+        Returns
+        -------
+        str
+            Path of the directory, one parquet file per run.
+
+        """
+        return "/tmp/{0}_history".format(step_name)
+
+    @staticmethod
+    def get_history_parts(step_name):
+        """List the parts of the history of a step, oldest first.
+
+        Parameters
+        ----------
+        step_name : str
+            Name of the Data Set.
+
+        Returns
+        -------
+        list
+            Paths of the parts, empty if the step has no history.
+
+        """
+        history_path = DataFlow.get_history_path(step_name)
+        if not os.path.isdir(history_path):
+            return []
+        return [
+            os.path.join(history_path, file_name)
+            for file_name in sorted(os.listdir(history_path))
+            if file_name.endswith(".parquet")
+        ]
+
+    @staticmethod
+    def get_last_history_part(step_name):
+        """Get the number of the last part of the history of a step.
+
+        Parameters
+        ----------
+        step_name : str
+            Name of the Data Set.
+
+        Returns
+        -------
+        int
+            Number of the last part, -1 if the step has no history.
+
+        """
+        parts = DataFlow.get_history_parts(step_name)
+        if not parts:
+            return -1
+        return int(os.path.basename(parts[-1]).split(".")[0])
+
+    @staticmethod
+    def append_history(step_name, part):
+        """Add the current output of a step to its history.
+
+        Parameters
+        ----------
+        step_name : str
+            Name of the Data Set.
+        part : int
+            Number of the part, the history is read in this order.
+
+        Returns
+        -------
+        str
+            Path of the new part.
+
+        """
+        history_path = DataFlow.get_history_path(step_name)
+        os.makedirs(history_path, exist_ok=True)
+        part_path = os.path.join(history_path, "{0:06d}.parquet".format(part))
+        shutil.copyfile(DataFlow.get_output_path(step_name), part_path)
+        return part_path
+
+    @staticmethod
+    def get_history_df(step_name):
+        """Read all the rows a step has output over its incremental runs.
 
         Parameters
         ----------
+        step_name : str
+            Name of the Data Set.
 
+        Returns
+        -------
+        Data Frame
+            The parts of the history one after the other.
+
+        """
+        frames = []
+        for part_path in DataFlow.get_history_parts(step_name):
+            table = pq.read_table(part_path)
+            df = table.to_pandas()
+            metadata = DataFlow._read_metadata(table.schema)
+            for column, value in metadata.get("constants", {}).items():
+                df[column] = value
+            if "columns" in metadata:
+                df = df[metadata["columns"]]
+            frames.append(df)
+        if not frames:
+            return DataFlow.get_output_df(step_name)
+        return pd.concat(frames, ignore_index=True)
+
+    @staticmethod
+    def _read_metadata(schema):
+        metadata = (schema.metadata or {}).get(METADATA_KEY)
+        if not metadata:
+            return {}
+        return json.loads(metadata.decode("utf-8"))
+
+    def run(self, shared_outputs=None):
+        """Short summary.
+
+        Parameters
+        ----------
+        shared_outputs : dict
+            Data Sets already computed by other Data Flows by step fingerprint
+            (see DataFlowStep.get_fingerprint), updated with the steps of this
+            one. Steps with a known fingerprint reuse that Data Set instead of
+            running, see run_all.
 
         Returns
         -------
@@ -103,26 +878,155 @@ class DataFlow:
             Description of returned object.
 
         """
+        # History part of the Data Sets that only hold the new rows of the run
+        self._delta_parts = {}
+        fingerprints = {}
         for key, step in enumerate(self.steps):
             if not step.name:
                 step.name = "{0}_{1}".format(type(step).__name__, step.position)
                 self.steps[key] = step
-            logger.info(
-                "Running step {0} name {1}".format(type(step).__name__, step.name)
+            fingerprint = step.get_fingerprint(
+                [fingerprints.get(name) for name in step.get_input_names()]
             )
-            step.run()
+            if shared_outputs is not None and fingerprint in shared_outputs:
+                DataFlow._reuse_output(step, shared_outputs[fingerprint])
+            else:
+                self._run_step(step)
             result = step.output_data_set
-            if not result:
-                raise Exception(
-                    "Step {0} returned an empty or no Data Set".format(step.name)
-                )
+            fingerprints[result] = fingerprint
+            if shared_outputs is not None:
+                DataFlow._share_output(shared_outputs, result, fingerprint)
+            if self.optimize_dtypes:
+                self.memory_report[step.name] = step.memory_saved
             input_data_sets = step.input_data_sets + [result]
             if key + 1 < len(self.steps):
                 self.steps[key + 1].input_data_sets = input_data_sets
         self.output_data_set = result
 
     @staticmethod
-    def save_output_df(df, name):
+    def _reuse_output(step, name):
+        """Use a Data Set computed by an identical step as the output of a step.
+
+        Parameters
+        ----------
+        step : DataFlowStep
+            Step that is not run.
+        name : str
+            Name of the Data Set.
+
+        Returns
+        -------
+        None
+
+        """
+        logger.info("Reusing {0} for step {1}".format(name, step.name))
+        if name != step.name:
+            shutil.copyfile(
+                DataFlow.get_output_path(name), DataFlow.get_output_path(step.name)
+            )
+        step.output_data_set = step.name
+
+    @staticmethod
+    def _share_output(shared_outputs, name, fingerprint):
+        # The Data Set saved under this name is now the one of the step
+        for other_fingerprint, other_name in list(shared_outputs.items()):
+            if other_name == name:
+                del shared_outputs[other_fingerprint]
+        if fingerprint is not None:
+            shared_outputs[fingerprint] = name
+
+    def _run_step(self, step):
+        """Run a step, on the new rows of its input if it is incremental.
+
+        Parameters
+        ----------
+        step : DataFlowStep
+            Step to run.
+
+        Returns
+        -------
+        None
+
+        """
+        logger.info("Running step {0} name {1}".format(type(step).__name__, step.name))
+        part = self._prepare_inputs(step)
+        step.run()
+        if not step.output_data_set:
+            raise Exception(
+                "Step {0} returned an empty or no Data Set".format(step.name)
+            )
+        if part is not None:
+            DataFlow.append_history(step.name, part)
+            self._delta_parts[step.name] = part
+
+    def _prepare_inputs(self, step):
+        """Decide if a step runs on the new rows of its input or on all of them.
+
+        Row local steps reading only new rows process them and add their output
+        to their own history. Other steps get the full history of their inputs,
+        and so do row local steps whose history is not up to date with their
+        input (it is then started again).
+
+        Parameters
+        ----------
+        step : DataFlowStep
+            Step about to run.
+
+        Returns
+        -------
+        int
+            History part the output of the step is saved as, None if the
+            output is not incremental.
+
+        """
+        if isinstance(step, DataSet):
+            if not step.incremental_column:
+                return None
+            return DataFlow.get_last_history_part(step.name) + 1
+        input_names = step.get_input_names()
+        delta_names = [name for name in input_names if name in self._delta_parts]
+        if not delta_names:
+            return None
+        if step.is_row_local() and len(input_names) == 1:
+            part = self._delta_parts[input_names[0]]
+            if DataFlow.get_last_history_part(step.name) == part - 1:
+                return part
+            logger.info("Step {0} history is reset".format(step.name))
+            shutil.rmtree(DataFlow.get_history_path(step.name), ignore_errors=True)
+        else:
+            part = None
+        for name in delta_names:
+            logger.info("Reading the full history of {0}".format(name))
+            DataFlow.save_output_df(DataFlow.get_history_df(name), name)
+            del self._delta_parts[name]
+        return part
+
+    @staticmethod
+    def run_all(data_flows):
+        """Run several Data Flows computing the steps they share only once.
+
+        Steps with the same type, parameters and inputs (e.g. the same Data
+        Set read by every flow, or the same merge of those Data Sets) run for
+        the first flow and their output is copied for the others.
+
+        Parameters
+        ----------
+        data_flows : list
+            Data Flows to run, in order.
+
+        Returns
+        -------
+        list
+            The output Data Set of each Data Flow.
+
+        """
+        shared_outputs = {}
+        for data_flow in data_flows:
+            data_flow.run(shared_outputs=shared_outputs)
+        return [data_flow.output_data_set for data_flow in data_flows]
+
+    @staticmethod
+    def save_output_df(df, name, metadata=None):
         """Short summary.
 
         Parameters
@@ -131,6 +1035,8 @@ class DataFlow:
             Description of parameter `df`.
         name : type
             Description of parameter `name`.
+        metadata : dict
+            panditas metadata to save with the Data Set, e.g. its sort keys.
 
         Returns
         -------
@@ -138,8 +1044,25 @@ class DataFlow:
             Description of returned object.
 
         """
-        # TODO: Check from setting and save to s3
-        df.to_parquet("/tmp/{0}.parquet".format(name), engine="pyarrow")
+        metadata = dict(metadata or {})
+        # The row count is read from the parquet footer
+        metadata.pop("row_count", None)
+        constants = {
+            column: _to_json_scalar(df[column].sparse.fill_value)
+            for column in df.columns
+            if is_virtual_constant(df[column])
+        }
+        if constants:
+            # Constants are kept in the metadata instead of being written
+            metadata["columns"] = df.columns.tolist()
+            metadata["constants"] = constants
+            df = df.drop(columns=list(constants))
+        table = pa.Table.from_pandas(df)
+        if metadata:
+            schema_metadata = dict(table.schema.metadata or {})
+            schema_metadata[METADATA_KEY] = json.dumps(metadata).encode("utf-8")
+            table = table.replace_schema_metadata(schema_metadata)
+        pq.write_table(table, DataFlow.get_output_path(name))
         return name
 
 
@@ -147,9 +1070,219 @@ class DataFlowStep:
     depends_on = []
     job_id = None
     input_data_sets = []
+    # Steps whose output rows are the input rows in the same order keep the
+    # sort and partitioning keys of the input, see get_output_properties
+    keeps_row_order = False
+    memory_saved = 0
     name = None
+    optimize_dtypes = False
     output_data_set = None
     position = None
+    # Parameters naming the input Data Sets, they are replaced by the
+    # fingerprints of the inputs in get_fingerprint
+    input_parameters = ()
+    # Steps whose output rows only depend on one input row each can process
+    # just the new rows of an incremental Data Set, see is_row_local
+    row_local = False
+
+    def get_input_names(self):
+        """Get the names of the Data Sets the step reads.
+
+        Returns
+        -------
+        list
+            The last Data Set of the flow by default.
+
+        """
+        return self.input_data_sets[-1:]
+
+    def get_fingerprint(self, input_fingerprints):
+        """Identify the output of the step by its type, parameters and inputs.
+
+        Parameters
+        ----------
+        input_fingerprints : list
+            Fingerprints of the Data Sets in get_input_names.
+
+        Returns
+        -------
+        str
+            Equal for steps that output the same Data Set, None if the output
+            can not be reused (it depends on state kept between runs or on an
+            input that can not be reused).
+
+        """
+        if not self.is_reusable() or None in input_fingerprints:
+            return None
+        parameters = _get_step_parameters(self)
+        for parameter in self.input_parameters:
+            parameters.pop(parameter, None)
+        try:
+            fingerprint = json.dumps(
+                [type(self).__name__, parameters, input_fingerprints],
+                default=_get_fingerprint_value,
+                sort_keys=True,
+            )
+        except TypeError:
+            # e.g. mappings with keys of mixed types
+            return None
+        return hashlib.sha1(fingerprint.encode("utf-8")).hexdigest()
+
+    def is_reusable(self):
+        """Check if the output of the step only depends on its parameters and inputs.
+
+        Returns
+        -------
+        bool
+            True unless the step keeps state between runs.
+
+        """
+        return True
+
+    def is_row_local(self):
+        """Check if each output row only depends on one input row.
+
+        Returns
+        -------
+        bool
+            True if the step can run on the new rows of its input alone.
+
+        """
+        return self.row_local
+
+    def get_modified_columns(self):
+        """Get the columns whose values the step changes.
+
+        Returns
+        -------
+        list
+            Names of the columns, the physical properties of the input that
+            use them are not kept.
+
+        """
+        return []
+
+    def get_output_properties(self):
+        """Get the physical properties of the input still valid for the output.
+
+        Returns
+        -------
+        dict
+            sort_keys, partition_keys and unique_keys of the input that do not
+            use modified columns, empty unless keeps_row_order.
+
+        """
+        if not self.keeps_row_order or not self.input_data_sets:
+            return {}
+        metadata = DataFlow.get_output_metadata(self.input_data_sets[-1])
+        columns = DataFlow.get_output_columns(self.input_data_sets[-1])
+        modified_columns = set(self.get_modified_columns())
+        return keep_valid_properties(
+            metadata, [column for column in columns if column not in modified_columns]
+        )
+
+    def _get_output_metadata(self, columns, metadata=None):
+        """Build the metadata of the output from the kept and new properties.
+
+        Parameters
+        ----------
+        columns : list
+            Columns of the output.
+        metadata : dict
+            Metadata set by the step, it takes precedence.
+
+        Returns
+        -------
+        dict
+            The metadata to save with the output.
+
+        """
+        output_metadata = self.get_output_properties()
+        output_metadata.update(metadata or {})
+        properties = keep_valid_properties(output_metadata, columns)
+        for key in PROPERTY_KEYS:
+            output_metadata.pop(key, None)
+        output_metadata.update(properties)
+        return output_metadata
+
+    def save_output(self, df, metadata=None):
+        """Save the output of the step, with compact dtypes if enabled.
+
+        Parameters
+        ----------
+        df : Data Frame
+            Output of the step.
+        metadata : dict
+            panditas metadata to save with the output.
+
+        Returns
+        -------
+        str
+            Name of the output Data Set.
+
+        """
+        if self.optimize_dtypes:
+            memory_usage = get_memory_usage(df)
+            df = optimize_dtypes(df)
+            self.memory_saved = memory_usage - get_memory_usage(df)
+            logger.info(
+                "Step {0} saved {1} bytes by optimizing dtypes".format(
+                    self.name, self.memory_saved
+                )
+            )
+        metadata = self._get_output_metadata(df.columns, metadata)
+        return DataFlow.save_output_df(df, self.name, metadata=metadata)
+
+    def save_projection(self, columns):
+        """Save some of the columns of the input as the output of the step.
+
+        Only the column chunks of the kept columns are read and written back,
+        the data is not converted to a Data Frame.
+
+        Parameters
+        ----------
+        columns : list
+            Columns of the input to keep, in the output order.
+
+        Returns
+        -------
+        str
+            Name of the output Data Set.
+
+        """
+        input_path = DataFlow.get_output_path(self.input_data_sets[-1])
+        schema = pq.read_schema(input_path)
+        constants = DataFlow._read_metadata(schema).get("constants", {})
+        index_columns = [
+            index_column
+            for index_column in (schema.pandas_metadata or {}).get("index_columns", [])
+            if not isinstance(index_column, dict)
+        ]
+        physical_columns = [
+            column for column in columns if column not in constants
+        ] + index_columns
+        table = pq.read_table(input_path, columns=physical_columns)
+        if self.optimize_dtypes:
+            df = table.to_pandas()
+            for column in columns:
+                if column in constants:
+                    df[column] = virtual_constant(constants[column], df.index)
+            return self.save_output(df[columns])
+        table = table.select(physical_columns)
+        metadata = self._get_output_metadata(columns)
+        kept_constants = {
+            column: constants[column] for column in columns if column in constants
+        }
+        if kept_constants:
+            metadata["columns"] = list(columns)
+            metadata["constants"] = kept_constants
+        schema_metadata = dict(table.schema.metadata or {})
+        schema_metadata.pop(METADATA_KEY, None)
+        if metadata:
+            schema_metadata[METADATA_KEY] = json.dumps(metadata).encode("utf-8")
+        table = table.replace_schema_metadata(schema_metadata)
+        pq.write_table(table, DataFlow.get_output_path(self.name))
+        return self.name
 
     def run(self):
         """Short summary.
@@ -169,16 +1302,27 @@ class DataFlowStep:
 
 
 class DataSet(DataFlowStep):
+    _partition_columns = []
+    cache_dir = None
+    chunk_size = 100000
     col_count = 0
     columns = []
     data_types = {}
     db_host = None
+    db_name = None
     db_pass = None
     db_port = 3306
     db_provider = "mysql"
     db_user = None
     df_path = None
-    preview_data_set = pd.DataFrame()
+    filters = []
+    incremental_column = None
+    max_workers = None
+    # In memory cache of parsed source files shared by all the Data Sets of a
+    # process, set by the warm worker of panditas.server
+    memory_cache = None
+    preview_data_set = None
+    reader = "pandas"
     row_count = 0
     sheet_index = 0
     sheet_name = None
@@ -187,22 +1331,91 @@ class DataSet(DataFlowStep):
     table_name = None
 
     def __init__(
-        self, columns=None, depends_on=[], df_path=None, name=None, source=None
+        self,
+        cache_dir=None,
+        chunk_size=100000,
+        columns=None,
+        data_types=None,
+        db_host=None,
+        db_name=None,
+        db_pass=None,
+        db_port=3306,
+        db_provider="mysql",
+        db_user=None,
+        depends_on=[],
+        df_path=None,
+        filters=None,
+        incremental_column=None,
+        max_workers=None,
+        name=None,
+        reader="pandas",
+        sheet_index=0,
+        sheet_name=None,
+        source=None,
+        sql_query=None,
+        table_name=None,
     ):
         """Short summary.
 
         Parameters
         ----------
+        cache_dir : str
+            If provided, directory where the parsed source is cached as parquet.
+            The cache is keyed by path, size, mtime and requested columns, so it
+            is invalidated automatically when the source file changes.
+        chunk_size : int
+            Number of rows fetched at a time from SQL sources.
         columns : type
             Description of parameter `columns`.
+        data_types : dict
+            Declared dtypes by column name, e.g. {"lossPaid": "float32",
+            "lossDate": "datetime64[ns]", "agencyName": "category"}.
+        db_host : str
+            Host of the database for SQL sources.
+        db_name : str
+            Name of the database, the file path for sqlite.
+        db_pass : str
+            Password of the database user.
+        db_port : int
+            Port of the database.
+        db_provider : str
+            SQLAlchemy dialect (and driver), e.g. mysql+pymysql, postgresql or
+            sqlite.
+        db_user : str
+            User of the database.
         depends_on : type
             Description of parameter `depends_on`.
-        df_path : type
-            Description of parameter `df_path`.
+        df_path : str
+            Path of a file, a glob pattern or a directory. Directories named
+            like key=value (Hive layout) are read as partition columns.
+        filters : list
+            FilterBy rules applied while reading, filters on partition columns
+            skip the files of the partitions that do not match.
+        incremental_column : str
+            Column that only grows as rows are added to the source, e.g. a
+            revision id or a timestamp. If set, each run only reads the rows
+            above the largest value read by the previous runs (the watermark),
+            and the row local steps that follow only process those rows, the
+            rows of every run are in DataFlow.get_history_df.
+        max_workers : int
+            Number of threads used to read multiple files.
         name : type
             Description of parameter `name`.
-        source : type
-            Description of parameter `source`.
+        reader : str
+            CSV parser to use, one of pandas or arrow. The arrow reader is
+            multi-threaded and reads low cardinality strings as categoricals.
+        sheet_index : int
+            Position of the sheet to read for excel sources.
+        sheet_name : str
+            Name of the sheet to read for excel sources, takes precedence over
+            `sheet_index`.
+        source : str
+            One of csv, excel or sql.
+        sql_query : str
+            Query to read from for SQL sources, columns and filters are applied
+            on top of it.
+        table_name : str
+            Table to read from for SQL sources when no `sql_query` is provided.
 
         Returns
         -------
@@ -210,11 +1423,28 @@ class DataSet(DataFlowStep):
             Description of returned object.
 
         """
+        self.cache_dir = cache_dir
+        self.chunk_size = chunk_size
         self.columns = columns
+        self.data_types = data_types or {}
+        self.db_host = db_host
+        self.db_name = db_name
+        self.db_pass = db_pass
+        self.db_port = db_port
+        self.db_provider = db_provider
+        self.db_user = db_user
         self.depends_on = depends_on
         self.df_path = df_path
+        self.filters = filters or []
+        self.incremental_column = incremental_column
+        self.max_workers = max_workers
         self.name = name
+        self.reader = reader
+        self.sheet_index = sheet_index
+        self.sheet_name = sheet_name
         self.source = source
+        self.sql_query = sql_query
+        self.table_name = table_name
 
     def _get_columns(self):
         """Short summary.
@@ -246,6 +1476,513 @@ class DataSet(DataFlowStep):
         """
         self.data_types = {}
 
+    def _get_cache_key(self, df_path, columns):
+        """Build the parts of the cache file name for a source file.
+
+        Parameters
+        ----------
+        df_path : str
+            Path of the source file.
+        columns : list
+            Columns requested from the file.
+
+        Returns
+        -------
+        tuple
+            Hash of the source path, hash of the source version (size and
+            mtime, the hash of the contents for Excel workbooks) and hash of
+            the read options (reader or sheet, requested columns and dtypes).
+
+        """
+        source_path = os.path.abspath(df_path)
+        if self.source == "excel":
+            file_hash = hashlib.sha1()
+            with open(source_path, "rb") as source_file:
+                for block in iter(lambda: source_file.read(1024 * 1024), b""):
+                    file_hash.update(block)
+            version = [file_hash.hexdigest()]
+            options = [self.sheet_index, self.sheet_name]
+        else:
+            stat = os.stat(source_path)
+            version = [stat.st_size, stat.st_mtime_ns]
+            options = [self.reader]
+        options = json.dumps(
+            options + [columns, self.data_types], default=str, sort_keys=True
+        )
+        return tuple(
+            hashlib.sha1(key.encode("utf-8")).hexdigest()[:16]
+            for key in (source_path, json.dumps(version), options)
+        )
+
+    def _read_cached(self, read_function, df_path, columns):
+        """Load a source file from the columnar cache, parsing it only on a miss.
+
+        Cache files of older versions of the source file are removed when a
+        new version is written, the files of other columns or dtypes of the
+        same version are kept.
+
+        Parameters
+        ----------
+        read_function : callable
+            Function that parses the source file and returns a Data Frame.
+        df_path : str
+            Path of the source file.
+        columns : list
+            Columns requested from the file.
+
+        Returns
+        -------
+        Data Frame
+            The source data.
+
+        """
+        path_key, version_key, options_key = self._get_cache_key(df_path, columns)
+        cache_path = os.path.join(
+            self.cache_dir,
+            "{0}_{1}_{2}.parquet".format(path_key, version_key, options_key),
+        )
+        if os.path.exists(cache_path):
+            logger.info("Loading {0} from cache {1}".format(df_path, cache_path))
+            return pd.read_parquet(cache_path, engine="pyarrow")
+        df = read_function(df_path, columns)
+        os.makedirs(self.cache_dir, exist_ok=True)
+        version_prefix = "{0}_{1}_".format(path_key, version_key)
+        for file_name in os.listdir(self.cache_dir):
+            if file_name.startswith(path_key + "_") and not file_name.startswith(
+                version_prefix
+            ):
+                os.remove(os.path.join(self.cache_dir, file_name))
+        # Write then rename so concurrent readers never see a partial file
+        temp_path = "{0}.{1}.tmp".format(cache_path, os.getpid())
+        df.to_parquet(temp_path, engine="pyarrow")
+        os.replace(temp_path, cache_path)
+        return df
+
+    def _read_csv(self, df_path, columns):
+        """Short summary.
+
+        Parameters
+        ----------
+        df_path : str
+            Path of the CSV file.
+        columns : list
+            Columns to read, all of them if empty.
+
+        Returns
+        -------
+        Data Frame
+            The CSV contents, restricted to `columns` if provided.
+
+        """
+        if self.reader == "arrow":
+            return self._read_csv_arrow(df_path, columns)
+        elif self.reader != "pandas":
+            raise Exception(
+                "{0} is an invalid reader, needs to be one of pandas or arrow".format(
+                    self.reader
+                )
+            )
+        dtypes = {}
+        parse_dates = []
+        for column, data_type in self.data_types.items():
+            if columns and column not in columns:
+                continue
+            if _is_datetime_type(data_type):
+                parse_dates.append(column)
+            else:
+                dtypes[column] = data_type
+        df = pd.read_csv(
+            df_path,
+            dtype=dtypes or None,
+            parse_dates=parse_dates or False,
+            usecols=columns,
+        )
+        if columns:
+            df = df[columns]
+        return df
+
+    def _read_csv_arrow(self, df_path, columns):
+        """Read a CSV file with the multi-threaded arrow parser.
+
+        Declared `data_types` are passed to the parser so no inference happens
+        for those columns, ISO dates are parsed natively and string columns
+        with few distinct values are dictionary encoded (categoricals).
+
+        Parameters
+        ----------
+        df_path : str
+            Path of the CSV file.
+        columns : list
+            Columns to read, all of them if empty.
+
+        Returns
+        -------
+        Data Frame
+            The CSV contents, restricted to `columns` if provided.
+
+        """
+        convert_options = pa_csv.ConvertOptions(
+            auto_dict_encode=True,
+            auto_dict_max_cardinality=ARROW_DICTIONARY_MAX_CARDINALITY,
+            column_types={
+                column: _get_arrow_type(data_type)
+                for column, data_type in self.data_types.items()
+            },
+            include_columns=columns or [],
+        )
+        table = pa_csv.read_csv(
+            df_path,
+            convert_options=convert_options,
+            read_options=pa_csv.ReadOptions(use_threads=True),
+        )
+        return table.to_pandas(
+            date_as_object=False, split_blocks=True, self_destruct=True
+        )
+
+    def _read_excel(self, df_path, columns):
+        """Read one sheet of a workbook with the streaming read only parser.
+
+        Only the requested columns are kept while the rows are read.
+
+        Parameters
+        ----------
+        df_path : str
+            Path of the workbook.
+        columns : list
+            Columns to read, all of them if empty.
+
+        Returns
+        -------
+        Data Frame
+            The sheet contents, the first row is used as header.
+
+        """
+        import openpyxl
+
+        workbook = openpyxl.load_workbook(df_path, data_only=True, read_only=True)
+        try:
+            if self.sheet_name:
+                sheet = workbook[self.sheet_name]
+            else:
+                sheet = workbook.worksheets[self.sheet_index]
+            rows = sheet.iter_rows(values_only=True)
+            header = list(next(rows, ()))
+            if columns:
+                missing_columns = [column for column in columns if column not in header]
+                if missing_columns:
+                    raise Exception(
+                        "{0} are invalid columns, needs to be one of {1}".format(
+                            ", ".join(missing_columns),
+                            ", ".join(str(column) for column in header),
+                        )
+                    )
+                indexes = [header.index(column) for column in columns]
+                rows = (tuple(row[index] for index in indexes) for row in rows)
+                header = columns
+            df = pd.DataFrame.from_records(rows, columns=header)
+        finally:
+            workbook.close()
+        for column, data_type in self.data_types.items():
+            if column in df.columns:
+                df[column] = df[column].astype(data_type)
+        return df
+
+    def _list_source_paths(self):
+        """List the files behind `df_path`.
+
+        Parameters
+        ----------
+
+
+        Returns
+        -------
+        tuple
+            The directory the partitions are relative to and the file paths,
+            None and an empty list if `df_path` is a single file.
+
+        """
+        if any(character in self.df_path for character in "*?["):
+            base_path = self.df_path
+            while any(character in base_path for character in "*?["):
+                base_path = os.path.dirname(base_path)
+            paths = [
+                path
+                for path in glob.glob(self.df_path, recursive=True)
+                if os.path.isfile(path)
+            ]
+            return base_path or os.curdir, sorted(paths)
+        elif os.path.isdir(self.df_path):
+            paths = []
+            for directory, _, file_names in os.walk(self.df_path):
+                for file_name in file_names:
+                    if file_name.endswith(SOURCE_EXTENSIONS[self.source]):
+                        paths.append(os.path.join(directory, file_name))
+            return self.df_path, sorted(paths)
+        return None, []
+
+    def _get_source_files(self):
+        """List the files behind `df_path` with their partition values.
+
+        `df_path` can be a single file, a glob pattern or a directory, and
+        directories named like key=value (Hive layout) become partition
+        columns.
+
+        Parameters
+        ----------
+
+
+        Returns
+        -------
+        Data Frame
+            One row per file with a `path` column and one column per partition
+            key.
+
+        """
+        base_path, paths = self._list_source_paths()
+        if not base_path:
+            return pd.DataFrame({"path": [self.df_path]})
+        files = []
+        for path in paths:
+            partitions = {"path": path}
+            relative_path = os.path.relpath(os.path.dirname(path), base_path)
+            for directory in relative_path.split(os.sep):
+                if "=" in directory:
+                    key, value = directory.split("=", 1)
+                    partitions[key] = value
+            files.append(partitions)
+        files = pd.DataFrame(files, columns=None if files else ["path"])
+        for column in files.columns.drop("path"):
+            try:
+                files[column] = pd.to_numeric(files[column])
+            except (TypeError, ValueError):
+                pass
+        return files
+
+    def _read_file(self, df_path, columns):
+        """Read one source file, through the caches if enabled.
+
+        The in memory cache is checked first, then the columnar cache in
+        `cache_dir`. Both are keyed by the version of the file, so a changed
+        source is read again.
+
+        Parameters
+        ----------
+        df_path : str
+            Path of the source file.
+        columns : list
+            Columns to read, all of them if empty.
+
+        Returns
+        -------
+        Data Frame
+            The file contents.
+
+        """
+        if self.memory_cache is not None:
+            cache_key = self._get_cache_key(df_path, columns)
+            df = self.memory_cache.get(cache_key)
+            if df is None:
+                df = self._read_source_file(df_path, columns)
+                self.memory_cache.set(cache_key, df)
+            # The caller adds partition columns and casts in place
+            return df.copy()
+        return self._read_source_file(df_path, columns)
+
+    def _read_source_file(self, df_path, columns):
+        read_function = self._read_csv
+        if self.source == "excel":
+            read_function = self._read_excel
+        if self.cache_dir:
+            return self._read_cached(read_function, df_path, columns)
+        return read_function(df_path, columns)
+
+    def _read_files(self):
+        """Read all the source files concurrently, skipping pruned partitions.
+
+        Files whose partition values do not satisfy the `filters` are never
+        opened.
+
+        Parameters
+        ----------
+
+
+        Returns
+        -------
+        Data Frame
+            The contents of all the files with their partition columns.
+
+        """
+        files = self._get_source_files()
+        partition_columns = files.columns.drop("path").tolist()
+        # Files are read in path order, so each partition is contiguous
+        self._partition_columns = partition_columns
+        for filter_rule in self.filters:
+            if filter_rule.column_name in partition_columns:
+                files = filter_rule.filter_df(files)
+        file_columns = None
+        if self.columns:
+            file_columns = [
+                column for column in self.columns if column not in partition_columns
+            ]
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            frames = list(
+                executor.map(
+                    lambda df_path: self._read_file(df_path, file_columns),
+                    files["path"],
+                )
+            )
+        for df, (_, partitions) in zip(frames, files.iterrows()):
+            for column in partition_columns:
+                df[column] = partitions[column]
+        if not frames:
+            return pd.DataFrame(columns=self.columns or partition_columns)
+        df = frames[0] if len(frames) == 1 else pd.concat(frames, ignore_index=True)
+        for column in partition_columns:
+            if column in self.data_types:
+                df[column] = df[column].astype(self.data_types[column])
+        if self.columns:
+            df = df[self.columns]
+        return df
+
+    def _get_sql_engine(self):
+        """Get the pooled engine for the database, creating it on first use.
+
+        Parameters
+        ----------
+
+
+        Returns
+        -------
+        sqlalchemy.engine.Engine
+            Engine shared by every Data Set reading from the same database.
+
+        """
+        import sqlalchemy as sa
+
+        key = (self.db_provider, self.db_host, self.db_port, self.db_name, self.db_user)
+        if key not in SQL_ENGINES:
+            if self.db_provider.startswith("sqlite"):
+                url = sa.engine.URL.create(self.db_provider, database=self.db_name)
+            else:
+                url = sa.engine.URL.create(
+                    self.db_provider,
+                    database=self.db_name,
+                    host=self.db_host,
+                    password=self.db_pass,
+                    port=self.db_port,
+                    username=self.db_user,
+                )
+            SQL_ENGINES[key] = sa.create_engine(url, pool_pre_ping=True)
+        return SQL_ENGINES[key]
+
+    def _build_sql_query(self):
+        """Build the query with the column projection and filters pushed down.
+
+        Parameters
+        ----------
+
+
+        Returns
+        -------
+        sqlalchemy.sql.Select
+            The query to run.
+
+        """
+        import sqlalchemy as sa
+
+        if self.sql_query:
+            from_clause = sa.text(self.sql_query).columns().subquery("q")
+        elif self.table_name:
+            from_clause = sa.table(self.table_name)
+        else:
+            raise Exception("SQL Data Sets need either a sql_query or a table_name")
+        if self.columns:
+            columns = [sa.column(column) for column in self.columns]
+        else:
+            columns = [sa.literal_column("*")]
+        query = sa.select(*columns).select_from(from_clause)
+        if self.filters:
+            # All the columns, a condition value naming one of them is compared
+            # against that column even if it is not read
+            table_columns = self._get_sql_columns(from_clause)
+        for filter_rule in self.filters:
+            query = query.where(filter_rule.filter_sql(table_columns))
+        watermark = self._get_watermark()
+        if watermark is not None:
+            query = query.where(sa.column(self.incremental_column) > watermark)
+        return query
+
+    def _get_sql_columns(self, from_clause):
+        """Get the columns of the queried table without reading any row.
+
+        Parameters
+        ----------
+        from_clause : sqlalchemy.sql.FromClause
+            Table or subquery the Data Set reads from.
+
+        Returns
+        -------
+        list
+            Names of the columns.
+
+        """
+        import sqlalchemy as sa
+
+        query = sa.select(sa.literal_column("*")).select_from(from_clause).limit(0)
+        with self._get_sql_engine().connect() as connection:
+            return list(connection.execute(query).keys())
+
+    def _read_sql(self):
+        """Read the query results in chunks through a server side cursor.
+
+        Parameters
+        ----------
+
+
+        Returns
+        -------
+        Data Frame
+            The query results.
+
+        """
+        query = self._build_sql_query()
+        with self._get_sql_engine().connect() as connection:
+            connection = connection.execution_options(stream_results=True)
+            frames = list(pd.read_sql(query, connection, chunksize=self.chunk_size))
+        if not frames:
+            return pd.DataFrame(columns=self.columns or [])
+        df = frames[0] if len(frames) == 1 else pd.concat(frames, ignore_index=True)
+        for column, data_type in self.data_types.items():
+            if column in df.columns:
+                df[column] = df[column].astype(data_type)
+        return df
+
+    def get_input_names(self):
+        return []
+
+    def is_reusable(self):
+        return not self.incremental_column
+
+    def _get_watermark(self):
+        """Get the largest value of the incremental column already read.
+
+        Parameters
+        ----------
+
+
+        Returns
+        -------
+        scalar
+            The watermark saved with the last run, None if there is none.
+
+        """
+        if not self.incremental_column:
+            return None
+        parts = DataFlow.get_history_parts(self.name)
+        if not parts:
+            return None
+        return DataFlow._read_metadata(pq.read_schema(parts[-1])).get("watermark")
+
     def get(self):
         """Short summary.
 
@@ -260,19 +1997,33 @@ class DataSet(DataFlowStep):
 
         """
         df = pd.DataFrame()
-        if self.source == "csv":
-            df = pd.read_csv(self.df_path)
-            if self.columns:
-                df = df[self.columns]
+        metadata = {}
+        watermark = self._get_watermark()
+        if self.source in SOURCE_EXTENSIONS:
+            df = self._read_files()
+            for filter_rule in self.filters:
+                df = filter_rule.filter_df(df)
+            if watermark is not None:
+                df = df[df[self.incremental_column] > watermark]
+            if self._partition_columns:
+                metadata["partition_keys"] = self._partition_columns
         elif self.source == "sql":
-            raise Exception("TODO: Finish")
+            # Filters and the watermark are already part of the query
+            df = self._read_sql()
         else:
-            raise StandardError(
-                "{0} is an invalid source, needs to be one of csv or sql".format(
+            raise Exception(
+                "{0} is an invalid source, needs to be one of csv, excel or sql".format(
                     self.source
                 )
             )
-        return DataFlow.save_output_df(df, self.name)
+        if self.incremental_column:
+            if len(df):
+                watermark = df[self.incremental_column].max()
+                if isinstance(watermark, pd.Timestamp):
+                    watermark = watermark.isoformat()
+                watermark = _to_json_scalar(watermark)
+            metadata["watermark"] = watermark
+        return self.save_output(df, metadata=metadata)
 
     def run(self):
         """Short summary.
@@ -291,6 +2042,7 @@ class DataSet(DataFlowStep):
 
 
 class MergeMultipleRule(DataFlowStep):
+    input_parameters = ("data_sets",)
     data_sets = []
     merge_types = []
     merge_keys = []
@@ -327,6 +2079,9 @@ class MergeMultipleRule(DataFlowStep):
             self.name, self.data_sets
         )
 
+    def get_input_names(self):
+        return list(self.data_sets)
+
     def _validate_merge_keys(self):
         """If merge keys are not provided, set them to None.
 
@@ -360,9 +2115,8 @@ class MergeMultipleRule(DataFlowStep):
             Description of returned object.
 
         """
-        df = DataFlow.get_output_df(self.data_sets.pop(0))
-        for idx, data_set in enumerate(self.data_sets):
-            right_df = DataFlow.get_output_df(data_set)
+        df = DataFlow.get_output_df(self.data_sets[0])
+        for idx, data_set in enumerate(self.data_sets[1:]):
             try:
                 self.merge_keys[idx][0]
             except TypeError:
@@ -371,16 +2125,31 @@ class MergeMultipleRule(DataFlowStep):
             else:
                 left_on = self.merge_keys[idx][0]
                 right_on = self.merge_keys[idx][1]
+            if self.merge_types[idx] in ("inner", "left"):
+                left_keys = left_on
+                right_keys = right_on
+                if left_on is None:
+                    # pandas merges on the columns in common
+                    left_keys = [
+                        column
+                        for column in df.columns
+                        if column in DataFlow.get_output_columns(data_set)
+                    ]
+                    right_keys = left_keys
+                right_df = read_semi_joined(data_set, right_keys, df, left_keys)
+            else:
+                right_df = DataFlow.get_output_df(data_set)
             df = df.merge(
                 right_df,
                 how=self.merge_types[idx],
                 left_on=left_on,
                 right_on=right_on,
             )
-        self.output_data_set = DataFlow.save_output_df(df, self.name)
+        self.output_data_set = self.save_output(df)
 
 
 class MergeRule(DataFlowStep):
+    input_parameters = ("left_data_set", "right_data_set")
     left_data_set = None
     right_data_set = None
     merge_type = "inner"
@@ -431,6 +2200,9 @@ class MergeRule(DataFlowStep):
         self.merge_columns_right = merge_columns_right
         self.name = name
 
+    def get_input_names(self):
+        return [self.left_data_set, self.right_data_set]
+
     def run(self):
         """Short summary.
 
@@ -444,17 +2216,263 @@ class MergeRule(DataFlowStep):
             Description of returned object.
 
         """
+        left_df, right_df = self._read_inputs()
+        metadata = {}
+        merge_key = self._get_merge_join_key(left_df, right_df)
+        if merge_key is not None:
+            df = self._merge_join(left_df, right_df, merge_key)
+            metadata["sort_keys"] = [[merge_key, True]]
+        else:
+            df = pd.merge(
+                left_df,
+                right_df,
+                how=self.merge_type,
+                on=self.merge_columns,
+                left_on=self.merge_columns_left,
+                right_on=self.merge_columns_right,
+            )
+        self.output_data_set = self.save_output(df, metadata=metadata)
+
+    def _read_inputs(self):
+        """Read both sides of the merge, pruning the rows that can not match.
+
+        Left merges prune the right side with the keys of the left one, inner
+        merges prune the larger side with the keys of the smaller one (see
+        `read_semi_joined`).
+
+        Parameters
+        ----------
+
+
+        Returns
+        -------
+        tuple
+            The left and right Data Frames.
+
+        """
+        left_keys, right_keys = self._get_merge_keys()
+        if not left_keys or self.merge_type not in ("inner", "left"):
+            return (
+                DataFlow.get_output_df(self.left_data_set),
+                DataFlow.get_output_df(self.right_data_set),
+            )
+        if self.merge_type == "inner" and (
+            DataFlow.get_output_metadata(self.left_data_set)["row_count"]
+            > DataFlow.get_output_metadata(self.right_data_set)["row_count"]
+        ):
+            right_df = DataFlow.get_output_df(self.right_data_set)
+            left_df = read_semi_joined(
+                self.left_data_set, left_keys, right_df, right_keys
+            )
+            return left_df, right_df
         left_df = DataFlow.get_output_df(self.left_data_set)
-        right_df = DataFlow.get_output_df(self.right_data_set)
-        df = pd.merge(
-            left_df,
-            right_df,
-            how=self.merge_type,
-            on=self.merge_type,
-            left_on=self.merge_columns_left,
-            right_on=self.merge_columns_right,
+        right_df = read_semi_joined(self.right_data_set, right_keys, left_df, left_keys)
+        return left_df, right_df
+
+    def _get_merge_keys(self):
+        if self.merge_columns:
+            merge_columns = self.merge_columns
+            if isinstance(merge_columns, str):
+                merge_columns = [merge_columns]
+            return list(merge_columns), list(merge_columns)
+        return self.merge_columns_left, self.merge_columns_right
+
+    def _get_merge_join_key(self, left_df, right_df):
+        """Find the key of a merge that can be done as a merge join.
+
+        Parameters
+        ----------
+        left_df : Data Frame
+            Left Data Set.
+        right_df : Data Frame
+            Right Data Set.
+
+        Returns
+        -------
+        str
+            The key, if the merge is on one column with the same name on both
+            sides, both Data Sets are sorted by it and it has no empty values.
+            None otherwise.
+
+        """
+        left_keys, right_keys = self._get_merge_keys()
+        if (
+            not left_keys
+            or len(left_keys) != 1
+            or left_keys != right_keys
+            or self.merge_type not in ("inner", "left", "outer", "right")
+        ):
+            return None
+        merge_key = left_keys[0]
+        if not (
+            is_sorted_by(DataFlow.get_output_metadata(self.left_data_set), [merge_key])
+            and is_sorted_by(
+                DataFlow.get_output_metadata(self.right_data_set), [merge_key]
+            )
+        ):
+            return None
+        if left_df[merge_key].hasnans or right_df[merge_key].hasnans:
+            return None
+        return merge_key
+
+    def _merge_join(self, left_df, right_df, merge_key):
+        """Merge Data Sets sorted by the key with one linear pass.
+
+        Joining on sorted indexes lets pandas walk both sides in order instead
+        of hashing the keys. The result matches `pd.merge`.
+
+        Parameters
+        ----------
+        left_df : Data Frame
+            Left Data Set, sorted by merge_key.
+        right_df : Data Frame
+            Right Data Set, sorted by merge_key.
+        merge_key : str
+            Column to merge on.
+
+        Returns
+        -------
+        Data Frame
+            The merged rows, sorted by merge_key.
+
+        """
+        overlap = (set(left_df.columns) & set(right_df.columns)) - {merge_key}
+        columns = [
+            "{0}_x".format(column) if column in overlap else column
+            for column in left_df.columns
+        ] + [
+            "{0}_y".format(column) if column in overlap else column
+            for column in right_df.columns
+            if column != merge_key
+        ]
+        df = (
+            left_df.set_index(merge_key)
+            .join(
+                right_df.set_index(merge_key),
+                how=self.merge_type,
+                lsuffix="_x",
+                rsuffix="_y",
+            )
+            .reset_index()
+        )
+        return df[columns]
+
+    def get_output_properties(self):
+        """Get the physical properties of the left Data Set kept by the merge.
+
+        Returns
+        -------
+        dict
+            Inner and left merges keep the order of the left rows, and its
+            unique keys when the right key is unique.
+
+        """
+        if self.merge_type not in ("inner", "left"):
+            return {}
+        left_metadata = DataFlow.get_output_metadata(self.left_data_set)
+        properties = keep_valid_properties(
+            left_metadata, DataFlow.get_output_columns(self.left_data_set)
         )
-        self.output_data_set = DataFlow.save_output_df(df, self.name)
+        right_keys = self._get_merge_keys()[1]
+        if not right_keys or not has_unique_key(
+            DataFlow.get_output_metadata(self.right_data_set), right_keys
+        ):
+            properties.pop("unique_keys", None)
+        return properties
+
+
+class OutputWriter:
+    """Write the output of a step in chunks of rows.
+
+    Parameters
+    ----------
+    name : str
+        Name of the output Data Set.
+    metadata : dict
+        panditas metadata of the Data Set, e.g. the virtual constants of the
+        columns that are not written.
+    schema : Schema
+        Arrow schema of the input, its column types are used instead of the
+        ones of the first chunk, where columns with only missing values have
+        no type yet.
+
+    """
+
+    def __init__(self, name, metadata=None, schema=None):
+        self.metadata = metadata
+        self.name = name
+        self.schema = schema
+        self._empty_df = None
+        self._writer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _get_schema(self, df):
+        schema = pa.Schema.from_pandas(df, preserve_index=True)
+        for key, field in enumerate(schema):
+            if self.schema is not None and field.name in self.schema.names:
+                field = field.with_type(self.schema.field(field.name).type)
+            # Later chunks can have more categories
+            if pa.types.is_dictionary(field.type):
+                field = field.with_type(
+                    pa.dictionary(pa.int32(), field.type.value_type)
+                )
+            schema = schema.set(key, field)
+        metadata = dict(self.metadata or {})
+        metadata.pop("row_count", None)
+        if metadata:
+            schema_metadata = dict(schema.metadata or {})
+            schema_metadata[METADATA_KEY] = json.dumps(metadata).encode("utf-8")
+            schema = schema.with_metadata(schema_metadata)
+        return schema
+
+    def write(self, df):
+        """Append rows to the output.
+
+        Parameters
+        ----------
+        df : Data Frame
+            Rows to append, all chunks must have the same columns and dtypes.
+
+        Returns
+        -------
+        None
+
+        """
+        if self._writer is None:
+            if df.empty:
+                # Empty object columns have no type yet
+                if self._empty_df is None:
+                    self._empty_df = df
+                return
+            self._writer = pq.ParquetWriter(
+                DataFlow.get_output_path(self.name), self._get_schema(df)
+            )
+        self._writer.write_table(
+            pa.Table.from_pandas(df, schema=self._writer.schema, preserve_index=True)
+        )
+
+    def close(self):
+        """Finish the output, an empty Data Set is written if no rows were.
+
+        Returns
+        -------
+        str
+            Name of the output Data Set.
+
+        """
+        if self._writer is None:
+            if self._empty_df is None:
+                self._empty_df = pd.DataFrame()
+            self._writer = pq.ParquetWriter(
+                DataFlow.get_output_path(self.name), self._get_schema(self._empty_df)
+            )
+        self._writer.close()
+        return self.name
 
 
 class TransformationRule(DataFlowStep):
@@ -0,0 +1,161 @@
+import logging
+
+from .models import DataSet, MergeMultipleRule, MergeRule
+from .transformation_rules import CaseWhen, ConditionalFill, ConstantColumn
+
+logger = logging.getLogger(__name__)
+
+
+def _get_referenced_names(steps):
+    """Get the names of the steps used by name from other steps.
+
+    Parameters
+    ----------
+    steps : list
+        Steps of a Data Flow.
+
+    Returns
+    -------
+    set
+        Names used by merges and explicit Data Set dependencies.
+
+    """
+    names = set()
+    for step in steps:
+        if isinstance(step, MergeMultipleRule):
+            names.update(step.data_sets)
+        elif isinstance(step, MergeRule):
+            names.update([step.left_data_set, step.right_data_set])
+        elif isinstance(step, DataSet):
+            names.update(step.depends_on or [])
+    names.discard(None)
+    return names
+
+
+def _is_chain_fill(step, column_name):
+    """Check if a step is a ConditionalFill that can join a chain on a column.
+
+    Parameters
+    ----------
+    step : DataFlowStep
+        Step to check.
+    column_name : str
+        Column filled by the chain.
+
+    Returns
+    -------
+    bool
+        True if the step fills `column_name` without reading it.
+
+    """
+    return (
+        type(step) is ConditionalFill
+        and step.fill_column == column_name
+        and step.where_column != column_name
+        and column_name not in step.where_condition_values
+    )
+
+
+def _build_case_when(chain):
+    """Build the CaseWhen equivalent to a chain of steps filling one column.
+
+    Later fills overwrite earlier ones, so the cases go in reverse order (the
+    first matching case wins in CaseWhen).
+
+    Parameters
+    ----------
+    chain : list
+        An optional ConstantColumn followed by ConditionalFill steps on the
+        same column.
+
+    Returns
+    -------
+    CaseWhen
+        Step with the name of the last step of the chain.
+
+    """
+    default = None
+    fills = chain
+    if isinstance(chain[0], ConstantColumn):
+        default = chain[0].column_value
+        fills = chain[1:]
+    return CaseWhen(
+        column_name=fills[0].fill_column,
+        cases=[
+            (
+                fill.where_column,
+                fill.where_condition,
+                fill.where_condition_values,
+                fill.fill_value,
+            )
+            for fill in reversed(fills)
+        ],
+        default=default,
+        name=chain[-1].name,
+    )
+
+
+def rewrite_conditional_fills(steps):
+    """Replace chains of ConditionalFill steps on a column with one CaseWhen.
+
+    A chain is an optional ConstantColumn followed by consecutive
+    ConditionalFill steps on the same column, with at least two steps in
+    total. Chains whose intermediate steps are used by name from other steps
+    are left as they are.
+
+    Parameters
+    ----------
+    steps : list
+        Steps of a Data Flow.
+
+    Returns
+    -------
+    list
+        The rewritten steps.
+
+    """
+    referenced_names = _get_referenced_names(steps)
+    rewritten_steps = []
+    position = 0
+    while position < len(steps):
+        step = steps[position]
+        if isinstance(step, ConstantColumn) and step.column_value is not None:
+            column_name = step.column_name
+        elif type(step) is ConditionalFill:
+            column_name = step.fill_column
+        else:
+            rewritten_steps.append(step)
+            position += 1
+            continue
+        end = position + 1
+        while end < len(steps) and _is_chain_fill(steps[end], column_name):
+            end += 1
+        chain = steps[position:end]
+        intermediate_names = set(chain_step.name for chain_step in chain[:-1])
+        if len(chain) < 2 or intermediate_names & referenced_names:
+            rewritten_steps.append(step)
+            position += 1
+            continue
+        logger.info(
+            "Rewriting {0} steps on {1} as a CaseWhen".format(len(chain), column_name)
+        )
+        rewritten_steps.append(_build_case_when(chain))
+        position = end
+    return rewritten_steps
+
+
+def optimize_steps(steps):
+    """Rewrite the steps of a Data Flow into cheaper equivalent steps.
+
+    Parameters
+    ----------
+    steps : list
+        Steps of a Data Flow.
+
+    Returns
+    -------
+    list
+        The optimized steps.
+
+    """
+    return rewrite_conditional_fills(steps)
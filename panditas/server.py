@@ -0,0 +1,332 @@
+import argparse
+import logging
+import os
+import pickle
+import socket
+import socketserver
+import struct
+import threading
+import time
+from collections import OrderedDict
+
+from .dtypes import get_memory_usage
+from .models import SOURCE_EXTENSIONS, DataSet
+
+logger = logging.getLogger(__name__)
+
+# Parsed source files kept in memory by default by a warm worker
+CACHE_MAX_ITEMS = 32
+# Every message is prefixed with its length as an unsigned 64 bit integer
+MESSAGE_HEADER = struct.Struct(">Q")
+
+
+class DataSetCache:
+    """Least recently used cache of parsed source files.
+
+    Entries are keyed by the version of the source file (see
+    DataSet._get_cache_key), so a changed file is never served from the cache.
+    A new version of a file replaces the entries of the previous versions,
+    other columns or dtypes read from the same version are kept. Entries are
+    evicted when the cache holds more than `max_items` entries or `max_bytes`
+    bytes, least recently used first, and when older than `ttl` seconds.
+    """
+
+    max_bytes = None
+    max_items = CACHE_MAX_ITEMS
+    ttl = None
+
+    def __init__(self, max_items=CACHE_MAX_ITEMS, max_bytes=None, ttl=None):
+        """Short summary.
+
+        Parameters
+        ----------
+        max_items : int
+            Number of source files kept.
+        max_bytes : int
+            Memory used by the cached Data Frames, no limit if None.
+        ttl : float
+            Seconds a source file is kept after being read, no limit if None.
+
+        Returns
+        -------
+        type
+            Description of returned object.
+
+        """
+        self.max_bytes = max_bytes
+        self.max_items = max_items
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._size = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """Get a cached Data Frame, marking it as the most recently used.
+
+        Parameters
+        ----------
+        key : tuple
+            Hash of the source path, of the source version and of the read
+            options.
+
+        Returns
+        -------
+        Data Frame
+            The cached Data Frame, None on a miss or if it expired.
+
+        """
+        with self._lock:
+            if key not in self._entries:
+                return None
+            df, size, expires_at = self._entries[key]
+            if expires_at is not None and expires_at <= time.monotonic():
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return df
+
+    def set(self, key, df):
+        """Cache a Data Frame, evicting the least recently used ones.
+
+        Parameters
+        ----------
+        key : tuple
+            Hash of the source path, of the source version and of the read
+            options.
+        df : Data Frame
+            Parsed contents of the file.
+
+        Returns
+        -------
+        None
+
+        """
+        size = get_memory_usage(df) if self.max_bytes is not None else 0
+        expires_at = None
+        if self.ttl is not None:
+            expires_at = time.monotonic() + self.ttl
+        with self._lock:
+            for other_key in list(self._entries):
+                if other_key[0] == key[0] and other_key[1] != key[1]:
+                    self._remove(other_key)
+            self._entries[key] = (df, size, expires_at)
+            self._size += size
+            while len(self._entries) > self.max_items or (
+                self.max_bytes is not None
+                and self._size > self.max_bytes
+                and len(self._entries) > 1
+            ):
+                self._remove(next(iter(self._entries)))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def _remove(self, key):
+        _, size, _ = self._entries.pop(key)
+        self._size -= size
+
+
+def _send(connection, value):
+    message = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+    connection.sendall(MESSAGE_HEADER.pack(len(message)) + message)
+
+
+def _receive_exactly(connection, size):
+    chunks = []
+    while size:
+        chunk = connection.recv(min(size, 1024 * 1024))
+        if not chunk:
+            raise Exception("Connection closed before the end of the message")
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b"".join(chunks)
+
+
+def _receive(connection):
+    (size,) = MESSAGE_HEADER.unpack(_receive_exactly(connection, MESSAGE_HEADER.size))
+    return pickle.loads(_receive_exactly(connection, size))
+
+
+class _RequestHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        command, payload = _receive(self.request)
+        try:
+            response = ("ok", self.server.handle_command(command, payload))
+        except Exception as error:
+            logger.exception("Error running {0}".format(command))
+            response = ("error", "{0}: {1}".format(type(error).__name__, error))
+        _send(self.request, response)
+
+
+class WarmWorker(socketserver.UnixStreamServer):
+    """Long lived process running Data Flows against source files kept in memory.
+
+    Flows submitted to the worker skip the startup of a new Python process and
+    the parsing of the source files read by previous flows, registered Data
+    Sets are read ahead of the first flow. Requests are pickled, so the socket
+    is only accessible to the user running the worker, and flows run one at a
+    time since they share the Data Sets in /tmp.
+    """
+
+    cache = None
+    socket_path = None
+
+    def __init__(
+        self, socket_path, max_items=CACHE_MAX_ITEMS, max_bytes=None, ttl=None
+    ):
+        """Short summary.
+
+        Parameters
+        ----------
+        socket_path : str
+            Path of the Unix socket to listen on, replaced if it exists.
+        max_items : int
+            Number of source files kept in memory.
+        max_bytes : int
+            Memory used by the source files kept, no limit if None.
+        ttl : float
+            Seconds a source file is kept after being read, no limit if None.
+
+        Returns
+        -------
+        type
+            Description of returned object.
+
+        """
+        self.cache = DataSetCache(max_items=max_items, max_bytes=max_bytes, ttl=ttl)
+        self.socket_path = socket_path
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        # Only the user can connect, from the moment the socket is created
+        umask = os.umask(0o177)
+        try:
+            super().__init__(socket_path, _RequestHandler)
+        finally:
+            os.umask(umask)
+        DataSet.memory_cache = self.cache
+
+    def server_close(self):
+        super().server_close()
+        if DataSet.memory_cache is self.cache:
+            DataSet.memory_cache = None
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+
+    def handle_command(self, command, payload):
+        """Run a command sent by a client.
+
+        Parameters
+        ----------
+        command : str
+            One of register, run or clear.
+        payload : object
+            Data Set to register or Data Flow to run.
+
+        Returns
+        -------
+        object
+            The names and output Data Sets of the steps for run, the number of
+            source files in memory otherwise.
+
+        """
+        if command == "register":
+            if payload.source not in SOURCE_EXTENSIONS:
+                raise Exception(
+                    "{0} is an invalid source to register, needs to be one of "
+                    "{1}".format(payload.source, ", ".join(SOURCE_EXTENSIONS))
+                )
+            # Reading the files puts them in the memory cache
+            payload._read_files()
+        elif command == "run":
+            payload.run()
+            return [(step.name, step.output_data_set) for step in payload.steps]
+        elif command == "clear":
+            self.cache.clear()
+        else:
+            raise Exception(
+                "{0} is an invalid command, needs to be one of register, run or "
+                "clear".format(command)
+            )
+        return len(self.cache)
+
+
+def _request(socket_path, command, payload=None):
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+        connection.connect(socket_path)
+        _send(connection, (command, payload))
+        status, result = _receive(connection)
+    if status == "error":
+        raise Exception(result)
+    return result
+
+
+def register(data_set, socket_path):
+    """Read the source files of a Data Set into the memory of a warm worker.
+
+    Parameters
+    ----------
+    data_set : DataSet
+        File based Data Set, SQL sources are never kept in memory.
+    socket_path : str
+        Path of the socket of the worker.
+
+    Returns
+    -------
+    int
+        Number of source files in memory.
+
+    """
+    return _request(socket_path, "register", data_set)
+
+
+def submit(data_flow, socket_path):
+    """Run a Data Flow in a warm worker.
+
+    The outputs are saved by the worker like in a local run, so they can be
+    read with DataFlow.get_output_df.
+
+    Parameters
+    ----------
+    data_flow : DataFlow
+        Data Flow to run, its steps get the names and outputs of the run.
+    socket_path : str
+        Path of the socket of the worker.
+
+    Returns
+    -------
+    str
+        Name of the output Data Set of the Data Flow.
+
+    """
+    outputs = _request(socket_path, "run", data_flow)
+    for step, (name, output_data_set) in zip(data_flow.steps, outputs):
+        step.name = name
+        step.output_data_set = output_data_set
+    data_flow.output_data_set = outputs[-1][1] if outputs else None
+    return data_flow.output_data_set
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Run a panditas warm worker.")
+    parser.add_argument("socket_path")
+    parser.add_argument("--max-items", type=int, default=CACHE_MAX_ITEMS)
+    parser.add_argument("--max-bytes", type=int)
+    parser.add_argument("--ttl", type=float)
+    args = parser.parse_args(args)
+    logging.basicConfig(level=logging.INFO)
+    with WarmWorker(
+        args.socket_path,
+        max_items=args.max_items,
+        max_bytes=args.max_bytes,
+        ttl=args.ttl,
+    ) as worker:
+        worker.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,667 @@
+import re
+
+from .lazy import lazy_import
+
+np = lazy_import("numpy")
+pd = lazy_import("pandas")
+
+# Registers of a HyperLogLog are 2 ** precision, the standard error of the
+# distinct count is 1.04 / sqrt(2 ** precision), 1.6% for 12
+HYPERLOGLOG_PRECISION = 12
+# A t-digest keeps about compression / 2 centroids, the error in rank of its
+# quantiles is at most about 1 / compression
+TDIGEST_COMPRESSION = 100
+# Fraction of keys a Bloom filter reports as present without being added
+BLOOM_FILTER_ERROR_RATE = 0.01
+# Hashes added or checked at a time, bounds the memory used for the positions
+BLOOM_FILTER_CHUNK_SIZE = 2**20
+APPROXIMATE_QUANTILE = re.compile(r"^approx p(\d{1,2}(\.\d+)?)$")
+
+
+def _bit_length(values):
+    """Count the bits needed to write each value of an unsigned array.
+
+    Parameters
+    ----------
+    values : ndarray
+        uint64 values.
+
+    Returns
+    -------
+    ndarray
+        Position of the highest set bit of each value, 0 for 0.
+
+    """
+    values = values.copy()
+    bit_length = np.zeros(len(values), dtype=np.int64)
+    for shift in (32, 16, 8, 4, 2, 1):
+        is_larger = values >= np.uint64(1 << shift)
+        bit_length[is_larger] += shift
+        values[is_larger] >>= np.uint64(shift)
+    return bit_length + (values > 0)
+
+
+def _hash_numbers(values):
+    """Hash float values, whole numbers get the hash of the same int64.
+
+    Parameters
+    ----------
+    values : ndarray
+        float64 values.
+
+    Returns
+    -------
+    ndarray
+        The uint64 hashes.
+
+    """
+    is_whole = (np.floor(values) == values) & (np.abs(values) < 2.0**63)
+    hashes = pd.util.hash_array(values)
+    hashes[is_whole] = pd.util.hash_array(values[is_whole].astype(np.int64))
+    return hashes
+
+
+def _hash_values(values):
+    """Hash the non empty values of a column.
+
+    Numbers are hashed as int64 when they are whole and as float64 otherwise,
+    and categoricals as their categories, so equal values get the same hash
+    whatever the dtype of the column (int8 or int64, 1 or 1.0, categorical or
+    not) and states built from different dtypes can be merged. Numbers in
+    object columns are hashed as text.
+
+    Parameters
+    ----------
+    values : Series
+        Values to hash.
+
+    Returns
+    -------
+    tuple
+        The uint64 hashes and the boolean mask of the hashed rows.
+
+    """
+    is_present = values.notna().to_numpy()
+    values = values[is_present]
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        values = values.astype(values.cat.categories.dtype)
+    if pd.api.types.is_bool_dtype(values) or pd.api.types.is_integer_dtype(values):
+        return pd.util.hash_array(values.to_numpy(dtype=np.int64)), is_present
+    if pd.api.types.is_float_dtype(values):
+        return _hash_numbers(values.to_numpy(dtype=np.float64)), is_present
+    hashes = pd.util.hash_pandas_object(values, index=False)
+    return hashes.to_numpy(dtype=np.uint64), is_present
+
+
+class HyperLogLog:
+    """Approximate distinct count that can be merged with other counts.
+
+    The count has a standard error of 1.04 / sqrt(2 ** precision) (1.6% with
+    the default precision) and takes 2 ** precision bytes whatever the number
+    of values. Merging the counts of two sets of rows gives the count of their
+    union. Empty values are not counted.
+    """
+
+    precision = HYPERLOGLOG_PRECISION
+    registers = None
+
+    def __init__(self, precision=HYPERLOGLOG_PRECISION, registers=None):
+        """Short summary.
+
+        Parameters
+        ----------
+        precision : int
+            Bits of the hash used to choose the register, 4 to 16.
+        registers : ndarray
+            uint8 registers of a saved state, empty by default.
+
+        Returns
+        -------
+        None
+
+        """
+        if not 4 <= precision <= 16:
+            raise Exception(
+                "{0} is an invalid precision, needs to be between 4 and 16".format(
+                    precision
+                )
+            )
+        self.precision = precision
+        if registers is None:
+            registers = np.zeros(2**precision, dtype=np.uint8)
+        self.registers = registers
+
+    def __repr__(self):
+        return "HyperLogLog precision: {0}, estimate: {1}".format(
+            self.precision, self.estimate()
+        )
+
+    @staticmethod
+    def get_registers(hashes, precision):
+        """Split hashes into their register and the rank stored in it.
+
+        Parameters
+        ----------
+        hashes : ndarray
+            uint64 hashes.
+        precision : int
+            Bits of the hash used to choose the register.
+
+        Returns
+        -------
+        tuple
+            Register of each hash and its rank (position of the first set bit
+            of the rest of the hash).
+
+        """
+        registers = (hashes >> np.uint64(64 - precision)).astype(np.int64)
+        rest = hashes << np.uint64(precision)
+        ranks = np.minimum(64 - _bit_length(rest) + 1, 64 - precision + 1)
+        return registers, ranks.astype(np.uint8)
+
+    @classmethod
+    def from_groups(cls, values, codes, group_count, precision=HYPERLOGLOG_PRECISION):
+        """Count the distinct values of every group at once.
+
+        Parameters
+        ----------
+        values : Series
+            Values to count.
+        codes : ndarray
+            Group of each value, from 0 to group_count - 1, -1 to skip it.
+        group_count : int
+            Number of groups.
+        precision : int
+            Bits of the hash used to choose the register.
+
+        Returns
+        -------
+        list
+            One HyperLogLog per group.
+
+        """
+        hashes, is_present = _hash_values(values)
+        codes = np.asarray(codes)[is_present]
+        is_grouped = codes >= 0
+        registers, ranks = cls.get_registers(hashes[is_grouped], precision)
+        positions = codes[is_grouped] * 2**precision + registers
+        group_registers = np.zeros(group_count * 2**precision, dtype=np.uint8)
+        np.maximum.at(group_registers, positions, ranks)
+        return [
+            cls(precision, registers)
+            for registers in group_registers.reshape(group_count, 2**precision)
+        ]
+
+    @classmethod
+    def from_bytes(cls, state):
+        return cls(state[0], np.frombuffer(state[1:], dtype=np.uint8).copy())
+
+    def to_bytes(self):
+        return bytes([self.precision]) + self.registers.tobytes()
+
+    def add(self, values):
+        """Count more values.
+
+        Parameters
+        ----------
+        values : Series
+            Values to count.
+
+        Returns
+        -------
+        HyperLogLog
+            The same count.
+
+        """
+        hashes, _ = _hash_values(values)
+        registers, ranks = self.get_registers(hashes, self.precision)
+        np.maximum.at(self.registers, registers, ranks)
+        return self
+
+    def merge(self, other):
+        """Add the values counted by another HyperLogLog.
+
+        Parameters
+        ----------
+        other : HyperLogLog
+            Count with the same precision.
+
+        Returns
+        -------
+        HyperLogLog
+            The same count.
+
+        """
+        if other.precision != self.precision:
+            raise Exception(
+                "{0} is an invalid precision, needs to be {1}".format(
+                    other.precision, self.precision
+                )
+            )
+        np.maximum(self.registers, other.registers, out=self.registers)
+        return self
+
+    def estimate(self):
+        """Estimate the number of distinct values.
+
+        Returns
+        -------
+        int
+            The estimate, exact up to a few values for small counts.
+
+        """
+        register_count = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / register_count)
+        estimate = (
+            alpha
+            * register_count**2
+            / np.sum(np.power(2.0, -self.registers.astype(np.float64)))
+        )
+        empty_registers = np.count_nonzero(self.registers == 0)
+        if estimate <= 2.5 * register_count and empty_registers:
+            # Linear counting is more accurate for small counts
+            estimate = register_count * np.log(register_count / empty_registers)
+        return int(round(estimate))
+
+
+class TDigest:
+    """Approximate quantiles that can be merged with other quantiles.
+
+    The values are summarized in about compression / 2 centroids, smaller near
+    the extremes. The rank of an estimated quantile is off by at most about
+    1 / compression of the rows (1% with the default compression), usually
+    much less and less near the extremes, the minimum and maximum are exact.
+    Merging the digests of two sets of rows gives the digest of their union.
+    Empty values are ignored.
+    """
+
+    compression = TDIGEST_COMPRESSION
+    maximum = float("nan")
+    means = None
+    minimum = float("nan")
+    weights = None
+
+    def __init__(
+        self,
+        compression=TDIGEST_COMPRESSION,
+        means=None,
+        weights=None,
+        minimum=float("nan"),
+        maximum=float("nan"),
+    ):
+        """Short summary.
+
+        Parameters
+        ----------
+        compression : int
+            Twice the number of centroids to keep, larger is more accurate.
+        means : ndarray
+            Means of the centroids of a saved state.
+        weights : ndarray
+            Number of values in each centroid of a saved state.
+        minimum : float
+            Smallest value of a saved state.
+        maximum : float
+            Largest value of a saved state.
+
+        Returns
+        -------
+        None
+
+        """
+        self.compression = compression
+        self.means = np.array([] if means is None else means, dtype=np.float64)
+        self.weights = np.array([] if weights is None else weights, dtype=np.float64)
+        self.minimum = minimum
+        self.maximum = maximum
+
+    def __repr__(self):
+        return "TDigest compression: {0}, centroids: {1}".format(
+            self.compression, len(self.means)
+        )
+
+    @classmethod
+    def from_groups(cls, values, codes, group_count, compression=TDIGEST_COMPRESSION):
+        """Summarize the values of every group.
+
+        Parameters
+        ----------
+        values : Series
+            Numeric values.
+        codes : ndarray
+            Group of each value, from 0 to group_count - 1, -1 to skip it.
+        group_count : int
+            Number of groups.
+        compression : int
+            Twice the number of centroids to keep, larger is more accurate.
+
+        Returns
+        -------
+        list
+            One TDigest per group.
+
+        """
+        values = pd.to_numeric(values).to_numpy(dtype=np.float64, na_value=np.nan)
+        codes = np.asarray(codes)
+        is_kept = (codes >= 0) & ~np.isnan(values)
+        values = values[is_kept]
+        codes = codes[is_kept]
+        order = np.lexsort((values, codes))
+        values = values[order]
+        bounds = np.searchsorted(codes[order], np.arange(group_count + 1))
+        return [
+            cls(compression)._add_sorted(values[start:end])
+            for start, end in zip(bounds[:-1], bounds[1:])
+        ]
+
+    @classmethod
+    def from_bytes(cls, state):
+        state = np.frombuffer(state, dtype=np.float64)
+        centroid_count = (len(state) - 3) // 2
+        return cls(
+            int(state[0]),
+            state[3 : 3 + centroid_count],
+            state[3 + centroid_count :],
+            state[1],
+            state[2],
+        )
+
+    def to_bytes(self):
+        return np.concatenate(
+            [[self.compression, self.minimum, self.maximum], self.means, self.weights]
+        ).tobytes()
+
+    def _compress(self, means, weights):
+        """Merge sorted centroids so each spans at most one unit of the scale.
+
+        Parameters
+        ----------
+        means : ndarray
+            Sorted means of the centroids.
+        weights : ndarray
+            Number of values in each centroid.
+
+        Returns
+        -------
+        TDigest
+            The same digest with the merged centroids.
+
+        """
+        total = weights.sum()
+        if not total:
+            self.means, self.weights = means, weights
+            return self
+        quantiles = (np.cumsum(weights) - weights / 2) / total
+        # Arcsine scale, centroids near the extremes are smaller
+        scale = self.compression / (2 * np.pi) * np.arcsin(2 * quantiles - 1)
+        buckets = np.floor(scale - scale.min()).astype(np.int64)
+        bucket_weights = np.bincount(buckets, weights)
+        is_used = bucket_weights > 0
+        self.means = (
+            np.bincount(buckets, weights * means)[is_used] / bucket_weights[is_used]
+        )
+        self.weights = bucket_weights[is_used]
+        return self
+
+    def _add_sorted(self, values):
+        if not len(values):
+            return self
+        self.minimum = np.fmin(self.minimum, values[0])
+        self.maximum = np.fmax(self.maximum, values[-1])
+        return self.merge(TDigest(self.compression, values, np.ones(len(values))))
+
+    def add(self, values):
+        """Summarize more values.
+
+        Parameters
+        ----------
+        values : Series
+            Numeric values.
+
+        Returns
+        -------
+        TDigest
+            The same digest.
+
+        """
+        values = pd.to_numeric(values).to_numpy(dtype=np.float64, na_value=np.nan)
+        return self._add_sorted(np.sort(values[~np.isnan(values)]))
+
+    def merge(self, other):
+        """Add the values summarized by another TDigest.
+
+        Parameters
+        ----------
+        other : TDigest
+            Digest to add.
+
+        Returns
+        -------
+        TDigest
+            The same digest.
+
+        """
+        self.minimum = np.fmin(self.minimum, other.minimum)
+        self.maximum = np.fmax(self.maximum, other.maximum)
+        means = np.concatenate([self.means, other.means])
+        weights = np.concatenate([self.weights, other.weights])
+        order = np.argsort(means, kind="stable")
+        return self._compress(means[order], weights[order])
+
+    def quantile(self, quantile):
+        """Estimate a quantile of the values.
+
+        Parameters
+        ----------
+        quantile : float
+            Between 0 and 1.
+
+        Returns
+        -------
+        float
+            The estimate, NaN if there are no values.
+
+        """
+        total = self.weights.sum()
+        if not total:
+            return np.nan
+        centers = np.cumsum(self.weights) - self.weights / 2
+        ranks = np.concatenate([[0], centers, [total]])
+        means = np.concatenate([[self.minimum], self.means, [self.maximum]])
+        return float(np.interp(quantile * total, ranks, means))
+
+
+class BloomFilter:
+    """Set of hashes that answers membership with some false positives.
+
+    With `capacity` hashes added at most `error_rate` of the hashes that were
+    not added are reported as present, hashes that were added always are. It
+    takes about 1.2 * capacity * log2(1 / error_rate) bits.
+    """
+
+    bits = None
+    hash_count = 1
+
+    def __init__(self, capacity, error_rate=BLOOM_FILTER_ERROR_RATE):
+        """Short summary.
+
+        Parameters
+        ----------
+        capacity : int
+            Number of hashes the error rate is sized for.
+        error_rate : float
+            Fraction of false positives, between 0 and 1.
+
+        Returns
+        -------
+        None
+
+        """
+        capacity = max(capacity, 1)
+        bit_count = int(np.ceil(-capacity * np.log(error_rate) / np.log(2) ** 2))
+        self.bit_count = max(bit_count, 8)
+        self.hash_count = max(int(round(self.bit_count / capacity * np.log(2))), 1)
+        self.bits = np.zeros((self.bit_count + 7) // 8, dtype=np.uint8)
+
+    def __repr__(self):
+        return "BloomFilter bits: {0}, hashes: {1}".format(
+            self.bit_count, self.hash_count
+        )
+
+    def _get_positions(self, hashes):
+        # Double hashing, the two halves of the hash give every position
+        low = hashes & np.uint64(0xFFFFFFFF)
+        high = hashes >> np.uint64(32)
+        steps = np.arange(self.hash_count, dtype=np.uint64)
+        positions = low[:, None] + steps[None, :] * high[:, None]
+        return positions % np.uint64(self.bit_count)
+
+    def add(self, hashes):
+        """Add uint64 hashes.
+
+        Parameters
+        ----------
+        hashes : ndarray
+            uint64 hashes, e.g. from pd.util.hash_pandas_object.
+
+        Returns
+        -------
+        BloomFilter
+            The same filter.
+
+        """
+        hashes = np.asarray(hashes, dtype=np.uint64)
+        is_set = np.zeros(len(self.bits) * 8, dtype=bool)
+        for start in range(0, len(hashes), BLOOM_FILTER_CHUNK_SIZE):
+            positions = self._get_positions(
+                hashes[start : start + BLOOM_FILTER_CHUNK_SIZE]
+            )
+            is_set[positions.ravel().astype(np.int64)] = True
+        self.bits |= np.packbits(is_set, bitorder="little")
+        return self
+
+    def contains(self, hashes):
+        """Check which hashes may have been added.
+
+        Parameters
+        ----------
+        hashes : ndarray
+            uint64 hashes.
+
+        Returns
+        -------
+        ndarray
+            False for the hashes that were surely not added.
+
+        """
+        hashes = np.asarray(hashes, dtype=np.uint64)
+        is_present = np.empty(len(hashes), dtype=bool)
+        for start in range(0, len(hashes), BLOOM_FILTER_CHUNK_SIZE):
+            end = start + BLOOM_FILTER_CHUNK_SIZE
+            positions = self._get_positions(hashes[start:end]).astype(np.int64)
+            is_set = self.bits[positions >> 3] >> (positions & 7).astype(np.uint8)
+            is_present[start:end] = (is_set & 1).all(axis=1)
+        return is_present
+
+
+def is_approximate_function(group_function):
+    """Check if a group function is computed from a mergeable sketch.
+
+    Parameters
+    ----------
+    group_function : str or callable
+        Group function of a PivotTable.
+
+    Returns
+    -------
+    bool
+        True for approx count distinct, approx median and approx pNN (e.g.
+        approx p95).
+
+    """
+    return isinstance(group_function, str) and (
+        group_function in ("approx count distinct", "approx median")
+        or APPROXIMATE_QUANTILE.match(group_function) is not None
+    )
+
+
+def _get_quantile(group_function):
+    if group_function == "approx median":
+        return 0.5
+    return float(APPROXIMATE_QUANTILE.match(group_function).group(1)) / 100
+
+
+def build_states(group_function, values, codes, group_count):
+    """Build the state of an approximate function for every group.
+
+    Parameters
+    ----------
+    group_function : str
+        Approximate function, see `is_approximate_function`.
+    values : Series
+        Values of the column.
+    codes : ndarray
+        Group of each value, from 0 to group_count - 1, -1 to skip it.
+    group_count : int
+        Number of groups.
+
+    Returns
+    -------
+    list
+        The serialized sketch of each group.
+
+    """
+    codes = np.asarray(codes)
+    if group_function == "approx count distinct":
+        sketches = HyperLogLog.from_groups(values, codes, group_count)
+    else:
+        sketches = TDigest.from_groups(values, codes, group_count)
+    return [sketch.to_bytes() for sketch in sketches]
+
+
+def merge_states(group_function, states):
+    """Merge the states of an approximate function for the same group.
+
+    Parameters
+    ----------
+    group_function : str
+        Approximate function, see `is_approximate_function`.
+    states : Series
+        States built by `build_states` over different rows, oldest first.
+
+    Returns
+    -------
+    bytes
+        The state of all the rows.
+
+    """
+    states = list(states)
+    sketch_class = HyperLogLog
+    if group_function != "approx count distinct":
+        sketch_class = TDigest
+    sketch = sketch_class.from_bytes(states[0])
+    for state in states[1:]:
+        sketch.merge(sketch_class.from_bytes(state))
+    return sketch.to_bytes()
+
+
+def finalize_states(group_function, states):
+    """Get the result of an approximate function from its states.
+
+    Parameters
+    ----------
+    group_function : str
+        Approximate function, see `is_approximate_function`.
+    states : Series
+        States built by `build_states` or `merge_states`.
+
+    Returns
+    -------
+    Series
+        The distinct counts or quantiles.
+
+    """
+    if group_function == "approx count distinct":
+        return states.map(lambda state: HyperLogLog.from_bytes(state).estimate())
+    quantile = _get_quantile(group_function)
+    return states.map(lambda state: TDigest.from_bytes(state).quantile(quantile))
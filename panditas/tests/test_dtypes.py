@@ -0,0 +1,34 @@
+import numpy as np
+import pandas as pd
+
+from panditas.dtypes import get_memory_usage, optimize_dtypes
+
+
+def test_optimize_dtypes():
+    df = pd.DataFrame(
+        {
+            "agencyName": ["Test Agency", "Other Agency"] * 500,
+            "claimId": ["Claim{0}".format(key) for key in range(1000)],
+            "claimCount": np.tile([0, 1], 500),
+            "newCount": np.tile([1.0, 0.0], 500),
+            "lossReserveBalance": np.tile([1000.5, np.nan], 500),
+            "policyInforcePremium": np.tile([1000.1, 20.3], 500),
+            "policyChangeWrittenPremium": np.tile([-200, 70000], 500),
+        }
+    )
+    optimized_df = optimize_dtypes(df)
+    assert str(optimized_df["agencyName"].dtype) == "category"
+    assert str(optimized_df["claimId"].dtype) == "object"
+    assert str(optimized_df["claimCount"].dtype) == "int8"
+    # Whole floats stay floats
+    assert str(optimized_df["newCount"].dtype) == "float32"
+    assert str(optimized_df["lossReserveBalance"].dtype) == "float32"
+    # float32 would change these values so they are kept
+    assert str(optimized_df["policyInforcePremium"].dtype) == "float64"
+    assert str(optimized_df["policyChangeWrittenPremium"].dtype) == "int32"
+    assert get_memory_usage(optimized_df) < get_memory_usage(df)
+    pd.testing.assert_frame_equal(
+        optimized_df.astype({"agencyName": object}),
+        df,
+        check_dtype=False,
+    )
@@ -0,0 +1,79 @@
+import subprocess
+import sys
+
+# Importing them takes several hundreds of milliseconds, the rest of the
+# package a few tens
+HEAVY_MODULES = ("numexpr", "numpy", "pandas", "pyarrow")
+
+IMPORT_PACKAGE = """
+import panditas
+import panditas.models
+import panditas.optimizer
+import panditas.server
+import panditas.transformation_rules
+"""
+BUILD_DATA_FLOW = """
+import pickle
+
+from panditas.models import DataFlow, DataSet, MergeRule
+from panditas.transformation_rules import (
+    CalculatedColumn,
+    ConditionalFill,
+    FilterBy,
+    PivotTable,
+)
+
+data_flow = DataFlow(
+    name="Agency Premium",
+    optimize=True,
+    steps=[
+        DataSet(df_path="policies.csv", name="policies", source="csv"),
+        FilterBy(
+            column_name="policyStatus",
+            filter_conditions=["=="],
+            condition_values=["Active"],
+        ),
+        DataSet(df_path="agencies.csv", name="agencies", source="csv"),
+        MergeRule(
+            left_data_set="policies",
+            right_data_set="agencies",
+            merge_columns=["agencyId"],
+        ),
+        ConditionalFill(
+            fill_column="newCount",
+            fill_value=1,
+            where_column="policyChangeTransactionType",
+            where_condition="==",
+            where_condition_values=["New"],
+        ),
+        CalculatedColumn(base_column="premium", expression=[("sum", "fees")]),
+        PivotTable(
+            group_columns=["agencyName"],
+            group_functions=["sum"],
+            group_values=["premium"],
+        ),
+    ],
+)
+pickle.loads(pickle.dumps(data_flow))
+"""
+
+
+def get_heavy_modules(code):
+    # A new interpreter, the tests already imported everything
+    code += "\nimport sys\nprint(','.join(sys.modules))\n"
+    output = subprocess.run(
+        [sys.executable, "-W", "ignore", "-c", code],
+        check=True,
+        stdout=subprocess.PIPE,
+        universal_newlines=True,
+    ).stdout
+    modules = set(name.split(".")[0] for name in output.strip().split(","))
+    return [module for module in HEAVY_MODULES if module in modules]
+
+
+def test_import_does_not_import_heavy_modules():
+    assert get_heavy_modules(IMPORT_PACKAGE) == []
+
+
+def test_data_flow_construction_does_not_import_heavy_modules():
+    assert get_heavy_modules(BUILD_DATA_FLOW) == []
@@ -1,5 +1,18 @@
+import os
+import shutil
+import sqlite3
+
+import pandas as pd
+import pytest
+
+from panditas import models
 from panditas.models import DataFlow, DataSet, MergeMultipleRule, MergeRule
-from panditas.transformation_rules import ConstantColumn
+from panditas.transformation_rules import (
+    CalculatedColumn,
+    ConstantColumn,
+    FilterBy,
+    SortValuesBy,
+)
 
 
 def test_data_set_dependencies():
@@ -22,6 +35,381 @@ def test_data_set_get_columns():
     pass
 
 
+def test_data_set_cache(monkeypatch, tmp_path):
+    csv_path = tmp_path / "claims.csv"
+    csv_path.write_text("claimId,claimStatus,lossPaid\nClaim1,Open,10\n")
+    cache_dir = tmp_path / "cache"
+    data_set = DataSet(
+        cache_dir=str(cache_dir),
+        columns=["claimStatus", "claimId"],
+        df_path=str(csv_path),
+        name="cached_claims",
+        source="csv",
+    )
+    data_set.run()
+    assert len(os.listdir(str(cache_dir))) == 1
+
+    # Second run must be served from the cache without parsing the CSV
+    def fail_read_csv(*args, **kwargs):
+        raise AssertionError("CSV should not be parsed on a cache hit")
+
+    monkeypatch.setattr(pd, "read_csv", fail_read_csv)
+    data_set.run()
+    df = DataFlow.get_output_df("cached_claims")
+    assert df.columns.tolist() == ["claimStatus", "claimId"]
+    monkeypatch.undo()
+
+    # Changing the source invalidates the cache and removes the stale file
+    csv_path.write_text(
+        "claimId,claimStatus,lossPaid\nClaim1,Open,10\nClaim2,Closed,20\n"
+    )
+    data_set.run()
+    df = DataFlow.get_output_df("cached_claims")
+    assert df["claimId"].tolist() == ["Claim1", "Claim2"]
+    assert len(os.listdir(str(cache_dir))) == 1
+
+
+def test_data_set_cache_projections(monkeypatch, tmp_path):
+    csv_path = tmp_path / "claims.csv"
+    csv_path.write_text("claimId,claimStatus,lossPaid\nClaim1,Open,10\n")
+    cache_dir = tmp_path / "cache"
+    data_sets = [
+        DataSet(
+            cache_dir=str(cache_dir),
+            columns=columns,
+            df_path=str(csv_path),
+            name="cached_claims_{0}".format(key),
+            source="csv",
+        )
+        for key, columns in enumerate([["claimId"], ["claimId", "lossPaid"]])
+    ]
+    read_count = [0]
+    read_csv = pd.read_csv
+
+    def counting_read_csv(*args, **kwargs):
+        read_count[0] += 1
+        return read_csv(*args, **kwargs)
+
+    monkeypatch.setattr(pd, "read_csv", counting_read_csv)
+    # Projections of the same version of the file do not evict each other
+    for _ in range(3):
+        for data_set in data_sets:
+            data_set.run()
+    assert read_count[0] == 2
+    assert len(os.listdir(str(cache_dir))) == 2
+
+    csv_path.write_text("claimId,claimStatus,lossPaid\nClaim1,Open,10\nClaim2,X,5\n")
+    data_sets[0].run()
+    assert read_count[0] == 3
+    assert len(os.listdir(str(cache_dir))) == 1
+
+
+def test_data_set_arrow_reader(tmp_path):
+    csv_path = tmp_path / "claims.csv"
+    csv_path.write_text(
+        "claimId,claimStatus,lossPaid,lossDate\n"
+        "Claim1,Open,10,2019-01-02\n"
+        "Claim2,Closed,20.5,2019-02-03\n"
+        "Claim3,Open,,2019-03-04\n"
+    )
+    DataSet(
+        columns=["claimId", "claimStatus", "lossPaid", "lossDate"],
+        data_types={"lossPaid": "float32", "claimId": "str"},
+        df_path=str(csv_path),
+        name="arrow_claims",
+        reader="arrow",
+        source="csv",
+    ).run()
+    df = DataFlow.get_output_df("arrow_claims")
+    assert str(df["claimStatus"].dtype) == "category"
+    assert str(df["lossPaid"].dtype) == "float32"
+    assert str(df["lossDate"].dtype).startswith("datetime64")
+    assert df["claimStatus"].astype(str).tolist() == ["Open", "Closed", "Open"]
+
+    DataSet(
+        data_types={"lossPaid": "float32", "lossDate": "datetime64[ns]"},
+        df_path=str(csv_path),
+        name="pandas_claims",
+        source="csv",
+    ).run()
+    pandas_df = DataFlow.get_output_df("pandas_claims")
+    assert str(pandas_df["lossPaid"].dtype) == "float32"
+    assert pandas_df["lossDate"].tolist() == df["lossDate"].tolist()
+
+
+def test_data_set_multiple_files(monkeypatch, tmp_path):
+    for day, amount in [("2026-10-01", 10), ("2026-10-02", 20), ("2026-10-03", 30)]:
+        partition_path = tmp_path / "claims" / "dt={0}".format(day)
+        partition_path.mkdir(parents=True)
+        (partition_path / "part-0.csv").write_text(
+            "claimId,lossPaid\nClaim{0},{0}\n".format(amount)
+        )
+    read_paths = []
+    read_csv = pd.read_csv
+
+    def counting_read_csv(path, *args, **kwargs):
+        read_paths.append(path)
+        return read_csv(path, *args, **kwargs)
+
+    monkeypatch.setattr(pd, "read_csv", counting_read_csv)
+
+    DataSet(
+        columns=["dt", "lossPaid"],
+        df_path=str(tmp_path / "claims"),
+        name="claims_directory",
+        source="csv",
+    ).run()
+    df = DataFlow.get_output_df("claims_directory")
+    assert df.columns.tolist() == ["dt", "lossPaid"]
+    assert df["lossPaid"].tolist() == [10, 20, 30]
+    assert len(read_paths) == 3
+
+    DataSet(
+        df_path=str(tmp_path / "claims" / "*" / "*.csv"),
+        name="claims_glob",
+        source="csv",
+    ).run()
+    assert len(DataFlow.get_output_df("claims_glob")) == 3
+
+    # Filters right after the Data Set prune the partitions that can not match
+    del read_paths[:]
+    data_flow = DataFlow(
+        name="Test Partition Pruning",
+        steps=[
+            DataSet(
+                df_path=str(tmp_path / "claims"), name="claims_pruned", source="csv"
+            ),
+            FilterBy(
+                column_name="dt",
+                filter_conditions=[">="],
+                condition_values=["2026-10-02"],
+            ),
+        ],
+    )
+    data_flow.run()
+    df = DataFlow.get_output_df(data_flow.output_data_set)
+    assert df["claimId"].tolist() == ["Claim20", "Claim30"]
+    assert len(read_paths) == 2
+
+
+def test_data_set_sql(tmp_path):
+    db_path = str(tmp_path / "claims.db")
+    connection = sqlite3.connect(db_path)
+    connection.execute(
+        "CREATE TABLE claims (claimId TEXT, claimStatus TEXT, lossPaid REAL)"
+    )
+    connection.executemany(
+        "INSERT INTO claims VALUES (?, ?, ?)",
+        [
+            ("Claim1", "Open", 10),
+            ("Claim2", "Closed", 20),
+            ("Claim3", "Open", 30),
+            ("Claim4", None, 40),
+            ("Claim5", "Reopened", 50),
+        ],
+    )
+    connection.commit()
+    connection.close()
+
+    data_set = DataSet(
+        chunk_size=2,
+        columns=["claimId", "lossPaid"],
+        db_name=db_path,
+        db_provider="sqlite",
+        filters=[
+            FilterBy(
+                column_name="claimStatus",
+                filter_conditions=["does not start with"],
+                condition_values=["Closed"],
+            ),
+            FilterBy(
+                column_name="lossPaid", filter_conditions=[">"], condition_values=[10]
+            ),
+        ],
+        name="sql_claims",
+        source="sql",
+        table_name="claims",
+    )
+    query = str(data_set._build_sql_query())
+    assert query.startswith("SELECT \"claimId\", \"lossPaid\"")
+    assert "WHERE" in query
+    data_set.run()
+    df = DataFlow.get_output_df("sql_claims")
+    assert df.columns.tolist() == ["claimId", "lossPaid"]
+    assert df["claimId"].tolist() == ["Claim3", "Claim4", "Claim5"]
+
+    query_data_set = DataSet(
+        db_name=db_path,
+        db_provider="sqlite",
+        name="sql_query_claims",
+        source="sql",
+        sql_query="SELECT claimId, lossPaid * 2 AS doublePaid FROM claims",
+    )
+    query_data_set.run()
+    df = DataFlow.get_output_df("sql_query_claims")
+    assert df["doublePaid"].tolist() == [20, 40, 60, 80, 100]
+    # Data Sets on the same database share the engine and its pool
+    assert query_data_set._get_sql_engine() is data_set._get_sql_engine()
+
+
+def test_data_set_sql_column_filter(tmp_path):
+    db_path = str(tmp_path / "reserves.db")
+    connection = sqlite3.connect(db_path)
+    connection.execute("CREATE TABLE claims (claimId TEXT, paid REAL, reserve REAL)")
+    connection.executemany(
+        "INSERT INTO claims VALUES (?, ?, ?)",
+        [("Claim1", 10, 5), ("Claim2", 20, 30), ("Claim3", 30, 25)],
+    )
+    connection.commit()
+    connection.close()
+
+    # Without columns the table is reflected to compare against the column
+    data_set = DataSet(
+        db_name=db_path,
+        db_provider="sqlite",
+        filters=[
+            FilterBy(
+                column_name="paid",
+                filter_conditions=[">"],
+                condition_values=["reserve"],
+            )
+        ],
+        name="sql_paid_claims",
+        source="sql",
+        table_name="claims",
+    )
+    data_set.run()
+    df = DataFlow.get_output_df("sql_paid_claims")
+    assert df["claimId"].tolist() == ["Claim1", "Claim3"]
+
+
+def test_data_set_excel(monkeypatch, tmp_path):
+    openpyxl = pytest.importorskip("openpyxl")
+    workbook = openpyxl.Workbook()
+    workbook.active.title = "Summary"
+    sheet = workbook.create_sheet("Agencies")
+    sheet.append(["agencyNumber", "agencyName", "revisionId"])
+    sheet.append([1, "Test Agency", "Revision1"])
+    sheet.append([2, "Other Agency", "Revision2"])
+    excel_path = str(tmp_path / "agencies.xlsx")
+    workbook.save(excel_path)
+
+    data_set = DataSet(
+        cache_dir=str(tmp_path / "cache"),
+        columns=["revisionId", "agencyName"],
+        df_path=excel_path,
+        name="excel_agencies",
+        sheet_name="Agencies",
+        source="excel",
+    )
+    data_set.run()
+    df = DataFlow.get_output_df("excel_agencies")
+    assert df.columns.tolist() == ["revisionId", "agencyName"]
+    assert df["agencyName"].tolist() == ["Test Agency", "Other Agency"]
+
+    # Repeated runs are served from the cache keyed by the workbook hash
+    def fail_load_workbook(*args, **kwargs):
+        raise AssertionError("Workbook should not be parsed on a cache hit")
+
+    monkeypatch.setattr(openpyxl, "load_workbook", fail_load_workbook)
+    data_set.run()
+    assert DataFlow.get_output_df("excel_agencies").equals(df)
+
+
+def test_data_set_incremental(tmp_path):
+    csv_path = tmp_path / "claims.csv"
+    rows = [
+        "revisionId,claimId,lossPaid,lossReserve",
+        "1,Claim3,10,1",
+        "2,Claim1,20,2",
+        "3,Claim2,30,3",
+        "4,Claim5,40,4",
+        "5,Claim4,50,5",
+    ]
+    for name in ["incremental_claims", "incurred", "paid_claims"]:
+        shutil.rmtree(DataFlow.get_history_path(name), ignore_errors=True)
+    for run_rows in [3, 6]:
+        csv_path.write_text("\n".join(rows[:run_rows]) + "\n")
+        data_flow = DataFlow(
+            name="Test Incremental Data Set",
+            steps=[
+                DataSet(
+                    df_path=str(csv_path),
+                    incremental_column="revisionId",
+                    name="incremental_claims",
+                    source="csv",
+                ),
+                CalculatedColumn(
+                    base_column="lossPaid", expression=[("sum", "lossReserve")]
+                ),
+                FilterBy(
+                    column_name="lossPaid",
+                    filter_conditions=[">"],
+                    condition_values=[11],
+                ),
+                SortValuesBy(sort_columns=["claimId"], sort_ascending=True),
+            ],
+        )
+        data_flow.steps[1].name = "incurred"
+        data_flow.steps[2].name = "paid_claims"
+        data_flow.run()
+    # The second run only reads and processes the new rows
+    df = DataFlow.get_output_df("incremental_claims")
+    assert df["revisionId"].tolist() == [3, 4, 5]
+    df = DataFlow.get_output_df("incurred")
+    assert df["lossPaid"].tolist() == [33, 44, 55]
+    history_df = DataFlow.get_history_df("incurred")
+    assert history_df["revisionId"].tolist() == [1, 2, 3, 4, 5]
+    assert history_df["lossPaid"].tolist() == [11, 22, 33, 44, 55]
+    assert len(DataFlow.get_history_parts("paid_claims")) == 2
+    # Steps that are not row local see all the rows
+    df = DataFlow.get_output_df(data_flow.output_data_set)
+    assert df["claimId"].tolist() == ["Claim1", "Claim2", "Claim4", "Claim5"]
+
+
+def test_data_flow_run_all(monkeypatch, tmp_path):
+    csv_path = tmp_path / "policies.csv"
+    csv_path.write_text("policyId,agencyName\nPolicy1,Agency1\nPolicy2,Agency2\n")
+    reads = []
+    read_files = DataSet._read_files
+
+    def count_reads(data_set):
+        reads.append(data_set.name)
+        return read_files(data_set)
+
+    monkeypatch.setattr(DataSet, "_read_files", count_reads)
+    data_flows = [
+        DataFlow(
+            name="Test Shared {0}".format(number),
+            steps=[
+                DataSet(
+                    df_path=str(csv_path),
+                    name="shared_policies_{0}".format(number),
+                    source="csv",
+                ),
+                ConstantColumn(
+                    column_name="lineOfBusiness",
+                    column_value=value,
+                    name="shared_line_{0}".format(number),
+                ),
+            ],
+        )
+        for number, value in enumerate(["Auto", "Auto", "Home"])
+    ]
+    outputs = DataFlow.run_all(data_flows)
+    assert outputs == ["shared_line_0", "shared_line_1", "shared_line_2"]
+    # The Data Set is read once, the constant column runs once per value
+    assert reads == ["shared_policies_0"]
+    for output, value in zip(outputs, ["Auto", "Auto", "Home"]):
+        df = DataFlow.get_output_df(output)
+        assert df["lineOfBusiness"].tolist() == [value, value]
+        assert df["policyId"].tolist() == ["Policy1", "Policy2"]
+    fingerprints = [
+        data_flow.steps[1].get_fingerprint(["policies"]) for data_flow in data_flows
+    ]
+    assert fingerprints[0] == fingerprints[1] != fingerprints[2]
+
+
 def test_data_set_dependencies_manual():
     data_flow = DataFlow(
         name="Test Data Sets",
@@ -106,3 +494,112 @@ def test_dependencies_merge_multiple():
     assert data_flow.steps[1].depends_on == []
     assert data_flow.steps[2].depends_on == []
     assert data_flow.steps[3].depends_on == ["claims", "policies", "agencies"]
+
+
+@pytest.mark.parametrize("merge_type", ["inner", "left", "right", "outer"])
+def test_merge_rule_merge_join(merge_type):
+    policies = pd.DataFrame(
+        {
+            "policyId": ["Policy1", "Policy2", "Policy2", "Policy4"],
+            "premium": [1, 2, 3, 4],
+        }
+    )
+    claims = pd.DataFrame(
+        {
+            "policyId": ["Policy2", "Policy2", "Policy3", "Policy4"],
+            "premium": [5, 6, 7, 8],
+        }
+    )
+    sort_keys = {"sort_keys": [["policyId", True]]}
+    DataFlow.save_output_df(policies, "merge_join_policies", metadata=sort_keys)
+    DataFlow.save_output_df(claims, "merge_join_claims", metadata=sort_keys)
+    merge_rule = MergeRule(
+        left_data_set="merge_join_policies",
+        right_data_set="merge_join_claims",
+        merge_type=merge_type,
+        merge_columns=["policyId"],
+        name="merge_join_output",
+    )
+    merge_rule.run()
+    pd.testing.assert_frame_equal(
+        DataFlow.get_output_df("merge_join_output"),
+        pd.merge(policies, claims, how=merge_type, on=["policyId"]),
+    )
+    assert DataFlow.get_output_metadata("merge_join_output")["sort_keys"] == [
+        ["policyId", True]
+    ]
+
+
+@pytest.mark.parametrize("merge_type", ["inner", "left"])
+@pytest.mark.parametrize("exact_max_keys", [100000, 0])
+@pytest.mark.parametrize("agency_type", [object, "category"])
+def test_merge_rule_semi_join(monkeypatch, merge_type, exact_max_keys, agency_type):
+    monkeypatch.setattr(models, "SEMI_JOIN_EXACT_MAX_KEYS", exact_max_keys)
+    claims = pd.DataFrame(
+        {
+            "agencyName": pd.Series(["Agency3", "Agency1", None], dtype=agency_type),
+            "lossPaid": [10, 20, 30],
+        }
+    )
+    agencies = pd.DataFrame(
+        {
+            "agencyName": ["Agency{0}".format(number) for number in range(50)] + [None],
+            "state": ["CA", "NY"] * 25 + ["TX"],
+        }
+    )
+    DataFlow.save_output_df(claims, "semi_join_claims")
+    DataFlow.save_output_df(agencies, "semi_join_agencies")
+    for left_data_set, right_data_set in [
+        ("semi_join_claims", "semi_join_agencies"),
+        ("semi_join_agencies", "semi_join_claims"),
+    ]:
+        merge_rule = MergeRule(
+            left_data_set=left_data_set,
+            right_data_set=right_data_set,
+            merge_type=merge_type,
+            merge_columns="agencyName",
+            name="semi_join_output",
+        )
+        merge_rule.run()
+        expected = pd.merge(
+            DataFlow.get_output_df(left_data_set),
+            DataFlow.get_output_df(right_data_set),
+            how=merge_type,
+            on="agencyName",
+        )
+        df = DataFlow.get_output_df("semi_join_output")
+        assert df.dtypes.tolist() == expected.dtypes.tolist()
+        # Empty values come back from parquet as None or NaN
+        pd.testing.assert_frame_equal(
+            df.astype(object).where(df.notna(), None),
+            expected.astype(object).where(expected.notna(), None),
+        )
+    claims_df = DataFlow.get_output_df("semi_join_claims")
+    right_df = models.read_semi_joined(
+        "semi_join_agencies", ["agencyName"], claims_df, ["agencyName"]
+    )
+    assert set(right_df["agencyName"].dropna()) >= {"Agency1", "Agency3"}
+    assert len(right_df) < len(agencies)
+
+
+def test_merge_multiple_rule_run():
+    pd.DataFrame({"claimId": ["Claim1", "Claim2"], "policyId": [1, 3]}).pipe(
+        DataFlow.save_output_df, "multiple_claims"
+    )
+    pd.DataFrame({"policyId": list(range(100)), "agencyId": [1, 2] * 50}).pipe(
+        DataFlow.save_output_df, "multiple_policies"
+    )
+    merge_rule = MergeMultipleRule(
+        data_sets=["multiple_claims", "multiple_policies"],
+        merge_types=["left"],
+        name="multiple_output",
+    )
+    for _ in range(2):
+        merge_rule.run()
+        df = DataFlow.get_output_df("multiple_output")
+        assert df.to_dict("list") == {
+            "claimId": ["Claim1", "Claim2"],
+            "policyId": [1, 3],
+            "agencyId": [2, 2],
+        }
+    assert merge_rule.data_sets == ["multiple_claims", "multiple_policies"]
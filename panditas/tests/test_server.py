@@ -0,0 +1,119 @@
+import os
+import tempfile
+import threading
+
+import pandas as pd
+import pytest
+
+from panditas.models import DataFlow, DataSet
+from panditas.server import DataSetCache, WarmWorker, register, submit
+from panditas.transformation_rules import FilterBy
+
+
+def test_data_set_cache(monkeypatch):
+    clock = [0.0]
+    monkeypatch.setattr("panditas.server.time.monotonic", lambda: clock[0])
+    cache = DataSetCache(max_items=3, ttl=10)
+    cache.set(("claims", "v1", "id"), pd.DataFrame({"claimId": ["Claim1"]}))
+    cache.set(("policies", "v1", "id"), pd.DataFrame({"policyId": ["Policy1"]}))
+    # Other columns of the same version are kept
+    cache.set(("claims", "v1", "all"), pd.DataFrame({"claimId": ["Claim1"]}))
+    assert cache.get(("claims", "v1", "id")) is not None
+    # Least recently used is evicted
+    cache.set(("agencies", "v1", "id"), pd.DataFrame({"agencyId": ["Agency1"]}))
+    assert cache.get(("policies", "v1", "id")) is None
+    # A new version replaces the previous ones
+    cache.set(("claims", "v2", "id"), pd.DataFrame({"claimId": ["Claim2"]}))
+    assert cache.get(("claims", "v1", "id")) is None
+    assert cache.get(("claims", "v1", "all")) is None
+    assert len(cache) == 2
+    clock[0] = 10
+    assert cache.get(("claims", "v2", "id")) is None
+
+    cache = DataSetCache(max_bytes=1)
+    cache.set(("claims", "v1", "id"), pd.DataFrame({"claimId": ["Claim1"]}))
+    cache.set(("policies", "v1", "id"), pd.DataFrame({"policyId": ["Policy1"]}))
+    assert len(cache) == 1
+
+
+@pytest.fixture
+def worker():
+    socket_dir = tempfile.mkdtemp()
+    warm_worker = WarmWorker(os.path.join(socket_dir, "panditas.sock"))
+    thread = threading.Thread(target=warm_worker.serve_forever)
+    thread.start()
+    yield warm_worker
+    warm_worker.shutdown()
+    thread.join()
+    warm_worker.server_close()
+    os.rmdir(socket_dir)
+    assert DataSet.memory_cache is None
+
+
+def test_warm_worker(monkeypatch, tmp_path, worker):
+    csv_path = tmp_path / "claims.csv"
+    csv_path.write_text("claimId,claimStatus\nClaim1,Open\nClaim2,Closed\n")
+    read_count = [0]
+    read_csv = pd.read_csv
+
+    def counting_read_csv(*args, **kwargs):
+        read_count[0] += 1
+        return read_csv(*args, **kwargs)
+
+    monkeypatch.setattr(pd, "read_csv", counting_read_csv)
+    data_set = DataSet(df_path=str(csv_path), name="warm_claims", source="csv")
+    assert os.stat(worker.socket_path).st_mode & 0o777 == 0o600
+    assert register(data_set, worker.socket_path) == 1
+    # Another projection of the file does not evict the first one
+    projection = DataSet(
+        columns=["claimId"], df_path=str(csv_path), name="warm_ids", source="csv"
+    )
+    assert register(projection, worker.socket_path) == 2
+    assert register(data_set, worker.socket_path) == 2
+    assert read_count[0] == 2
+
+    def get_data_flow():
+        return DataFlow(
+            name="Open Claims",
+            steps=[
+                DataSet(df_path=str(csv_path), name="warm_claims", source="csv"),
+                FilterBy(
+                    column_name="claimStatus",
+                    filter_conditions=["=="],
+                    condition_values=["Open"],
+                ),
+            ],
+        )
+
+    for _ in range(2):
+        data_flow = get_data_flow()
+        output = submit(data_flow, worker.socket_path)
+        assert output == "FilterBy_1"
+        assert data_flow.steps[1].output_data_set == "FilterBy_1"
+        df = DataFlow.get_output_df(output)
+        assert df["claimId"].tolist() == ["Claim1"]
+    assert read_count[0] == 2
+
+    # Changing the source invalidates the file kept in memory
+    csv_path.write_text("claimId,claimStatus\nClaim1,Open\nClaim3,Open\nClaim4,X\n")
+    output = submit(get_data_flow(), worker.socket_path)
+    assert DataFlow.get_output_df(output)["claimId"].tolist() == ["Claim1", "Claim3"]
+    assert read_count[0] == 3
+
+    with pytest.raises(Exception, match="invalid source"):
+        submit(
+            DataFlow(steps=[DataSet(df_path=str(csv_path), source="json")]),
+            worker.socket_path,
+        )
+
+    # SQL sources are never kept in memory
+    with pytest.raises(Exception, match="invalid source to register"):
+        register(
+            DataSet(
+                db_name=str(tmp_path / "claims.db"),
+                db_provider="sqlite",
+                source="sql",
+                table_name="claims",
+            ),
+            worker.socket_path,
+        )
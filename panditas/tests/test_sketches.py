@@ -0,0 +1,84 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from panditas.sketches import (
+    HyperLogLog,
+    TDigest,
+    build_states,
+    finalize_states,
+    is_approximate_function,
+    merge_states,
+)
+
+
+@pytest.mark.parametrize("distinct_count", [0, 10, 1000, 100000])
+def test_hyperloglog(distinct_count):
+    values = pd.Series(np.arange(distinct_count * 2) % max(distinct_count, 1))
+    values = values.astype(str).where(values % 7 != 3)
+    expected = values.nunique()
+    hyperloglog = HyperLogLog().add(values)
+    # Five standard errors
+    assert abs(hyperloglog.estimate() - expected) <= 5 * 0.0163 * expected
+    state = HyperLogLog.from_bytes(hyperloglog.to_bytes())
+    assert state.estimate() == hyperloglog.estimate()
+
+
+def test_hyperloglog_merge():
+    values = pd.Series(["Policy{0}".format(number) for number in range(5000)])
+    merged = HyperLogLog().add(values[:3000]).merge(HyperLogLog().add(values[2000:]))
+    assert merged.estimate() == HyperLogLog().add(values).estimate()
+    # Categoricals hash like strings
+    categorical = HyperLogLog().add(values.astype("category"))
+    assert categorical.estimate() == merged.estimate()
+    with pytest.raises(Exception):
+        merged.merge(HyperLogLog(precision=10))
+
+
+def test_hyperloglog_merge_dtypes():
+    values = np.arange(-2000, 2000)
+    expected = HyperLogLog().add(pd.Series(values)).estimate()
+    # Equal numbers count once whatever the dtype of their column
+    merged = HyperLogLog().add(pd.Series(values[:2100]).astype(np.int16))
+    merged.merge(HyperLogLog().add(pd.Series(values[1900:]).astype(np.float64)))
+    merged.merge(HyperLogLog().add(pd.Series(values).astype("category")))
+    merged.merge(HyperLogLog().add(pd.Series(values).astype("Int64")))
+    assert merged.estimate() == expected
+    fractions = pd.Series(values + 0.5)
+    merged.merge(HyperLogLog().add(fractions.astype(np.float32)))
+    assert (
+        merged.estimate()
+        == HyperLogLog().add(pd.Series(values)).add(fractions).estimate()
+    )
+
+
+def test_tdigest():
+    values = np.random.default_rng(1).lognormal(size=50000)
+    digest = TDigest().add(pd.Series(values))
+    assert len(digest.means) <= 100
+    for quantile in [0.01, 0.25, 0.5, 0.75, 0.99]:
+        estimate = digest.quantile(quantile)
+        assert abs((values < estimate).mean() - quantile) <= 0.01
+    assert digest.quantile(0) == values.min()
+    assert digest.quantile(1) == values.max()
+    merged = TDigest()
+    for part in np.array_split(values, 5):
+        merged.merge(TDigest.from_bytes(TDigest().add(pd.Series(part)).to_bytes()))
+    assert abs((values < merged.quantile(0.5)).mean() - 0.5) <= 0.01
+    assert np.isnan(TDigest().quantile(0.5))
+
+
+def test_group_states():
+    values = pd.Series(["a", "b", None, "a", "c", "b"])
+    codes = np.array([0, 0, 0, 1, -1, 1])
+    assert is_approximate_function("approx p95")
+    assert not is_approximate_function("unique")
+    states = build_states("approx count distinct", values, codes, 2)
+    counts = finalize_states("approx count distinct", pd.Series(states))
+    assert counts.tolist() == [2, 2]
+    merged = merge_states("approx count distinct", states)
+    assert HyperLogLog.from_bytes(merged).estimate() == 2
+    assert not is_approximate_function("approx first")
+    numbers = pd.Series([1.0, 3.0, 2.0, 10.0, 5.0, np.nan])
+    states = build_states("approx median", numbers, codes, 2)
+    assert finalize_states("approx median", pd.Series(states)).tolist() == [2.0, 10.0]
@@ -0,0 +1,760 @@
+import os
+import pathlib
+
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+import pytest
+
+from panditas import transformation_rules
+from panditas.models import DataFlow, DataSet, virtual_constant
+from panditas.transformation_rules import (
+    CalculatedColumn,
+    CaseWhen,
+    ConditionalFill,
+    ConstantColumn,
+    FilterBy,
+    FormatColumns,
+    MapValues,
+    PivotTable,
+    RemoveColumns,
+    RemoveDuplicateRows,
+    RenameColumns,
+    ReplaceText,
+    SelectColumns,
+    SortValuesBy,
+)
+
+fixtures_path = "{0}/fixtures".format(pathlib.Path(__file__).parent)
+
+
+def test_constant_column_virtual():
+    data_flow = DataFlow(
+        name="Test Virtual Constants",
+        steps=[
+            DataSet(
+                columns=["policyId", "policyChangeTransactionType"],
+                df_path="{0}/policy_changes.csv".format(fixtures_path),
+                name="transactions",
+                source="csv",
+            ),
+            ConstantColumn(column_name="newCount", column_value=0, name="add_new"),
+            ConstantColumn(
+                column_name="source", column_value="policy", name="add_source"
+            ),
+            ConditionalFill(
+                fill_column="newCount",
+                fill_value=1,
+                name="calculate_new",
+                where_column="policyChangeTransactionType",
+                where_condition="==",
+                where_condition_values=["New"],
+            ),
+        ],
+    )
+    data_flow.run()
+    # Constants are saved as metadata, not as data
+    assert "source" not in pq.read_schema(DataFlow.get_output_path("add_source")).names
+    assert DataFlow.get_output_metadata("add_source")["constants"] == {
+        "newCount": 0,
+        "source": "policy",
+    }
+    assert DataFlow.get_output_metadata("calculate_new")["constants"] == {
+        "source": "policy"
+    }
+    df = DataFlow.get_output_df("calculate_new")
+    assert df.columns.tolist() == [
+        "policyId",
+        "policyChangeTransactionType",
+        "newCount",
+        "source",
+    ]
+    assert df["newCount"].tolist() == [1, 0]
+    assert df["source"].tolist() == ["policy", "policy"]
+
+
+@pytest.mark.parametrize(
+    "column_value, expected",
+    [(0, ["x", "0", "0"]), (None, ["x", None, None]), (1.5, [2.0, 1.5, 1.5])],
+)
+def test_conditional_fill_virtual_constant(tmp_path, column_value, expected):
+    csv_path = tmp_path / "claims.csv"
+    csv_path.write_text("claimId,claimStatus\nClaim1,Open\nClaim2,Closed\nClaim3,X\n")
+    fill_value = 2.0 if isinstance(column_value, float) else "x"
+    data_flow = DataFlow(
+        name="Test Fill Virtual Constant",
+        steps=[
+            DataSet(df_path=str(csv_path), name="claims", source="csv"),
+            ConstantColumn(column_name="flag", column_value=column_value),
+            ConditionalFill(
+                fill_column="flag",
+                fill_value=fill_value,
+                name="fill_flag",
+                where_column="claimStatus",
+                where_condition="==",
+                where_condition_values=["Open"],
+            ),
+        ],
+    )
+    data_flow.run()
+    assert DataFlow.get_output_df("fill_flag")["flag"].tolist() == expected
+    constant_df = DataFlow.get_output_df(data_flow.steps[1].output_data_set)
+    assert constant_df["flag"].tolist() == [column_value] * 3
+
+
+def test_case_when():
+    data_flow = DataFlow(
+        name="Test Case When",
+        steps=[
+            DataSet(
+                columns=["policyId", "policyChangeTransactionType"],
+                df_path="{0}/policy_changes.csv".format(fixtures_path),
+                name="transactions",
+                source="csv",
+            ),
+            CaseWhen(
+                column_name="transactionSign",
+                cases=[
+                    ("policyChangeTransactionType", "==", ["Canceled"], -1),
+                    ("policyId", "==", ["Policy1", "Policy2"], 1),
+                ],
+                default=0,
+                name="sign_transactions",
+            ),
+            CaseWhen(
+                column_name="transactionSign",
+                cases=[("policyId", "==", ["Policy1"], 2)],
+                name="overwrite_sign",
+            ),
+        ],
+    )
+    data_flow.run()
+    assert DataFlow.get_output_df("sign_transactions")["transactionSign"].tolist() == [
+        1,
+        -1,
+    ]
+    # Without default the rows that match no case keep their values
+    assert DataFlow.get_output_df("overwrite_sign")["transactionSign"].tolist() == [
+        2,
+        -1,
+    ]
+
+
+@pytest.mark.parametrize(
+    "cases, expected",
+    [
+        ([("policyId", "==", ["Policy1"], "first")], ["first", None]),
+        ([("policyId", "==", ["Policy1"], 1)], [1, np.nan]),
+    ],
+)
+def test_case_when_new_column_without_default(cases, expected):
+    DataFlow.save_output_df(
+        pd.DataFrame({"policyId": ["Policy1", "Policy2"]}), "case_when_input"
+    )
+    case_when = CaseWhen(column_name="policyLabel", cases=cases)
+    case_when.input_data_sets = ["case_when_input"]
+    case_when.name = "case_when_output"
+    case_when.run()
+    result = DataFlow.get_output_df("case_when_output")["policyLabel"]
+    pd.testing.assert_series_equal(
+        result, pd.Series(expected, name="policyLabel"), check_dtype=False
+    )
+
+
+@pytest.mark.parametrize("use_numexpr", [False, True])
+def test_calculated_column(monkeypatch, use_numexpr):
+    if use_numexpr:
+        pytest.importorskip("numexpr")
+        monkeypatch.setattr(transformation_rules, "NUMEXPR_MIN_ROWS", 0)
+    else:
+        monkeypatch.setattr(transformation_rules, "numexpr", None)
+    df = pd.DataFrame(
+        {
+            "premium": np.array([100, 120, 127], dtype=np.int8),
+            "fees": ["10", "20", "30"],
+            "share": [0.5, 0.25, 0.0],
+        }
+    )
+    df["rate"] = virtual_constant(2, df.index)
+    DataFlow.save_output_df(df, "calculated_column_input")
+    calculated_column = CalculatedColumn(
+        base_column="premium",
+        expression=[
+            ("sum", "fees"),
+            ("multiply", "rate"),
+            ("divide", "share"),
+            ("mod", "premiumMod"),
+            ("subtract", "fees"),
+        ],
+        mod=7,
+    )
+    calculated_column.input_data_sets = ["calculated_column_input"]
+    calculated_column.name = "calculated_column"
+    calculated_column.run()
+    result = DataFlow.get_output_df("calculated_column")
+    # int8 premiums must not overflow and division by zero gives inf
+    assert result["premium"].tolist() == [430, 1100, np.inf]
+    assert result["premiumMod"].tolist()[:2] == [6, 0]
+
+
+@pytest.mark.parametrize("presorted", [False, True])
+def test_calculated_column_window(presorted):
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame(
+        {
+            "policyId": rng.choice(["Policy1", "Policy2", "Policy3"], 50),
+            "revision": rng.permutation(50),
+            "premium": rng.integers(-100, 100, 50).astype(float),
+        }
+    )
+    df.loc[[3, 17], "premium"] = np.nan
+    if presorted:
+        df = df.sort_values(["policyId", "revision"], ignore_index=True)
+    DataFlow.save_output_df(df, "window_input")
+    calculated_column = CalculatedColumn(
+        base_column="premium",
+        expression=[
+            ("cumsum", "runningPremium"),
+            ("cumcount", "revisionNumber"),
+            ("rolling_sum", "rollingPremium"),
+            ("rolling_mean", "averagePremium"),
+            ("lag", "previousPremium"),
+            ("lead", "nextPremium"),
+            ("rank", "premiumRank"),
+        ],
+        order_by=["revision"],
+        partition_by=["policyId"],
+        window=3,
+        min_periods=1,
+    )
+    calculated_column.input_data_sets = ["window_input"]
+    calculated_column.name = "window_output"
+    calculated_column.run()
+    result = DataFlow.get_output_df("window_output")
+
+    expected = df.sort_values(["policyId", "revision"])
+    grouped = expected.groupby("policyId")["premium"]
+    expected = expected.assign(
+        runningPremium=grouped.cumsum(),
+        revisionNumber=grouped.cumcount(),
+        rollingPremium=grouped.transform(lambda x: x.rolling(3, 1).sum()),
+        averagePremium=grouped.transform(lambda x: x.rolling(3, 1).mean()),
+        previousPremium=grouped.shift(1),
+        nextPremium=grouped.shift(-1),
+        premiumRank=grouped.rank(method="min"),
+    ).sort_index()
+    pd.testing.assert_frame_equal(
+        result, expected, check_dtype=False, check_index_type=False
+    )
+
+
+def get_line_name(value):
+    return "Line {0}".format(value)
+
+
+@pytest.mark.parametrize(
+    "map_logic, max_workers",
+    [({"Auto": "A", "Home": "H"}, None), (get_line_name, None), (get_line_name, 2)],
+)
+@pytest.mark.parametrize("dtype", [object, "category"])
+def test_map_values(monkeypatch, map_logic, max_workers, dtype):
+    monkeypatch.setattr(transformation_rules, "MAP_PROCESS_MIN_VALUES", 0)
+    df = pd.DataFrame({"line": ["Auto", "Home", None, "Auto", "Boat"]}, dtype=dtype)
+    DataFlow.save_output_df(df, "map_values_input")
+    map_values = MapValues(
+        column_name="line", map_logic=map_logic, max_workers=max_workers
+    )
+    map_values.input_data_sets = ["map_values_input"]
+    map_values.name = "map_values_output"
+    map_values.run()
+    result = DataFlow.get_output_df("map_values_output")["line"]
+    expected = df["line"].map(map_logic)
+    # Parquet reads empty values back as None
+    assert result.dtype == expected.dtype
+    assert result.isna().tolist() == expected.isna().tolist()
+    assert result.dropna().tolist() == expected.dropna().tolist()
+
+
+@pytest.mark.parametrize(
+    "replace_pattern, replace_pattern_is_regex, replace_value, expected",
+    [
+        (".", False, "", ["J Smith", "Jane Doe", None, "J Smith"]),
+        (r"^(\w)\w*\.? ", True, r"\1 ", ["J Smith", "J Doe", None, "J Smith"]),
+        # Look-arounds are not supported by Arrow
+        (r"(?<=J)\w+", True, "", ["J. Smith", "J Doe", None, "J Smith"]),
+    ],
+)
+@pytest.mark.parametrize("dtype", [object, "category"])
+def test_replace_text(
+    replace_pattern, replace_pattern_is_regex, replace_value, expected, dtype
+):
+    df = pd.DataFrame(
+        {"agentName": ["J. Smith", "Jane Doe", None, "J Smith"]}, dtype=dtype
+    )
+    DataFlow.save_output_df(df, "replace_text_input")
+    replace_text = ReplaceText(
+        column="agentName",
+        replace_pattern=replace_pattern,
+        replace_pattern_is_regex=replace_pattern_is_regex,
+        replace_value=replace_value,
+        replace_column="cleanAgentName",
+    )
+    replace_text.input_data_sets = ["replace_text_input"]
+    replace_text.name = "replace_text_output"
+    replace_text.run()
+    result = DataFlow.get_output_df("replace_text_output")
+    assert result["agentName"].dtype == df["agentName"].dtype
+    assert result["cleanAgentName"].astype(object).fillna("").tolist() == [
+        value or "" for value in expected
+    ]
+    assert str(result["cleanAgentName"].dtype) == str(df["agentName"].dtype)
+
+
+@pytest.mark.parametrize("replace_pattern_is_regex", [False, True])
+def test_replace_text_not_text(replace_pattern_is_regex):
+    df = pd.DataFrame({"agentCode": [101, 202, 303]})
+    DataFlow.save_output_df(df, "replace_not_text_input")
+    replace_text = ReplaceText(
+        column="agentCode",
+        replace_pattern="0",
+        replace_pattern_is_regex=replace_pattern_is_regex,
+        replace_value="",
+        replace_column="cleanAgentCode",
+    )
+    replace_text.input_data_sets = ["replace_not_text_input"]
+    replace_text.name = "replace_not_text_output"
+    replace_text.run()
+    result = DataFlow.get_output_df("replace_not_text_output")
+    assert result["agentCode"].tolist() == [101, 202, 303]
+    assert result["cleanAgentCode"].isna().all()
+
+
+@pytest.mark.parametrize(
+    "condition, value, expected",
+    [
+        ("contains", "me", [True, False, False, False]),
+        ("starts with", "Ho", [True, False, False, False]),
+        ("ends with", "to", [False, True, False, False]),
+        ("does not contain", "me", [False, True, True, True]),
+        ("does not start with", "Ho", [False, True, True, True]),
+        ("does not end with", "to", [True, False, True, True]),
+    ],
+)
+@pytest.mark.parametrize("dtype", [object, "category"])
+def test_string_conditions(condition, value, expected, dtype):
+    df = pd.DataFrame({"line": ["Home", "Auto", None, "Boat"]}, dtype=dtype)
+    df["matches"] = False
+    DataFlow.save_output_df(df, "string_conditions_input")
+    filter_by = FilterBy(
+        column_name="line", filter_conditions=[condition], condition_values=[value]
+    )
+    filter_by.input_data_sets = ["string_conditions_input"]
+    filter_by.name = "string_conditions_filter"
+    filter_by.run()
+    result = DataFlow.get_output_df("string_conditions_filter")
+    assert result["line"].tolist() == df["line"][expected].tolist()
+
+    conditional_fill = ConditionalFill(
+        fill_column="matches",
+        fill_value=True,
+        name="string_conditions_fill",
+        where_column="line",
+        where_condition=condition,
+        where_condition_values=[value],
+    )
+    conditional_fill.input_data_sets = ["string_conditions_input"]
+    conditional_fill.run()
+    result = DataFlow.get_output_df("string_conditions_fill")
+    assert result["matches"].tolist() == expected
+
+
+@pytest.mark.parametrize(
+    "condition, expected", [("contains", []), ("does not contain", [101, 202])]
+)
+def test_string_conditions_not_text(condition, expected):
+    # Numbers are never text, whatever their digits
+    df = pd.DataFrame({"agentCode": [101, 202]})
+    DataFlow.save_output_df(df, "string_conditions_not_text_input")
+    filter_by = FilterBy(
+        column_name="agentCode", filter_conditions=[condition], condition_values=["1"]
+    )
+    filter_by.input_data_sets = ["string_conditions_not_text_input"]
+    filter_by.name = "string_conditions_not_text_filter"
+    filter_by.run()
+    result = DataFlow.get_output_df("string_conditions_not_text_filter")
+    assert result["agentCode"].tolist() == expected
+
+
+@pytest.mark.parametrize("optimize_dtypes", [False, True])
+def test_filter_by_optimized_dtypes(tmp_path, optimize_dtypes):
+    rng = np.random.default_rng(0)
+    pd.DataFrame(
+        {
+            "agencyName": rng.choice(["Agency1", "Agency2", "Agency3"], 300),
+            "previousAgencyName": rng.choice(["Agency1", "Agency2"], 300),
+            "premium": rng.integers(0, 50, 300),
+        }
+    ).to_csv(str(tmp_path / "agencies.csv"), index=False)
+    data_flow = DataFlow(
+        name="Test Filter Optimized",
+        optimize_dtypes=optimize_dtypes,
+        steps=[
+            DataSet(
+                df_path=str(tmp_path / "agencies.csv"),
+                name="filter_optimized_input",
+                source="csv",
+            ),
+            FilterBy(
+                column_name="premium", filter_conditions=[">"], condition_values=[10]
+            ),
+            # Ordered comparisons on the categoricals made by the optimizer
+            FilterBy(
+                column_name="agencyName",
+                filter_conditions=[">", "<="],
+                condition_values=["Agency1", "previousAgencyName"],
+            ),
+        ],
+    )
+    data_flow.run()
+    if optimize_dtypes:
+        df = DataFlow.get_output_df(data_flow.steps[1].output_data_set)
+        assert str(df["agencyName"].dtype) == "category"
+    result = DataFlow.get_output_df(data_flow.output_data_set)
+    df = pd.read_csv(str(tmp_path / "agencies.csv"))
+    expected = df[
+        (df["premium"] > 10)
+        & (df["agencyName"] > "Agency1")
+        & (df["agencyName"] <= df["previousAgencyName"])
+    ]
+    assert len(expected)
+    assert result["premium"].tolist() == expected["premium"].tolist()
+    assert result["agencyName"].astype(object).tolist() == (
+        expected["agencyName"].tolist()
+    )
+
+
+@pytest.mark.parametrize("memory_budget", [0, 10**9])
+@pytest.mark.parametrize("keep", ["first", "last", False])
+def test_remove_duplicate_rows_external(memory_budget, keep):
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame(
+        {
+            "policyId": pd.Categorical(rng.choice(["Policy1", "Policy2", None], 500)),
+            "revision": rng.choice([1.0, 2.0, np.nan], 500),
+            "premium": rng.integers(0, 50, 500),
+        }
+    )
+    # Index labels of a filtered Data Set are kept
+    df = df[df["premium"] > 10]
+    df["source"] = virtual_constant("policy", df.index)
+    DataFlow.save_output_df(df, "deduplicate_input")
+    remove_duplicate_rows = RemoveDuplicateRows(
+        columns_subset=["policyId", "revision", "premium", "source"],
+        keep=keep,
+        chunk_size=50,
+        memory_budget=memory_budget,
+    )
+    remove_duplicate_rows.input_data_sets = ["deduplicate_input"]
+    remove_duplicate_rows.name = "deduplicate_output"
+    remove_duplicate_rows.run()
+    expected = DataFlow.get_output_df("deduplicate_input").drop_duplicates(
+        subset=["policyId", "revision", "premium", "source"], keep=keep
+    )
+    assert len(expected)
+    # Compared after saving, empty categoricals lose their categories
+    DataFlow.save_output_df(expected, "deduplicate_expected")
+    pd.testing.assert_frame_equal(
+        DataFlow.get_output_df("deduplicate_output"),
+        DataFlow.get_output_df("deduplicate_expected"),
+    )
+
+
+def test_remove_duplicate_rows_external_missing_values():
+    df = pd.DataFrame(
+        {
+            "policyId": np.arange(1000) // 2,
+            "agencyName": np.where(np.arange(1000) % 3, "Agency1", "Agency2"),
+            "cancelDate": None,
+        }
+    )
+    # The first chunk has no value to type the column with
+    df.loc[500:, "cancelDate"] = "2026-10-01"
+    DataFlow.save_output_df(df, "deduplicate_missing_input")
+    remove_duplicate_rows = RemoveDuplicateRows(
+        columns_subset=["agencyName", "policyId"],
+        keep="first",
+        chunk_size=333,
+        memory_budget=2000,
+    )
+    remove_duplicate_rows.input_data_sets = ["deduplicate_missing_input"]
+    remove_duplicate_rows.name = "deduplicate_missing_output"
+    remove_duplicate_rows.run()
+    expected = df.drop_duplicates(subset=["agencyName", "policyId"], keep="first")
+    pd.testing.assert_frame_equal(
+        DataFlow.get_output_df("deduplicate_missing_output"), expected
+    )
+
+
+@pytest.mark.parametrize("memory_budget", [None, 0, 4000, 10**9])
+@pytest.mark.parametrize("limit", [None, 7])
+def test_sort_values_by(memory_budget, limit):
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame(
+        {
+            "agencyName": pd.Categorical(rng.choice(["Agency1", "Agency2", None], 200)),
+            "premium": rng.choice([1.0, 2.0, 3.0, np.nan], 200),
+            "claimId": np.arange(200),
+        }
+    )
+    df["source"] = virtual_constant("policy", df.index)
+    DataFlow.save_output_df(df, "sort_input")
+    sort_values_by = SortValuesBy(
+        sort_columns=["premium", "agencyName"],
+        sort_ascending=[False, True],
+        chunk_size=30,
+        limit=limit,
+        memory_budget=memory_budget,
+    )
+    sort_values_by.input_data_sets = ["sort_input"]
+    sort_values_by.name = "sort_output"
+    sort_values_by.run()
+    expected = DataFlow.get_output_df("sort_input").sort_values(
+        ["premium", "agencyName"], ascending=[False, True], kind="stable"
+    )
+    if limit:
+        expected = expected.head(limit)
+    result = DataFlow.get_output_df("sort_output")
+    assert result.index.tolist() == expected.index.tolist()
+    assert result.columns.tolist() == expected.columns.tolist()
+    assert DataFlow.get_output_metadata("sort_output")["sort_keys"] == [
+        ["premium", False],
+        ["agencyName", True],
+    ]
+
+
+def test_sort_values_by_missing_values():
+    df = pd.DataFrame({"policyId": np.arange(1000), "cancelDate": None})
+    # The first runs have no value to type the column with
+    df.loc[500:, "cancelDate"] = "2026-10-01"
+    DataFlow.save_output_df(df, "sort_missing_input")
+    sort_values_by = SortValuesBy(
+        sort_columns=["policyId"],
+        sort_ascending=True,
+        chunk_size=100,
+        memory_budget=10**9,
+    )
+    sort_values_by.input_data_sets = ["sort_missing_input"]
+    sort_values_by.name = "sort_missing_output"
+    sort_values_by.run()
+    pd.testing.assert_frame_equal(
+        DataFlow.get_output_df("sort_missing_output"), df.sort_values("policyId")
+    )
+
+
+def test_physical_properties():
+    data_flow = DataFlow(
+        name="Test Physical Properties",
+        steps=[
+            DataSet(
+                columns=["policyId", "policyChangeTransactionType"],
+                df_path="{0}/policy_changes.csv".format(fixtures_path),
+                name="transactions",
+                source="csv",
+            ),
+            SortValuesBy(sort_columns=["policyId"], sort_ascending=True),
+            RemoveDuplicateRows(columns_subset=["policyId"]),
+            ConstantColumn(column_name="newCount", column_value=0, name="add_new"),
+            FilterBy(
+                column_name="policyChangeTransactionType",
+                filter_conditions=["=="],
+                condition_values=["New"],
+            ),
+            RenameColumns(columns={"policyId": "id"}),
+            MapValues(column_name="id", map_logic={"Policy1": "P"}),
+        ],
+    )
+    data_flow.run()
+    metadata = DataFlow.get_output_metadata("RenameColumns_5")
+    assert metadata["sort_keys"] == [["id", True]]
+    assert metadata["unique_keys"] == [["id"]]
+    assert metadata["row_count"] == 1
+    # Mapping the key column loses its properties
+    metadata = DataFlow.get_output_metadata("MapValues_6")
+    assert "sort_keys" not in metadata
+    assert "unique_keys" not in metadata
+
+
+def test_format_columns(tmp_path):
+    df = pd.DataFrame(
+        {"agencyName": ["Agency1", "Agency2", None], "premium": [1000.5, 2.25, np.nan]}
+    )
+    DataFlow.save_output_df(df, "format_input")
+    format_columns = FormatColumns(column_formats={"premium": "{:,.2f}"})
+    format_columns.name = "format_premium"
+    format_columns.input_data_sets = ["format_input"]
+    format_columns.run()
+    rename_columns = RenameColumns(columns={"premium": "totalPremium"})
+    rename_columns.name = "format_rename"
+    rename_columns.input_data_sets = ["format_premium"]
+    rename_columns.run()
+    # The data keeps its types, the formats are only metadata
+    output_df = DataFlow.get_output_df("format_rename")
+    assert output_df["totalPremium"].dtype == np.float64
+    metadata = DataFlow.get_output_metadata("format_rename")
+    assert metadata["column_formats"] == {"totalPremium": "{:,.2f}"}
+    path = DataFlow.export_output_df("format_rename", str(tmp_path / "out.csv"))
+    exported = pd.read_csv(path, keep_default_na=False)
+    assert exported["totalPremium"].tolist() == ["1,000.50", "2.25", ""]
+    assert exported["agencyName"].tolist() == ["Agency1", "Agency2", ""]
+    with pytest.raises(Exception):
+        DataFlow.export_output_df("format_rename", str(tmp_path / "out.txt"))
+
+
+@pytest.mark.parametrize("index", [None, ["a", "b", "c"]])
+def test_remove_and_select_columns(index):
+    df = pd.DataFrame(
+        {
+            "policyId": ["Policy1", "Policy2", "Policy3"],
+            "agencyName": pd.Categorical(["Agency1", "Agency2", "Agency1"]),
+            "premium": [1.5, 2.5, np.nan],
+        },
+        index=index,
+    )
+    df["lineOfBusiness"] = virtual_constant("Auto", df.index)
+    DataFlow.save_output_df(
+        df, "projection_input", metadata={"unique_keys": [["policyId"]]}
+    )
+    remove_columns = RemoveColumns(column_names=["agencyName"])
+    remove_columns.name = "projection_remove"
+    remove_columns.input_data_sets = ["projection_input"]
+    remove_columns.run()
+    expected = df.drop(columns=["agencyName"])
+    expected["lineOfBusiness"] = "Auto"
+    pd.testing.assert_frame_equal(DataFlow.get_output_df("projection_remove"), expected)
+    assert DataFlow.get_output_metadata("projection_remove")["unique_keys"] == [
+        ["policyId"]
+    ]
+    select_columns = SelectColumns(keep_columns=["premium", "agencyName"])
+    select_columns.name = "projection_select"
+    select_columns.input_data_sets = ["projection_input"]
+    select_columns.run()
+    pd.testing.assert_frame_equal(
+        DataFlow.get_output_df("projection_select"), df[["premium", "agencyName"]]
+    )
+    assert "unique_keys" not in DataFlow.get_output_metadata("projection_select")
+    select_columns.keep_columns = ["missing"]
+    with pytest.raises(Exception):
+        select_columns.run()
+
+
+@pytest.mark.parametrize("sort_keys", [None, [["agencyName", True]]])
+def test_pivot_table_contiguous(sort_keys):
+    df = pd.DataFrame(
+        {
+            "agencyName": ["Agency2", "Agency2", "Agency1", None, "Agency3"],
+            "premium": [1, 2, 3, 4, 5],
+            "fees": [1.5, np.nan, 2.0, 1.0, np.nan],
+        }
+    )
+    metadata = {"partition_keys": ["agencyName"]}
+    if sort_keys:
+        df = df.sort_values("agencyName", ignore_index=True)
+        metadata = {"sort_keys": sort_keys}
+    DataFlow.save_output_df(df, "pivot_input", metadata=metadata)
+    pivot_table = PivotTable(
+        group_columns=["agencyName"],
+        group_functions=["sum", "max"],
+        group_values=["premium", "fees"],
+        name="pivot_output",
+    )
+    pivot_table.input_data_sets = ["pivot_input"]
+    pivot_table.run()
+    expected = df.pivot_table(
+        index=["agencyName"],
+        values=["premium", "fees"],
+        aggfunc={"premium": "sum", "fees": "max"},
+        observed=True,
+    ).reset_index()
+    pd.testing.assert_frame_equal(DataFlow.get_output_df("pivot_output"), expected)
+    assert DataFlow.get_output_metadata("pivot_output")["unique_keys"] == [
+        ["agencyName"]
+    ]
+
+
+@pytest.mark.parametrize(
+    "group_functions",
+    [
+        ["sum", "max", "last"],
+        ["sum", "max", "unique"],
+        ["approx median", "min", "approx count distinct"],
+        ["count", "approx last", "approx first"],
+    ],
+)
+def test_pivot_table_incremental(group_functions):
+    df = pd.DataFrame(
+        {
+            "revisionId": [1, 2, 3, 4, 5, 6],
+            "agencyName": ["Agency2", "Agency1", "Agency2", "Agency3", "Agency1", None],
+            "premium": [1, 2, 3, 4, 5, 6],
+            "fees": [1.5, np.nan, 2.0, 1.0, np.nan, 3.0],
+            "lineOfBusiness": ["Auto", "Home", "Home", "Auto", None, "Auto"],
+        }
+    )
+    aggfunc = dict(zip(["premium", "fees", "lineOfBusiness"], group_functions))
+    pivot_table = PivotTable(
+        group_columns=["agencyName"],
+        group_functions=group_functions,
+        group_values=["premium", "fees", "lineOfBusiness"],
+        name="incremental_output",
+        watermark_column="revisionId",
+    )
+    pivot_table.input_data_sets = ["incremental_input"]
+    if os.path.exists(DataFlow.get_output_path("incremental_output_state")):
+        os.remove(DataFlow.get_output_path("incremental_output_state"))
+    for rows in [3, 3, 6]:
+        DataFlow.save_output_df(df.iloc[:rows], "incremental_input")
+        pivot_table.run()
+        # approx first and approx last are the exact first and last
+        expected_df = PivotTable(
+            group_columns=["agencyName"],
+            group_functions=[
+                {"approx first": "first", "approx last": "last"}.get(function, function)
+                for function in group_functions
+            ],
+            group_values=["premium", "fees", "lineOfBusiness"],
+            name="incremental_expected",
+        )
+        expected_df.input_data_sets = ["incremental_input"]
+        expected_df.run()
+        pd.testing.assert_frame_equal(
+            DataFlow.get_output_df("incremental_output"),
+            DataFlow.get_output_df("incremental_expected"),
+        )
+    state_path = DataFlow.get_output_path("incremental_output_state")
+    if "unique" in aggfunc.values():
+        assert not os.path.exists(state_path)
+    else:
+        assert (
+            DataFlow.get_output_metadata("incremental_output_state")["watermark"] == 6
+        )
+
+
+@pytest.mark.parametrize("keep", ["first", "last", False])
+def test_remove_duplicate_rows_adjacent(keep):
+    df = pd.DataFrame(
+        {
+            "policyId": ["Policy1", "Policy1", "Policy2", None, None, "Policy3"],
+            "revision": [1, 2, 1, 1, 2, 1],
+        }
+    )
+    DataFlow.save_output_df(
+        df, "adjacent_input", metadata={"partition_keys": ["policyId"]}
+    )
+    remove_duplicate_rows = RemoveDuplicateRows(columns_subset=["policyId"], keep=keep)
+    remove_duplicate_rows.input_data_sets = ["adjacent_input"]
+    remove_duplicate_rows.name = "adjacent_output"
+    remove_duplicate_rows.run()
+    pd.testing.assert_frame_equal(
+        DataFlow.get_output_df("adjacent_output"),
+        df.drop_duplicates(subset=["policyId"], keep=keep),
+    )
@@ -1,7 +1,42 @@
-import numpy as np
-import pandas as pd
-
-from .models import DataFlow, TransformationRule
+import functools
+import heapq
+import logging
+import operator
+import os
+import re
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+from .dtypes import get_memory_usage
+from .lazy import lazy_import
+from .models import (
+    DataFlow,
+    OutputWriter,
+    TransformationRule,
+    are_groups_contiguous,
+    has_unique_key,
+    is_sorted_by,
+    is_virtual_constant,
+    is_virtual_constant_value,
+    keep_valid_properties,
+    virtual_constant,
+)
+from .sketches import (
+    build_states,
+    finalize_states,
+    is_approximate_function,
+    merge_states,
+)
+
+logger = logging.getLogger(__name__)
+
+# Only imported when a step runs, see panditas.lazy
+np = lazy_import("numpy")
+numexpr = lazy_import("numexpr", optional=True)
+pd = lazy_import("pandas")
+pa = lazy_import("pyarrow")
+pc = lazy_import("pyarrow.compute")
+pq = lazy_import("pyarrow.parquet")
 
 CHECK_CONDITIONS = [
     "==",
@@ -9,16 +44,52 @@ CHECK_CONDITIONS = [
     ">",
     ">=",
     "<",
-    "=<"
+    "<=",
+    "=<",
     "contains",
     "does not contain",
     "starts with",
     "does not start with",
     "ends with",
+    "does not end with",
 ]
+COMPARISON_OPERATORS = {
+    "==": operator.eq,
+    "!=": operator.ne,
+    ">": operator.gt,
+    ">=": operator.ge,
+    "<": operator.lt,
+    "<=": operator.le,
+    "=<": operator.le,
+}
+# Names of the pyarrow.compute kernels
+STRING_CONDITIONS = {
+    "contains": "match_substring",
+    "starts with": "starts_with",
+    "ends with": "ends_with",
+}
+# Negated conditions and the spellings used by ConditionalFill
+STRING_CONDITION_ALIASES = {
+    "does not contain": "contains",
+    "does not start with": "starts with",
+    "does not end with": "ends with",
+    "not contains": "contains",
+    "startswith": "starts with",
+    "not startswith": "starts with",
+    "endswith": "ends with",
+    "not endswith": "ends with",
+}
+# Number of files the keys are split into when deduplicating out of memory
+DEDUPLICATE_SPILL_PARTITIONS = 64
+# Functions are only sent to a process pool for at least this many values
+MAP_PROCESS_MIN_VALUES = 10000
 GROUP_FUNCTIONS = [
     "alpha max",
     "alpha min",
+    "approx count distinct",
+    "approx first",
+    "approx last",
+    "approx median",
     "concatenate",
     "count",
     "first",
@@ -29,10 +100,177 @@ GROUP_FUNCTIONS = [
     "sum",
     "unique",
 ]
+# Group functions computed by other ones, approx first and approx last are
+# exact, the first and last values are already mergeable
+GROUP_FUNCTION_ALIASES = {"approx first": "first", "approx last": "last"}
 SUPPORTED_OPERATIONS = ["sum", "subtract", "multiply", "divide"]
+# Names of the numpy ufuncs
+ARITHMETIC_FUNCTIONS = {
+    "sum": "add",
+    "subtract": "subtract",
+    "multiply": "multiply",
+    "divide": "true_divide",
+}
+ARITHMETIC_OPERATORS = {"sum": "+", "subtract": "-", "multiply": "*", "divide": "/"}
+# Below this number of rows numexpr setup costs more than it saves
+NUMEXPR_MIN_ROWS = 10000
+NUMEXPR_TYPES = ("int32", "int64", "float32", "float64")
+# Functions whose results can be merged with the results on newer rows, by
+# the function used to merge them
+INCREMENTAL_FUNCTIONS = {
+    "count": "sum",
+    "first": "first",
+    "last": "last",
+    "max": "max",
+    "min": "min",
+    "sum": "sum",
+}
+WINDOW_OPERATIONS = [
+    "cumcount",
+    "cumsum",
+    "lag",
+    "lead",
+    "rank",
+    "rolling_mean",
+    "rolling_sum",
+]
+
+
+def is_string_condition(condition):
+    """Check if a condition is a text condition like contains.
+
+    Parameters
+    ----------
+    condition : str
+        Condition of a FilterBy or ConditionalFill.
+
+    Returns
+    -------
+    bool
+        True for contains, starts with, ends with and their negations.
+
+    """
+    return condition in STRING_CONDITIONS or condition in STRING_CONDITION_ALIASES
+
+
+def get_comparable_values(series):
+    """Get the values of a column for ordered comparisons.
+
+    Unordered categoricals, like the ones made by optimize_dtypes, can only be
+    compared for equality against a value, so their values are compared.
+
+    Parameters
+    ----------
+    series : Series
+        Column to compare.
+
+    Returns
+    -------
+    Series
+        The values of unordered categoricals, the column otherwise.
+
+    """
+    if isinstance(series.dtype, pd.CategoricalDtype) and not series.cat.ordered:
+        return series.astype(series.cat.categories.dtype)
+    return series
+
+
+def get_string_condition_mask(series, condition, value):
+    """Evaluate a text condition with Arrow compute kernels.
+
+    Categorical and virtual constant columns evaluate the condition once per
+    distinct value and broadcast the result to the rows. Missing values never
+    contain, start or end with anything, so they only match the negations.
+
+    Parameters
+    ----------
+    series : Series
+        Column the condition applies to.
+    condition : str
+        Text condition, see is_string_condition.
+    value : str
+        Text to look for.
+
+    Returns
+    -------
+    array
+        Boolean mask of the rows that match.
+
+    """
+    negated = "not" in condition
+    kernel = getattr(
+        pc, STRING_CONDITIONS[STRING_CONDITION_ALIASES.get(condition, condition)]
+    )
+    codes = None
+    values = series
+    if is_virtual_constant(series):
+        codes = np.zeros(len(series), dtype=np.int64)
+        values = [series.sparse.fill_value]
+    elif isinstance(series.dtype, pd.CategoricalDtype):
+        codes = series.cat.codes.to_numpy()
+        values = series.cat.categories
+    try:
+        array = pa.array(values, type=pa.string(), from_pandas=True)
+        mask = pc.fill_null(kernel(array, str(value)), False)
+        mask = mask.to_numpy(zero_copy_only=False)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        # Columns mixing text with other values, which never match
+        text = pd.Series(values, dtype=object)
+        is_text = text.map(type).to_numpy() == str
+        mask = np.zeros(len(text), dtype=bool)
+        # Typed, without text values the array would be of the null type
+        array = pa.array(text[is_text].tolist(), type=pa.string())
+        mask[is_text] = kernel(array, str(value)).to_numpy(zero_copy_only=False)
+    if codes is not None:
+        mask = np.where(codes < 0, False, mask[codes])
+    return ~mask if negated else mask
+
+
+def _get_sort_order(keys):
+    """Get the order that sorts rows by some integer keys.
+
+    Parameters
+    ----------
+    keys : list
+        Integer arrays, the first one is the most significant.
+
+    Returns
+    -------
+    array or None
+        Stable order of the rows, None if they are already sorted.
+
+    """
+    undecided = np.ones(max(len(keys[0]) - 1, 0), dtype=bool)
+    for key in keys:
+        difference = np.diff(key)
+        if (undecided & (difference < 0)).any():
+            return np.lexsort(keys[::-1])
+        undecided &= difference == 0
+    return None
+
+
+def _get_group_starts(groups):
+    """Find where each group starts in sorted group codes.
+
+    Parameters
+    ----------
+    groups : array
+        Group code of each row, rows of a group are contiguous.
+
+    Returns
+    -------
+    tuple
+        Position of the first row of each group and the group number (in
+        order of appearance) of each row.
+
+    """
+    is_start = np.ones(len(groups), dtype=bool)
+    is_start[1:] = groups[1:] != groups[:-1]
+    return np.flatnonzero(is_start), np.cumsum(is_start) - 1
 
 
 class CalculatedColumn(TransformationRule):
+    keeps_row_order = True
     base_column = None
     expression = None
     axis = 0
@@ -40,8 +278,26 @@ class CalculatedColumn(TransformationRule):
     skipna = True
     # ver for mod
     mod = 1
+    # vars for window operations
+    min_periods = None
+    order_by = None
+    partition_by = None
+    periods = 1
+    window = None
 
-    def __init__(self, base_column, expression, axis=0, skipna=True, mod=None):
+    def __init__(
+        self,
+        base_column,
+        expression,
+        axis=0,
+        skipna=True,
+        mod=None,
+        min_periods=None,
+        order_by=None,
+        partition_by=None,
+        periods=1,
+        window=None,
+    ):
         """Short summary.
 
         operations supported:
@@ -51,6 +307,12 @@ class CalculatedColumn(TransformationRule):
          - divide
          - cumsum
          - mod
+         - cumcount, rolling_sum, rolling_mean, lag, lead and rank (window
+           operations)
+
+        Window operations (and cumsum when partition_by or order_by are given)
+        are computed within each group of partition_by with the rows ordered
+        by order_by, the result goes to the row it was computed for.
 
         Parameters
         ----------
@@ -61,6 +323,22 @@ class CalculatedColumn(TransformationRule):
                     example: sum : column_1 will translate to base_column = base_column + column_1
                 for cumsum and mod the value is the name of a new column, if empty
                 the operation is performed on base_column
+                a list of (operation, column_name) pairs is also accepted, so an
+                operation can be used more than once
+                consecutive sum, subtract, multiply and divide operations are
+                evaluated together in a single pass
+                for window operations the value is the name of a new column, if
+                empty the operation is performed on base_column
+            min_periods : int
+                minimum non empty values for rolling operations, window by default
+            order_by : list
+                columns that order the rows of a window, ascending
+            partition_by : list
+                columns that split the rows into independent windows
+            periods : int
+                rows to shift for lag and lead
+            window : int
+                number of rows for rolling operations
 
 
         Returns
@@ -74,6 +352,11 @@ class CalculatedColumn(TransformationRule):
         self.axis = axis
         self.skipna = skipna
         self.mod = mod
+        self.min_periods = min_periods
+        self.order_by = order_by
+        self.partition_by = partition_by
+        self.periods = periods
+        self.window = window
 
     def _validate_expression(self):
         """Short summary.
@@ -107,10 +390,10 @@ class CalculatedColumn(TransformationRule):
             The dataframe recieved with the list of columns set to numeric if one or more was not
 
         """
-        dt = df.dtypes
         for col in column_names:
-            col_dt = dt[col]
-            if str(col_dt) not in "int" or str(col_dt) not in "float":
+            if is_virtual_constant(df[col]):
+                df[col] = df[col].sparse.to_dense()
+            if not pd.api.types.is_numeric_dtype(df[col]):
                 try:
                     df[col] = pd.to_numeric(df[col])
                 except Exception:
@@ -242,6 +525,8 @@ class CalculatedColumn(TransformationRule):
             Resulting DF.
 
         """
+        if self.partition_by or self.order_by:
+            return self.window_column(df, cumsum_col, "cumsum")
         df = self.check_column_arith(df, [self.base_column])
         if cumsum_col:
             df[cumsum_col] = df[self.base_column].cumsum(skipna=self.skipna, axis=self.axis)
@@ -249,6 +534,227 @@ class CalculatedColumn(TransformationRule):
             df[self.base_column] = df[self.base_column].cumsum(skipna=self.skipna, axis=self.axis)
         return df
 
+    def _get_window_keys(self, df):
+        """Build the integer sort keys of the windows.
+
+        Parameters
+        ----------
+            df : Data Frame
+                dataframe to which the operation will apply
+
+        Returns
+        -------
+        list
+            The group number of each row (numbered by first appearance, so rows
+            already grouped together are in order) followed by the sort codes of
+            each order_by column, empty values last.
+
+        """
+        keys = []
+        if self.partition_by:
+            keys.append(
+                df.groupby(list(self.partition_by), dropna=False, sort=False)
+                .ngroup()
+                .to_numpy()
+            )
+        for column in self.order_by or []:
+            codes, uniques = pd.factorize(df[column], sort=True)
+            keys.append(np.where(codes < 0, len(uniques), codes))
+        return keys
+
+    def window_column(self, df, window_col, operation):
+        """Apply a window operation to base column.
+
+        Rows are sorted by partition_by and order_by only when they are not
+        already in that order, then each operation is computed for all the
+        groups at once from the group start positions.
+
+        Parameters
+        ----------
+            df : Data Frame
+                dataframe to which the operation will apply
+            window_col : str
+                name of the new column where the result will be stored
+            operation : str
+                one of WINDOW_OPERATIONS
+
+        Returns
+        -------
+        Data Frame
+            Resulting DF.
+
+        """
+        if operation.startswith("rolling") and not self.window:
+            raise Exception("A window is needed for {0}".format(operation))
+        if operation in ("cumsum", "rolling_mean", "rolling_sum"):
+            df = self.check_column_arith(df, [self.base_column])
+        elif is_virtual_constant(df[self.base_column]):
+            df[self.base_column] = df[self.base_column].sparse.to_dense()
+        keys = self._get_window_keys(df) or [np.zeros(len(df), dtype=np.int64)]
+        order = _get_sort_order(keys)
+        values = df[self.base_column].to_numpy()
+        groups = keys[0] if self.partition_by else np.zeros(len(df), dtype=np.int64)
+        if order is not None:
+            values = values[order]
+            groups = groups[order]
+        starts, group_index = _get_group_starts(groups)
+        row_starts = starts[group_index]
+        positions = np.arange(len(df))
+        if operation == "cumcount":
+            result = positions - row_starts
+        elif operation in ("lag", "lead"):
+            shift = -self.periods if operation == "lag" else self.periods
+            source = positions + shift
+            row_ends = np.append(starts[1:], len(df))[group_index]
+            source[(source < row_starts) | (source >= row_ends)] = -1
+            result = pd.api.extensions.take(values, source, allow_fill=True)
+        elif operation == "rank":
+            result = self._rank_values(values, groups, row_starts, positions)
+        elif operation == "cumsum":
+            result = self._cumsum_values(values, starts, group_index)
+        else:
+            result = self._rolling_values(operation, values, row_starts, positions)
+        if order is not None:
+            sorted_result = result
+            result = np.empty_like(sorted_result)
+            result[order] = sorted_result
+        df[window_col or self.base_column] = result
+        return df
+
+    def _cumsum_values(self, values, starts, group_index):
+        """Cumulative sum of sorted values restarting at each group.
+
+        Parameters
+        ----------
+            values : array
+                numeric values sorted by group
+            starts : array
+                position of the first row of each group
+            group_index : array
+                group number of each row
+
+        Returns
+        -------
+        array
+            Cumulative sums, integers stay integers.
+
+        """
+        is_nan = pd.isna(values)
+        filled = np.where(is_nan, 0, values)
+        totals = np.cumsum(filled)
+        result = totals - (totals[starts] - filled[starts])[group_index]
+        if is_nan.any():
+            result = result.astype(np.float64)
+            if self.skipna:
+                result[is_nan] = np.nan
+            else:
+                nan_counts = np.cumsum(is_nan)
+                previous_nans = (nan_counts[starts] - is_nan[starts])[group_index]
+                result[nan_counts > previous_nans] = np.nan
+        return result
+
+    def _rolling_values(self, operation, values, row_starts, positions):
+        """Rolling sum or mean of sorted values within each group.
+
+        Parameters
+        ----------
+            operation : str
+                rolling_sum or rolling_mean
+            values : array
+                numeric values sorted by group
+            row_starts : array
+                position of the first row of the group of each row
+            positions : array
+                position of each row
+
+        Returns
+        -------
+        array
+            Float results, empty when the window has less than min_periods
+            values.
+
+        """
+        min_periods = self.window if self.min_periods is None else self.min_periods
+        values = values.astype(np.float64)
+        is_nan = np.isnan(values)
+        totals = np.zeros(len(values) + 1)
+        np.cumsum(np.where(is_nan, 0, values), out=totals[1:])
+        counts = np.zeros(len(values) + 1, dtype=np.int64)
+        np.cumsum(~is_nan, out=counts[1:])
+        lower = np.maximum(positions - self.window + 1, row_starts)
+        result = totals[positions + 1] - totals[lower]
+        count = counts[positions + 1] - counts[lower]
+        if operation == "rolling_mean":
+            with np.errstate(divide="ignore", invalid="ignore"):
+                result = result / count
+        result[count < max(min_periods, 1)] = np.nan
+        return result
+
+    @staticmethod
+    def _rank_values(values, groups, row_starts, positions):
+        """Rank values within each group, ties get the lowest rank.
+
+        Parameters
+        ----------
+            values : array
+                values sorted by group
+            groups : array
+                group code of each row
+            row_starts : array
+                position of the first row of the group of each row
+            positions : array
+                position of each row
+
+        Returns
+        -------
+        array
+            Float ranks starting at 1, empty for empty values.
+
+        """
+        codes, uniques = pd.factorize(values, sort=True)
+        is_nan = codes < 0
+        codes = np.where(is_nan, len(uniques), codes)
+        # Stable, so the groups stay in the same place
+        order = np.lexsort((codes, groups))
+        codes = codes[order]
+        is_first = np.ones(len(codes), dtype=bool)
+        is_first[1:] = (codes[1:] != codes[:-1]) | (row_starts[1:] != row_starts[:-1])
+        first_positions = np.maximum.accumulate(np.where(is_first, positions, 0))
+        result = np.empty(len(codes), dtype=np.float64)
+        result[order] = first_positions - row_starts + 1
+        result[is_nan] = np.nan
+        return result
+
+    def is_row_local(self):
+        """Check if each output row only depends on one input row.
+
+        Returns
+        -------
+        bool
+            True unless there are cumsum or window operations.
+
+        """
+        return all(
+            operation in ARITHMETIC_FUNCTIONS or operation == "mod"
+            for operation, _ in self._get_expression()
+        )
+
+    def get_modified_columns(self):
+        """Get the columns whose values the step changes.
+
+        Returns
+        -------
+        list
+            The base column and the columns added by mod, cumsum and window
+            operations.
+
+        """
+        return [self.base_column] + [
+            column
+            for operation, column in self._get_expression()
+            if operation not in ARITHMETIC_FUNCTIONS and column
+        ]
+
     def run(self):
         """Short summary.
 
@@ -266,17 +772,151 @@ class CalculatedColumn(TransformationRule):
             "sum": self.sum_columns,
             "subtract": self.subtract_columns,
             "multiply": self.multiply_columns,
+            "divide": self.divide_columns,
+            "mod": self.mod_column,
             "cumsum": self.cumsum_column,
         }
-        df = DataFlow.get_output_df(self.input_data_sets[-1])
+        for operation in WINDOW_OPERATIONS:
+            operations.setdefault(
+                operation, functools.partial(self.window_column, operation=operation)
+            )
+        self._validate_expression()
+        df = DataFlow.get_output_df(self.input_data_sets[-1], virtual_columns=True)
         if self.base_column not in df.columns:
             df[self.base_column] = np.nan
-        for operation, column in self.expression:
+        # Consecutive arithmetic operations are evaluated together in one pass
+        arithmetic_operations = []
+        operands = {}
+        for operation, column in self._get_expression():
+            if operation in ARITHMETIC_FUNCTIONS:
+                arithmetic_operations.append((operation, column))
+                continue
+            self._evaluate_arithmetic(df, arithmetic_operations, operands)
+            arithmetic_operations = []
             df = operations[operation](df, column)
-        self.output_data_set = DataFlow.save_output_df(df, self.name)
+            operands.pop(self.base_column, None)
+            operands.pop(column, None)
+        self._evaluate_arithmetic(df, arithmetic_operations, operands)
+        self.output_data_set = self.save_output(df)
+
+    def _get_expression(self):
+        """Short summary.
+
+        Parameters
+        ----------
+
+
+        Returns
+        -------
+        list
+            The (operation, column) pairs of the expression, which can be given
+            as a list of pairs or as an ordered dict.
+
+        """
+        if isinstance(self.expression, dict):
+            return list(self.expression.items())
+        return list(self.expression)
+
+    def _get_operand(self, df, column, operands):
+        """Get the numeric values of a column, making it numeric only once.
+
+        Parameters
+        ----------
+        df : Data Frame
+            dataframe to which the operation will apply
+        column : str
+            name of the column
+        operands : dict
+            values already prepared by column name
+
+        Returns
+        -------
+        array or scalar
+            The values of the column, a scalar for virtual constant columns.
+
+        """
+        if column in operands:
+            return operands[column]
+        series = df[column]
+        if is_virtual_constant(series) and pd.api.types.is_numeric_dtype(
+            series.dtype.subtype
+        ):
+            operands[column] = series.sparse.fill_value
+            return operands[column]
+        self.check_column_arith(df, [column])
+        series = df[column]
+        if isinstance(series.dtype, pd.api.extensions.ExtensionDtype):
+            operands[column] = series.to_numpy(dtype=np.float64, na_value=np.nan)
+        else:
+            operands[column] = series.to_numpy()
+        return operands[column]
+
+    def _evaluate_arithmetic(self, df, arithmetic_operations, operands):
+        """Apply a sequence of arithmetic operations to base column in one pass.
+
+        The operations are applied from left to right, with numexpr if it is
+        installed and otherwise in place on a single output array, so no
+        intermediate columns are created.
+
+        Parameters
+        ----------
+        df : Data Frame
+            dataframe to which the operations will apply
+        arithmetic_operations : list
+            (operation, column) pairs, operation is one of SUPPORTED_OPERATIONS
+        operands : dict
+            values already prepared by column name
+
+        Returns
+        -------
+        None
+
+        """
+        if not arithmetic_operations:
+            return
+        columns = [self.base_column] + [column for _, column in arithmetic_operations]
+        values = [self._get_operand(df, column, operands) for column in columns]
+        dtype = np.result_type(*values)
+        if dtype.kind in "biu":
+            # Compact (downcast) columns must not overflow
+            dtype = np.result_type(dtype, np.int64)
+            if any(operation == "divide" for operation, _ in arithmetic_operations):
+                dtype = np.dtype(np.float64)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            if (
+                numexpr is not None
+                and len(df) >= NUMEXPR_MIN_ROWS
+                and isinstance(values[0], np.ndarray)
+                and all(
+                    str(value.dtype) in NUMEXPR_TYPES
+                    for value in values
+                    if isinstance(value, np.ndarray)
+                )
+            ):
+                expression = "v0"
+                for key, (operation, _) in enumerate(arithmetic_operations):
+                    expression = "({0} {1} v{2})".format(
+                        expression, ARITHMETIC_OPERATORS[operation], key + 1
+                    )
+                result = numexpr.evaluate(
+                    expression,
+                    local_dict={
+                        "v{0}".format(key): value for key, value in enumerate(values)
+                    },
+                ).astype(dtype, copy=False)
+            else:
+                result = np.empty(len(df), dtype=dtype)
+                result[...] = values[0]
+                for (operation, _), value in zip(arithmetic_operations, values[1:]):
+                    function = getattr(np, ARITHMETIC_FUNCTIONS[operation])
+                    function(result, value, out=result)
+        df[self.base_column] = result
+        operands[self.base_column] = result
 
 
 class ConditionalFill(TransformationRule):
+    keeps_row_order = True
+    row_local = True
     fill_column = None
     fill_value = None
     where_column = None
@@ -350,12 +990,18 @@ class ConditionalFill(TransformationRule):
         for value in values:
             if value in df.columns:
                 value = 'df["{0}"]'.format(value)
-            elif isinstance(value, str) and df[column].dtype.type == np.object_:
+            elif isinstance(value, str) and not pd.api.types.is_numeric_dtype(
+                df[column]
+            ):
                 value = value.replace('"', '\\"')
                 value = '"{0}"'.format(value)
-            if df[column].dtype.type == np.int64 and not isinstance(value, int):
+            elif pd.api.types.is_integer_dtype(df[column]) and not isinstance(
+                value, int
+            ):
                 value = int(value)
-            if df[column].dtype.type == np.float64 and not isinstance(value, float):
+            elif pd.api.types.is_float_dtype(df[column]) and not isinstance(
+                value, float
+            ):
                 value = float(value)
             expression = '(df["{0}"] {1} {2})'.format(column, action, value)
             expressions.append(expression)
@@ -394,44 +1040,36 @@ class ConditionalFill(TransformationRule):
         # Operator Style
         operators = ["==", "!="]
 
-        # Method Style
-        string_methods = {
-            "contains": "contains",
-            "not contains": "contains",
-            "startswith": "startswith",
-            "not startswith": "startswith",
-            "endswith": "endswith",
-            "not endswith": "endswith",
-        }
-
         if action in operators:
             expression = self._build_operator_expression(
                 values=values, action=action, column=column, df=df
             )
-        elif action in string_methods:
-            expression = self._build_string_expression(
-                values, action, column, string_methods
-            )
         else:
             raise Exception(
                 "{0} is an invalid filter, ".format(action)
-                + "needs to be one of {0}".format(", ".join(operators + string_methods))
+                + "needs to be one of {0}".format(
+                    ", ".join(operators + list(STRING_CONDITIONS))
+                )
             )
         return expression
 
-    def _build_string_expression(self, values, action, column, string_methods):
+    def get_modified_columns(self):
+        """Get the columns whose values the step changes.
+
+        Returns
+        -------
+        list
+            The filled column.
+
+        """
+        return [self.fill_column]
+
+    def run(self):
         """Short summary.
 
         Parameters
         ----------
-        values : type
-            Description of parameter `values`.
-        action : type
-            Description of parameter `action`.
-        column : type
-            Description of parameter `column`.
-        string_methods : type
-            Description of parameter `string_methods`.
+
 
         Returns
         -------
@@ -439,58 +1077,173 @@ class ConditionalFill(TransformationRule):
             Description of returned object.
 
         """
-        negation = ""
-        if "not" in action:
-            negation = "~"
-        expressions = []
-        for value in values:
-            if isinstance(value, str):
-                value = '"{0}"'.format(value)
-            expression = '({0}df["{1}"].str.{2}({3}))'.format(
-                negation, column, string_methods[action], value
-            )
-            expressions.append(expression)
-        if "!" in action or "not" in action:
-            expression = " & ".join(expressions)
-        else:
-            expression = " | ".join(expressions)
-        return expression
+        df = DataFlow.get_output_df(self.input_data_sets[-1], virtual_columns=True)
+        mask = self._get_condition_mask(
+            df, self.where_column, self.where_condition, self.where_condition_values
+        )
+        fill_column_values = df[self.fill_column]
+        if is_virtual_constant(fill_column_values):
+            fill_column_values = self._get_constant_fill_values(fill_column_values)
+        df[self.fill_column] = np.where(mask, self.fill_value, fill_column_values)
+        self.output_data_set = self.save_output(df)
 
-    def run(self):
-        """Short summary.
+    def _get_constant_fill_values(self, series):
+        """Get the values to fill a virtual constant column from.
 
         Parameters
         ----------
+        series : Series
+            Virtual constant column.
+
+        Returns
+        -------
+        scalar or Series
+            The constant when it is of the same kind as the fill value (numbers
+            or text), so the full column is never built, the dense column
+            otherwise, e.g. for text filled into a number column.
+
+        """
+        constant = series.sparse.fill_value
+        kinds = {np.asarray(value).dtype.kind for value in (self.fill_value, constant)}
+        if kinds <= set("biuf") or kinds == {"U"}:
+            return constant
+        return series.sparse.to_dense()
 
+    def _get_condition_mask(self, df, column, condition, values):
+        """Evaluate a condition on the rows of a Data Frame.
+
+        Parameters
+        ----------
+        df : Data Frame
+            Data Frame to evaluate, virtual constant columns used by the
+            condition are made dense.
+        column : str
+            Column the condition applies to.
+        condition : str
+            One of the supported conditions, e.g. == or contains.
+        values : list
+            Values (or column names) to compare against.
 
         Returns
         -------
-        type
-            Description of returned object.
+        array
+            Boolean mask of the rows that match.
 
         """
-        # TODO: If using contains or does not contain need to fillna
-        df = DataFlow.get_output_df(self.input_data_sets[-1])
         available_columns = df.columns.tolist()
-        if self.where_column not in available_columns:
+        if column not in available_columns:
             raise Exception(
                 "{0} is an invalid column name, needs to be one of {1}".format(
-                    self.where_column, ", ".join(available_columns)
+                    column, ", ".join(available_columns)
                 )
             )
+        if is_string_condition(condition):
+            masks = [
+                get_string_condition_mask(df[column], condition, value)
+                for value in values
+            ]
+            # Negated conditions have to hold for all the values
+            if "not" in condition:
+                return np.logical_and.reduce(masks)
+            return np.logical_or.reduce(masks)
+        for value in [column] + list(values):
+            if value in available_columns and is_virtual_constant(df[value]):
+                df[value] = df[value].sparse.to_dense()
         pd_expression = self._build_pandas_expression(
-            column=self.where_column,
-            action=self.where_condition,
-            values=self.where_condition_values,
-            df=df,
+            column=column, action=condition, values=values, df=df
         )
-        df[self.fill_column] = np.where(
-            eval(pd_expression), self.fill_value, df[self.fill_column]
+        return np.asarray(eval(pd_expression), dtype=bool)
+
+
+class CaseWhen(ConditionalFill):
+    column_name = None
+    cases = None
+    default = None
+
+    def __init__(self, column_name=None, cases=None, default=None, name=None):
+        """Fill a column with the value of the first case that matches each row.
+
+        Parameters
+        ----------
+        column_name : str
+            Column to fill, it is created if it does not exist.
+        cases : list
+            Ordered list of (where_column, where_condition,
+            where_condition_values, value) tuples, the conditions work like
+            in ConditionalFill.
+        default : scalar
+            Value for the rows that match no case, if None the current values
+            of `column_name` are kept (missing values if it does not exist).
+        name : str
+            Description of parameter `name`.
+
+        Returns
+        -------
+        None
+
+        """
+        self.column_name = column_name
+        self.cases = cases
+        self.default = default
+        self.name = name
+
+    def __repr__(self):
+        return "CaseWhen column: {}, cases: {}, default: {}".format(
+            self.column_name, self.cases, self.default
         )
-        self.output_data_set = DataFlow.save_output_df(df, self.name)
+
+    def get_modified_columns(self):
+        """Get the columns whose values the step changes.
+
+        Returns
+        -------
+        list
+            The filled column.
+
+        """
+        return [self.column_name]
+
+    def run(self):
+        """Evaluate all the cases in a single pass with np.select.
+
+        Parameters
+        ----------
+
+
+        Returns
+        -------
+        None
+
+        """
+        df = DataFlow.get_output_df(self.input_data_sets[-1], virtual_columns=True)
+        masks = []
+        values = []
+        for where_column, where_condition, where_condition_values, value in self.cases:
+            masks.append(
+                self._get_condition_mask(
+                    df, where_column, where_condition, where_condition_values
+                )
+            )
+            values.append(value)
+        default = self.default
+        if default is None and self.column_name in df.columns:
+            default = df[self.column_name]
+            if is_virtual_constant(default):
+                default = default.sparse.fill_value
+        elif default is None and not all(
+            np.asarray(value).dtype.kind in "biuf" for value in values
+        ):
+            # Missing text is None, np.nan has no common dtype with strings
+            default = None
+        elif default is None:
+            default = np.nan
+        df[self.column_name] = np.select(masks, values, default=default)
+        self.output_data_set = self.save_output(df)
 
 
 class ConstantColumn(TransformationRule):
+    keeps_row_order = True
+    row_local = True
     column_name = None
     column_value = None
 
@@ -516,6 +1269,17 @@ class ConstantColumn(TransformationRule):
         self.column_value = column_value
         self.name = name
 
+    def get_modified_columns(self):
+        """Get the columns whose values the step changes.
+
+        Returns
+        -------
+        list
+            The constant column.
+
+        """
+        return [self.column_name]
+
     def run(self):
         """Short summary.
 
@@ -529,13 +1293,18 @@ class ConstantColumn(TransformationRule):
             Description of returned object.
 
         """
-        df = DataFlow.get_output_df(self.input_data_sets[-1])
+        df = DataFlow.get_output_df(self.input_data_sets[-1], virtual_columns=True)
         # TODO: Add support for reference to other column
-        df[self.column_name] = self.column_value
-        self.output_data_set = DataFlow.save_output_df(df, self.name)
+        if is_virtual_constant_value(self.column_value):
+            df[self.column_name] = virtual_constant(self.column_value, df.index)
+        else:
+            df[self.column_name] = self.column_value
+        self.output_data_set = self.save_output(df)
 
 
 class FilterBy(TransformationRule):
+    keeps_row_order = True
+    row_local = True
     column_name = None
     filter_conditions = None
     condition_values = None
@@ -589,50 +1358,113 @@ class FilterBy(TransformationRule):
             assert (isinstance(condition_value, str) or isinstance(condition_value, int),
                     isinstance(condition_value, float) or isinstance(condition_value, bool))
 
-    def run(self):
+    def filter_df(self, df):
         """Filter a dataframe by comparing one column to other column or values
 
         Parameters
         ----------
+            df : Data Frame
+                dataframe to filter
+
+        Returns
+        -------
+        Data Frame
+            The rows of df that match all the conditions
 
+        """
+        for condition, value in zip(self.filter_conditions, self.condition_values):
+            if condition in COMPARISON_OPERATORS:
+                column = df[self.column_name]
+                if isinstance(value, str) and value in df.columns:
+                    column = get_comparable_values(column)
+                    value = get_comparable_values(df[value])
+                elif condition not in ("==", "!="):
+                    column = get_comparable_values(column)
+                df = df[COMPARISON_OPERATORS[condition](column, value)]
+            elif is_string_condition(condition):
+                df = df[
+                    get_string_condition_mask(df[self.column_name], condition, value)
+                ]
+        return df
+
+    def filter_sql(self, columns=None):
+        """Translate the conditions to a SQL where clause
+
+        Parameters
+        ----------
+            columns : list
+                columns of the queried table, condition values matching one of
+                them are compared against that column instead of a literal
 
         Returns
         -------
-        None
+        sqlalchemy clause
+            The conditions joined by AND
 
         """
-        df = DataFlow.get_output_df(self.input_data_sets[-1])
+        import sqlalchemy as sa
+
+        column = sa.column(self.column_name)
+        string_conditions = {
+            "contains": column.contains,
+            "starts with": column.startswith,
+            "ends with": column.endswith,
+        }
+        negated_conditions = {
+            "does not contain": "contains",
+            "does not start with": "starts with",
+            "does not end with": "ends with",
+        }
+        clauses = []
         for condition, value in zip(self.filter_conditions, self.condition_values):
-            if condition in ["==", '!=', ">", ">=", "<", "=<"]:
-                df = df.query(
-                    '{column} {condition} {value}'.format(column=self.column_name,
-                                                          condition=condition,
-                                                          value=value)
+            if condition in COMPARISON_OPERATORS:
+                if columns and isinstance(value, str) and value in columns:
+                    value = sa.column(value)
+                clauses.append(COMPARISON_OPERATORS[condition](column, value))
+            elif condition in string_conditions:
+                clauses.append(string_conditions[condition](value, autoescape=True))
+            elif condition in negated_conditions:
+                # Missing values never contain, start or end with anything
+                string_condition = string_conditions[negated_conditions[condition]]
+                clauses.append(
+                    sa.or_(column.is_(None), ~string_condition(value, autoescape=True))
                 )
-            elif condition == "contains":
-                df = df[df[self.column_name].contains(value)]
-            elif condition == "starts with":
-                df = df[df[self.column_name].startswith(value)]
-            elif condition == "ends with":
-                df = df[df[self.column_name].endswith(value)]
-            elif condition == "does not contain":
-                df = df[~df[self.column_name].contains(value)]
-            elif condition == "does not start with":
-                df = df[~df[self.column_name].startswith(value)]
-        self.output_data_set = DataFlow.save_output_df(df, self.name)
+        return sa.and_(*clauses)
+
+    def run(self):
+        """Filter the output of the previous step
+
+        Parameters
+        ----------
+
+
+        Returns
+        -------
+        None
+
+        """
+        df = DataFlow.get_output_df(self.input_data_sets[-1])
+        df = self.filter_df(df)
+        self.output_data_set = self.save_output(df)
 
 
 class FormatColumns(TransformationRule):
+    keeps_row_order = True
+    row_local = True
     column_formats = None
 
     def __init__(self, column_formats):
         """Short summary.
 
+        The formats are saved with the output and only applied when it is
+        exported (see DataFlow.export_output_df), the data keeps its types.
+
         Parameters
         ----------
             column_formats : str or dict
                 if a string is passed the format will be applied to the whole DF
                 if a dict is passed the keys are the columns and the values the formatting for each column
+                formats are format strings, e.g. "{:,.2f}"
 
         Returns
         -------
@@ -643,8 +1475,22 @@ class FormatColumns(TransformationRule):
     def __repr__(self):
         return "FormatColumns column_formats: {}".format(self.column_formats)
 
+    def _validate_formats(self):
+        formats = self.column_formats
+        if isinstance(formats, dict):
+            formats = list(formats.values())
+        else:
+            formats = [formats]
+        for column_format in formats:
+            if not isinstance(column_format, str):
+                raise Exception(
+                    "{0} is an invalid format, needs to be a format string".format(
+                        column_format
+                    )
+                )
+
     def run(self):
-        """Short summary.
+        """Record the formats in the metadata of the output.
 
         Parameters
         ----------
@@ -652,20 +1498,28 @@ class FormatColumns(TransformationRule):
 
         Returns
         -------
-        type
-            Description of returned object.
+        None
 
         """
-        df = DataFlow.get_output_df(self.input_data_sets[-1])
-        df = df.style.format(self.column_formats)
-        self.output_data_set = DataFlow.save_output_df(df, self.name)
+        self._validate_formats()
+        df = DataFlow.get_output_df(self.input_data_sets[-1], virtual_columns=True)
+        column_formats = self.column_formats
+        previous_formats = self.get_output_properties().get("column_formats")
+        if isinstance(column_formats, dict) and isinstance(previous_formats, dict):
+            column_formats = dict(previous_formats, **column_formats)
+        self.output_data_set = self.save_output(
+            df, metadata={"column_formats": column_formats}
+        )
 
 
 class MapValues(TransformationRule):
+    keeps_row_order = True
+    row_local = True
     column_name = None
     map_logic = None
+    max_workers = None
 
-    def __init__(self, column_name, map_logic):
+    def __init__(self, column_name, map_logic, max_workers=None):
         """Short summary.
 
         Parameters
@@ -673,7 +1527,12 @@ class MapValues(TransformationRule):
             column_name : str
                 name of the column to affect
             map_logic: dict or lambda
-                logic to transform current values to desired values
+                logic to transform current values to desired values, it is
+                applied once to each distinct value of the column
+            max_workers: int
+                if given, functions are evaluated in a pool of this many
+                processes when the column has many distinct values, the
+                function must be picklable (defined at module level)
 
 
         Returns
@@ -682,33 +1541,118 @@ class MapValues(TransformationRule):
         """
         self.column_name = column_name
         self.map_logic = map_logic
+        self.max_workers = max_workers
 
     def __repr__(self):
         return "MapValues series: {}, map_logic: {}".format(
             self.column_name, str(self.map_logic)
         )
 
-    def run(self):
-        """Transforms a series, part of a DF, using a the map function with a dictionary or lambda function as arg
+    def _map_values(self, values):
+        """Apply the map logic to distinct values.
 
         Parameters
         ----------
+            values : array
+                distinct values of the column
 
 
         Returns
         -------
+        Series
+            The mapped values, in the same order.
 
         """
-        df = DataFlow.get_output_df(self.input_data_sets[-1])
-        df[self.column_name] = df[self.column_name].map(self.map_logic)
-        self.output_data_set = DataFlow.save_output_df(df, self.name)
+        if (
+            callable(self.map_logic)
+            and self.max_workers
+            and len(values) >= MAP_PROCESS_MIN_VALUES
+        ):
+            chunk_size = max(1, len(values) // (self.max_workers * 4))
+            with ProcessPoolExecutor(max_workers=self.max_workers) as executor:
+                return pd.Series(
+                    list(executor.map(self.map_logic, values, chunksize=chunk_size))
+                )
+        return pd.Series(values).map(self.map_logic)
 
+    def get_modified_columns(self):
+        """Get the columns whose values the step changes.
 
-class PivotTable(TransformationRule):
-    group_columns = None
-    group_functions = None
-    group_values = None
-    preserve_order = True
+        Returns
+        -------
+        list
+            The mapped column.
+
+        """
+        return [self.column_name]
+
+    def run(self):
+        """Transforms a series, part of a DF, using a the map function with a dictionary or lambda function as arg
+
+        The column is factorized and only its distinct values are mapped, the
+        result is broadcast back to the rows with the codes. Categorical
+        columns only map their categories.
+
+        Parameters
+        ----------
+
+
+        Returns
+        -------
+
+        """
+        df = DataFlow.get_output_df(self.input_data_sets[-1], virtual_columns=True)
+        df[self.column_name] = self._map_column(df[self.column_name])
+        self.output_data_set = self.save_output(df)
+
+    def _map_column(self, series):
+        """Map a column through its distinct values.
+
+        Parameters
+        ----------
+            series : Series
+                column to map
+
+
+        Returns
+        -------
+        Series
+            The mapped column.
+
+        """
+        if is_virtual_constant(series):
+            value = self._map_values([series.sparse.fill_value]).iloc[0]
+            if is_virtual_constant_value(value):
+                return virtual_constant(value, series.index)
+            return pd.Series([value] * len(series), index=series.index)
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            codes = series.cat.codes.to_numpy()
+            uniques = series.cat.categories
+        else:
+            codes, uniques = pd.factorize(series)
+        missing = codes < 0
+        if missing.any():
+            # Empty values are mapped too, as Series.map does
+            uniques = list(uniques) + [series[missing].iloc[0]]
+            codes = np.where(missing, len(uniques) - 1, codes)
+        mapped = self._map_values(uniques)
+        if (
+            isinstance(series.dtype, pd.CategoricalDtype)
+            and len(mapped) == len(series.cat.categories)
+            and mapped.notna().all()
+            and mapped.is_unique
+        ):
+            return series.cat.rename_categories(mapped.tolist())
+        return pd.Series(mapped.array.take(codes), index=series.index)
+
+
+class PivotTable(TransformationRule):
+    group_columns = None
+    group_functions = None
+    group_values = None
+    preserve_order = True
+    state_name = None
+    watermark_column = None
 
     def __init__(
         self,
@@ -717,6 +1661,8 @@ class PivotTable(TransformationRule):
         group_values=None,
         name=None,
         preserve_order=True,
+        state_name=None,
+        watermark_column=None,
     ):
         """Short summary.
 
@@ -725,13 +1671,25 @@ class PivotTable(TransformationRule):
         group_columns : type
             Description of parameter `group_columns`.
         group_functions : type
-            Description of parameter `group_functions`.
+            Description of parameter `group_functions`. approx count distinct,
+            approx median and approx pNN (e.g. approx p95) are computed from
+            mergeable sketches, see sketches. approx first and approx last are
+            the same as first and last.
         group_values : type
             Description of parameter `group_values`.
         name : type
             Description of parameter `name`.
         preserve_order : type
             Description of parameter `preserve_order`.
+        state_name : str
+            Name of the Data Set holding the aggregates of the previous runs,
+            by default the name of the step followed by _state.
+        watermark_column : str
+            if set, the input is append-only by this column, each run only
+            aggregates the rows newer than the previous run and merges them
+            into the saved aggregates. Needs all the functions to be one of
+            INCREMENTAL_FUNCTIONS or approximate, otherwise everything is
+            aggregated again.
 
         Returns
         -------
@@ -744,6 +1702,8 @@ class PivotTable(TransformationRule):
         self.group_values = group_values
         self.name = name
         self.preserve_order = preserve_order
+        self.state_name = state_name
+        self.watermark_column = watermark_column
 
     def run(self):
         """Short summary.
@@ -758,9 +1718,10 @@ class PivotTable(TransformationRule):
             Description of returned object.
 
         """
-        df = DataFlow.get_output_df(self.input_data_sets[-1])
-        available_columns = df.columns.tolist()
+        available_columns = DataFlow.get_output_columns(self.input_data_sets[-1])
         requested_columns = self.group_columns + self.group_values
+        if self.watermark_column is not None:
+            requested_columns = requested_columns + [self.watermark_column]
         for requested_column in requested_columns:
             if requested_column not in available_columns:
                 raise Exception(
@@ -772,18 +1733,283 @@ class PivotTable(TransformationRule):
         # First add the cols provided for the pivot
         for key, column in enumerate(self.group_values):
             group_function = self.group_functions[key]
+            group_function = GROUP_FUNCTION_ALIASES.get(group_function, group_function)
             if group_function == "unique":
                 group_function = lambda x: ", ".join(set(str(v) for v in x if v))
             pivot_functions[column] = group_function
-        # Add not specified ones with default (pandas uses mean)
-        df = df[requested_columns]
-        pivot_df = df.pivot_table(
-            index=self.group_columns, values=self.group_values, aggfunc=pivot_functions
+        metadata = DataFlow.get_output_metadata(self.input_data_sets[-1])
+        if self.watermark_column is not None:
+            pivot_df = self._pivot_incremental(pivot_functions, metadata)
+        else:
+            # Add not specified ones with default (pandas uses mean)
+            df = DataFlow.get_output_df(self.input_data_sets[-1])
+            pivot_df = self._pivot(df[requested_columns], pivot_functions, metadata)
+        for column, group_function in pivot_functions.items():
+            if is_approximate_function(group_function):
+                pivot_df[column] = finalize_states(group_function, pivot_df[column])
+        self.output_data_set = self.save_output(
+            pivot_df,
+            metadata={
+                "sort_keys": [[column, True] for column in self.group_columns],
+                "unique_keys": [list(self.group_columns)],
+            },
+        )
+
+    def _pivot(self, df, pivot_functions, metadata):
+        """Aggregate the value columns by the group columns.
+
+        Parameters
+        ----------
+        df : Data Frame
+            Group and value columns.
+        pivot_functions : dict
+            Aggregation of each value column.
+        metadata : dict
+            Metadata of the input.
+
+        Returns
+        -------
+        Data Frame
+            One row per group, sorted by the group columns. Approximate
+            functions give the state of each group (see sketches.build_states)
+            instead of the result.
+
+        """
+        df = df[self.group_columns + list(pivot_functions)]
+        approximate_functions = {
+            column: group_function
+            for column, group_function in pivot_functions.items()
+            if is_approximate_function(group_function)
+        }
+        exact_functions = {
+            column: group_function
+            for column, group_function in pivot_functions.items()
+            if column not in approximate_functions
+        }
+        if not approximate_functions:
+            return self._pivot_exact(df, exact_functions, metadata)
+        grouped = df.groupby(self.group_columns, sort=True, observed=True)
+        codes = grouped.ngroup().fillna(-1).astype(np.int64).to_numpy()
+        pivot_df = grouped.size().reset_index()[self.group_columns]
+        for column, group_function in approximate_functions.items():
+            pivot_df[column] = build_states(
+                group_function, df[column], codes, len(pivot_df)
+            )
+        if exact_functions:
+            pivot_df = pivot_df.merge(
+                self._pivot_exact(
+                    df[self.group_columns + list(exact_functions)],
+                    exact_functions,
+                    metadata,
+                ),
+                how="left",
+                on=self.group_columns,
+            )
+        return pivot_df[self.group_columns + sorted(pivot_functions)]
+
+    def _pivot_exact(self, df, pivot_functions, metadata):
+        if are_groups_contiguous(metadata, self.group_columns):
+            return self._pivot_contiguous(df, pivot_functions, metadata)
+        return df.pivot_table(
+            index=self.group_columns,
+            values=list(pivot_functions),
+            aggfunc=pivot_functions,
+            observed=True,
         ).reset_index()
-        self.output_data_set = DataFlow.save_output_df(pivot_df, self.name)
+
+    def is_reusable(self):
+        return self.watermark_column is None
+
+    def _get_pivot_definition(self):
+        return {
+            "group_columns": self.group_columns,
+            "group_functions": self.group_functions,
+            "group_values": self.group_values,
+            "input_data_set": self.input_data_sets[-1],
+            "watermark_column": self.watermark_column,
+        }
+
+    def _read_newer_rows(self, watermark):
+        """Read the rows of the input newer than the watermark.
+
+        Row groups whose statistics show no newer rows are not read.
+
+        Parameters
+        ----------
+        watermark : scalar
+            Largest value of the watermark column already aggregated, all
+            rows are read if None.
+
+        Returns
+        -------
+        Data Frame
+            Group, value and watermark columns of the newer rows.
+
+        """
+        input_path = DataFlow.get_output_path(self.input_data_sets[-1])
+        schema = pq.read_schema(input_path)
+        constants = DataFlow._read_metadata(schema).get("constants", {})
+        columns = list(
+            dict.fromkeys(
+                self.group_columns + self.group_values + [self.watermark_column]
+            )
+        )
+        filters = None
+        if watermark is not None:
+            if pa.types.is_timestamp(schema.field(self.watermark_column).type):
+                watermark = pd.Timestamp(watermark)
+            filters = [(self.watermark_column, ">", watermark)]
+        df = pq.read_table(
+            input_path,
+            columns=[column for column in columns if column not in constants],
+            filters=filters,
+        ).to_pandas()
+        for column in columns:
+            if column in constants:
+                df[column] = constants[column]
+        return df
+
+    def _pivot_incremental(self, pivot_functions, metadata):
+        """Aggregate the newer rows of the input and merge the saved aggregates.
+
+        Parameters
+        ----------
+        pivot_functions : dict
+            Aggregation of each value column.
+        metadata : dict
+            Metadata of the input.
+
+        Returns
+        -------
+        Data Frame
+            One row per group of all the rows, sorted by the group columns,
+            with the states of the approximate functions.
+
+        """
+        state_name = self.state_name or "{0}_state".format(self.name)
+        definition = self._get_pivot_definition()
+        state_metadata = {}
+        if os.path.exists(DataFlow.get_output_path(state_name)):
+            state_metadata = DataFlow.get_output_metadata(state_name)
+        is_mergeable = all(
+            group_function in INCREMENTAL_FUNCTIONS
+            or is_approximate_function(group_function)
+            for group_function in pivot_functions.values()
+        )
+        watermark = None
+        if is_mergeable and state_metadata.get("pivot_definition") == definition:
+            watermark = state_metadata.get("watermark")
+        elif not is_mergeable:
+            logger.info(
+                "Step {0} aggregates all the rows, not all of {1} are "
+                "incremental".format(self.name, self.group_functions)
+            )
+        df = self._read_newer_rows(watermark)
+        if watermark is not None:
+            logger.info(
+                "Step {0} merging {1} rows newer than {2}".format(
+                    self.name, len(df), watermark
+                )
+            )
+            state_df = DataFlow.get_output_df(state_name)
+            if not len(df):
+                return state_df
+            pivot_df = (
+                pd.concat(
+                    [state_df, self._pivot(df, pivot_functions, metadata)],
+                    ignore_index=True,
+                )
+                .groupby(self.group_columns, sort=True, observed=True)
+                .agg(
+                    {
+                        column: INCREMENTAL_FUNCTIONS.get(group_function)
+                        or functools.partial(merge_states, group_function)
+                        for column, group_function in pivot_functions.items()
+                    }
+                )
+                .reset_index()
+            )
+            pivot_df = pivot_df[self.group_columns + sorted(pivot_functions)]
+        else:
+            pivot_df = self._pivot(df, pivot_functions, metadata)
+        if is_mergeable:
+            if len(df):
+                watermark = df[self.watermark_column].max()
+                if isinstance(watermark, pd.Timestamp):
+                    watermark = watermark.isoformat()
+                elif isinstance(watermark, np.generic):
+                    watermark = watermark.item()
+            DataFlow.save_output_df(
+                pivot_df,
+                state_name,
+                metadata={"pivot_definition": definition, "watermark": watermark},
+            )
+        return pivot_df
+
+    def _pivot_contiguous(self, df, pivot_functions, metadata):
+        """Aggregate groups whose rows are known to be contiguous.
+
+        The groups are found comparing each row with the previous one instead
+        of hashing and sorting the group columns, the result is the same as
+        pivot_table.
+
+        Parameters
+        ----------
+        df : Data Frame
+            Group and value columns.
+        pivot_functions : dict
+            Aggregation of each value column.
+        metadata : dict
+            Metadata of the input.
+
+        Returns
+        -------
+        Data Frame
+            One row per group, sorted by the group columns.
+
+        """
+        keys = df[self.group_columns]
+        # pivot_table leaves out rows with empty group values
+        has_keys = keys.notna().all(axis=1).to_numpy()
+        if not has_keys.all():
+            df = df[has_keys]
+            keys = keys[has_keys]
+        is_start = np.zeros(len(df), dtype=bool)
+        is_start[:1] = True
+        for column in self.group_columns:
+            values = keys[column]
+            if isinstance(values.dtype, pd.CategoricalDtype):
+                values = values.cat.codes
+            values = values.to_numpy()
+            is_start[1:] |= values[1:] != values[:-1]
+        starts = np.flatnonzero(is_start)
+        pivot_df = (
+            df[list(pivot_functions)]
+            .groupby(np.cumsum(is_start) - 1, sort=False)
+            .agg(pivot_functions)
+            .reset_index(drop=True)
+        )
+        for column in pivot_functions:
+            # pivot_table casts integral results back to integers
+            if pd.api.types.is_integer_dtype(
+                df[column]
+            ) and pd.api.types.is_float_dtype(pivot_df[column]):
+                values = pivot_df[column]
+                if values.notna().all() and (values == np.round(values)).all():
+                    pivot_df[column] = values.astype(df[column].dtype)
+        pivot_df = pd.concat(
+            [keys.iloc[starts].reset_index(drop=True), pivot_df], axis=1
+        ).dropna(how="all", subset=list(pivot_functions))
+        if not is_sorted_by(metadata, self.group_columns):
+            pivot_df = pivot_df.sort_values(self.group_columns, kind="stable")
+        return pivot_df[self.group_columns + sorted(pivot_functions)].reset_index(
+            drop=True
+        )
 
 
 class RemoveColumns(TransformationRule):
+    keeps_row_order = True
+    row_local = True
     column_names = None
 
     def __init__(self, column_names):
@@ -804,7 +2030,7 @@ class RemoveColumns(TransformationRule):
         return "RemoveColumns: {}".format(self.column_names)
 
     def run(self):
-        """Short summary.
+        """Remove the columns, only the kept ones are read and written.
 
         Parameters
         ----------
@@ -812,21 +2038,32 @@ class RemoveColumns(TransformationRule):
 
         Returns
         -------
-        type
-            Description of returned object.
+        None
 
         """
-        df = DataFlow.get_output_df(self.input_data_sets[-1])
+        columns = DataFlow.get_output_columns(self.input_data_sets[-1])
         for col in self.column_names:
-            del df[col]
-        self.output_data_set = DataFlow.save_output_df(df, self.name)
+            if col not in columns:
+                raise Exception(
+                    "{0} is an invalid column, needs to be one of {1}".format(
+                        col, ", ".join(columns)
+                    )
+                )
+        self.output_data_set = self.save_projection(
+            [col for col in columns if col not in self.column_names]
+        )
 
 
 class RemoveDuplicateRows(TransformationRule):
+    keeps_row_order = True
+    chunk_size = 100000
     columns_subset = None
     keep = False
+    memory_budget = None
 
-    def __init__(self, columns_subset=None, keep=False):
+    def __init__(
+        self, columns_subset=None, keep=False, chunk_size=100000, memory_budget=None
+    ):
         """Short summary.
 
         Parameters
@@ -835,14 +2072,22 @@ class RemoveDuplicateRows(TransformationRule):
             Names of the columns in which to search for duplicates
         keep : str
             if first or last, drop duplicates except first or last occurrence
+        chunk_size : int
+            rows read at a time when memory_budget is set
+        memory_budget : int
+            if set, the input is streamed and the keys kept in memory take at
+            most about this many bytes, beyond that they are split by hash into
+            files on disk and each file is deduplicated on its own
 
         Returns
         -------
         None
 
         """
+        self.chunk_size = chunk_size
         self.columns_subset = columns_subset
         self.keep = keep
+        self.memory_budget = memory_budget
 
     def __repr__(self):
         return "RemoveDuplicateRows columns_subset: {}, keep: {}".format(
@@ -855,8 +2100,188 @@ class RemoveDuplicateRows(TransformationRule):
                 self.keep == "first" or self.keep == "last"
             ), "keep can only be 'first', 'last' or None"
 
+    def _mark_kept_rows(self, keys, kept_rows):
+        """Flag the rows of some keys that are not duplicates.
+
+        Parameters
+        ----------
+        keys : Data Frame
+            Key columns and the _row position of each row, all the rows with
+            the same key must be included, in order.
+        kept_rows : array
+            Boolean flag of each row of the input, updated in place.
+
+        Returns
+        -------
+        None
+
+        """
+        key_columns = [column for column in keys.columns if column != "_row"]
+        duplicated = keys.duplicated(subset=key_columns, keep=self.keep).to_numpy()
+        kept_rows[keys["_row"].to_numpy()[~duplicated]] = True
+
+    def _spill_keys(self, keys, spill_dir, spill_count):
+        """Write keys to disk split by the hash of their values.
+
+        Parameters
+        ----------
+        keys : Data Frame
+            Key columns and the _row position of each row.
+        spill_dir : str
+            Directory of the spilled files.
+        spill_count : int
+            Number of previous spills, to name the files.
+
+        Returns
+        -------
+        None
+
+        """
+        key_columns = [column for column in keys.columns if column != "_row"]
+        hashes = pd.util.hash_pandas_object(keys[key_columns], index=False).to_numpy()
+        partitions = hashes % DEDUPLICATE_SPILL_PARTITIONS
+        for partition in np.unique(partitions):
+            file_name = "{0}_{1:08d}.pkl".format(partition, spill_count)
+            keys[partitions == partition].to_pickle(os.path.join(spill_dir, file_name))
+
+    def _get_kept_rows(self, columns, spill_dir):
+        """Find the rows to keep streaming the key columns of the input.
+
+        Keys are kept in memory until they exceed memory_budget, then they
+        are spilled to disk by hash, so equal keys always end up in the same
+        file, and each file is deduplicated exactly with pandas.
+
+        Parameters
+        ----------
+        columns : list
+            Key columns.
+        spill_dir : str
+            Directory for the spilled files.
+
+        Returns
+        -------
+        array
+            Boolean flag of each row of the input, True to keep it.
+
+        """
+        row_count = 0
+        buffered_keys = []
+        buffered_size = 0
+        spill_count = 0
+        for chunk in DataFlow.iter_output_df(
+            self.input_data_sets[-1], self.chunk_size, columns=columns
+        ):
+            keys = chunk.reset_index(drop=True)
+            if keys.columns.empty:
+                # Only virtual constants, all the rows are equal
+                keys["_key"] = np.zeros(len(keys), dtype=np.int8)
+            keys["_row"] = np.arange(row_count, row_count + len(keys))
+            row_count += len(keys)
+            if spill_count == 0:
+                buffered_keys.append(keys)
+                buffered_size += get_memory_usage(keys)
+                if buffered_size <= self.memory_budget:
+                    continue
+                keys = pd.concat(buffered_keys, ignore_index=True)
+                buffered_keys = []
+            self._spill_keys(keys, spill_dir, spill_count)
+            spill_count += 1
+        kept_rows = np.zeros(row_count, dtype=bool)
+        if buffered_keys:
+            self._mark_kept_rows(pd.concat(buffered_keys), kept_rows)
+        spill_files = {}
+        for file_name in sorted(os.listdir(spill_dir)):
+            partition = file_name.split("_")[0]
+            spill_files.setdefault(partition, []).append(file_name)
+        for file_names in spill_files.values():
+            keys = pd.concat(
+                [
+                    pd.read_pickle(os.path.join(spill_dir, file_name))
+                    for file_name in file_names
+                ]
+            )
+            self._mark_kept_rows(keys, kept_rows)
+        return kept_rows
+
+    def _run_external(self):
+        """Remove duplicates without loading the input in memory.
+
+        Returns
+        -------
+        str
+            Name of the output Data Set.
+
+        """
+        metadata = DataFlow.get_output_metadata(self.input_data_sets[-1])
+        constants = metadata.get("constants", {})
+        metadata = self._get_output_metadata(
+            DataFlow.get_output_columns(self.input_data_sets[-1]),
+            dict(metadata, **self._get_unique_metadata()),
+        )
+        columns = None
+        if self.columns_subset:
+            # Virtual constants are equal in all rows
+            columns = [
+                column for column in self.columns_subset if column not in constants
+            ]
+        with tempfile.TemporaryDirectory() as spill_dir:
+            kept_rows = self._get_kept_rows(columns, spill_dir)
+        position = 0
+        input_path = DataFlow.get_output_path(self.input_data_sets[-1])
+        with OutputWriter(
+            self.name, metadata, schema=pq.read_schema(input_path)
+        ) as writer:
+            for chunk in DataFlow.iter_output_df(
+                self.input_data_sets[-1], self.chunk_size
+            ):
+                writer.write(chunk[kept_rows[position : position + len(chunk)]])
+                position += len(chunk)
+        return self.name
+
+    def _get_unique_metadata(self):
+        if not self.columns_subset:
+            return {}
+        return {"unique_keys": [list(self.columns_subset)]}
+
+    def _drop_adjacent_duplicates(self, df, columns):
+        """Remove duplicates that are known to be next to each other.
+
+        Parameters
+        ----------
+        df : Data Frame
+            Rows where equal keys are contiguous.
+        columns : list
+            Key columns.
+
+        Returns
+        -------
+        Data Frame
+            The same rows as drop_duplicates, found comparing each row only
+            with the previous one.
+
+        """
+        same_as_previous = np.ones(max(len(df) - 1, 0), dtype=bool)
+        for column in columns:
+            values = df[column]
+            if isinstance(values.dtype, pd.CategoricalDtype):
+                values = values.cat.codes
+            values = values.to_numpy()
+            is_nan = pd.isna(values)
+            same_as_previous &= (values[1:] == values[:-1]) | (is_nan[1:] & is_nan[:-1])
+        duplicated_previous = np.append(False, same_as_previous)
+        duplicated_next = np.append(same_as_previous, False)
+        if self.keep == "first":
+            return df[~duplicated_previous]
+        if self.keep == "last":
+            return df[~duplicated_next]
+        return df[~(duplicated_previous | duplicated_next)]
+
     def run(self):
-        """Short summary.
+        """Remove the duplicated rows of the previous output.
+
+        When the input is known to have no duplicates it is kept as is, and
+        when equal keys are known to be contiguous each row is only compared
+        with the previous one.
 
         Parameters
         ----------
@@ -864,16 +2289,28 @@ class RemoveDuplicateRows(TransformationRule):
 
         Returns
         -------
-        type
-            Description of returned object.
+        None
 
         """
+        if self.memory_budget is not None:
+            self.output_data_set = self._run_external()
+            return
+        metadata = DataFlow.get_output_metadata(self.input_data_sets[-1])
         df = DataFlow.get_output_df(self.input_data_sets[-1])
-        df = df.drop_duplicates(subset=self.columns_subset, keep=self.keep)
-        self.output_data_set = DataFlow.save_output_df(df, self.name)
+        columns = list(self.columns_subset or df.columns)
+        if has_unique_key(metadata, columns):
+            logger.info("{0} has no duplicates, keeping all rows".format(self.name))
+        elif are_groups_contiguous(metadata, columns):
+            df = self._drop_adjacent_duplicates(df, columns)
+        else:
+            df = df.drop_duplicates(subset=self.columns_subset, keep=self.keep)
+        self.output_data_set = self.save_output(
+            df, metadata=self._get_unique_metadata()
+        )
 
 
 class RenameColumns(TransformationRule):
+    row_local = True
     columns = None
 
     def __init__(self, columns):
@@ -894,6 +2331,41 @@ class RenameColumns(TransformationRule):
     def __repr__(self):
         return "RenameColumns columns: {}".format(self.columns)
 
+    def get_output_properties(self):
+        """Get the physical properties of the input with the new column names.
+
+        Returns
+        -------
+        dict
+            sort_keys, partition_keys and unique_keys of the input.
+
+        """
+        properties = DataFlow.get_output_metadata(self.input_data_sets[-1])
+        properties = keep_valid_properties(
+            properties, DataFlow.get_output_columns(self.input_data_sets[-1])
+        )
+        if "sort_keys" in properties:
+            properties["sort_keys"] = [
+                [self.columns.get(column, column), ascending]
+                for column, ascending in properties["sort_keys"]
+            ]
+        if "partition_keys" in properties:
+            properties["partition_keys"] = [
+                self.columns.get(column, column)
+                for column in properties["partition_keys"]
+            ]
+        if "unique_keys" in properties:
+            properties["unique_keys"] = [
+                [self.columns.get(column, column) for column in keys]
+                for keys in properties["unique_keys"]
+            ]
+        if isinstance(properties.get("column_formats"), dict):
+            properties["column_formats"] = {
+                self.columns.get(column, column): column_format
+                for column, column_format in properties["column_formats"].items()
+            }
+        return properties
+
     def run(self):
         """Changes the DF column names using a dictionary
 
@@ -907,18 +2379,62 @@ class RenameColumns(TransformationRule):
         """
         df = DataFlow.get_output_df(self.input_data_sets[-1])
         df = df.rename(columns=self.columns)
-        self.output_data_set = DataFlow.save_output_df(df, self.name)
+        self.output_data_set = self.save_output(df)
 
 
 class ReplaceText(TransformationRule):
+    keeps_row_order = True
+    row_local = True
     column = None
     replace_pattern = None
     replace_pattern_is_regex = False
     replace_value = None
     replace_column = None
 
-    def __init__(self):
-        """Short summary.
+    def __init__(
+        self,
+        column,
+        replace_pattern,
+        replace_pattern_is_regex=False,
+        replace_value="",
+        replace_column=None,
+    ):
+        """Replace a text or regular expression in a column.
+
+        Parameters
+        ----------
+            column : str
+                name of the column with the text
+            replace_pattern : str
+                text to look for, or regular expression if
+                replace_pattern_is_regex
+            replace_pattern_is_regex : bool
+                if the pattern is a regular expression, groups can be used in
+                replace_value as \\1
+            replace_value : str
+                text that replaces every match
+            replace_column : str
+                name of the column where the result is stored, column is
+                replaced if empty
+
+        Returns
+        -------
+
+        """
+        self.column = column
+        self.replace_pattern = replace_pattern
+        self.replace_pattern_is_regex = replace_pattern_is_regex
+        self.replace_value = replace_value
+        self.replace_column = replace_column
+        self._compiled_pattern = None
+
+    def __repr__(self):
+        return "ReplaceText column: {}, pattern: {}, value: {}".format(
+            self.column, self.replace_pattern, self.replace_value
+        )
+
+    def _get_compiled_pattern(self):
+        """Compile the pattern once for the fallback replacement.
 
         Parameters
         ----------
@@ -926,14 +2442,106 @@ class ReplaceText(TransformationRule):
 
         Returns
         -------
-        type
-            Description of returned object.
+        Pattern
+            The compiled pattern, escaped if it is not a regular expression.
 
         """
-        pass
+        if self._compiled_pattern is None:
+            pattern = self.replace_pattern
+            if not self.replace_pattern_is_regex:
+                pattern = re.escape(pattern)
+            self._compiled_pattern = re.compile(pattern)
+        return self._compiled_pattern
+
+    def _replace_values(self, values):
+        """Replace the pattern in some values.
+
+        Arrow string kernels are used when possible, patterns Arrow (RE2) does
+        not support, like look-arounds, and non text values fall back to the
+        compiled Python pattern.
+
+        Parameters
+        ----------
+            values : array
+                values to replace the pattern in
+
+
+        Returns
+        -------
+        Series
+            The values with the pattern replaced, non text values are empty.
+
+        """
+        try:
+            array = pa.array(values, type=pa.string(), from_pandas=True)
+            if self.replace_pattern_is_regex:
+                array = pc.replace_substring_regex(
+                    array, pattern=self.replace_pattern, replacement=self.replace_value
+                )
+            else:
+                array = pc.replace_substring(
+                    array, pattern=self.replace_pattern, replacement=self.replace_value
+                )
+            return pd.Series(array.to_numpy(zero_copy_only=False))
+        except (pa.ArrowInvalid, pa.ArrowNotImplementedError, pa.ArrowTypeError):
+            replace_value = self.replace_value
+            if not self.replace_pattern_is_regex:
+                replace_value = replace_value.replace("\\", "\\\\")
+            text = pd.Series(values, dtype=object)
+            # Like in Arrow non text values are empty, .str rejects columns
+            # without any text
+            text = text.where(text.map(lambda value: isinstance(value, str)), None)
+            return text.str.replace(
+                self._get_compiled_pattern(), replace_value, regex=True
+            )
+
+    def _replace_column(self, series):
+        """Replace the pattern in a column.
+
+        Parameters
+        ----------
+            series : Series
+                column with the text
+
+
+        Returns
+        -------
+        Series
+            The column with the pattern replaced, categorical columns only
+            replace their categories and stay categorical.
+
+        """
+        if is_virtual_constant(series):
+            value = self._replace_values([series.sparse.fill_value]).iloc[0]
+            return virtual_constant(value, series.index)
+        if not isinstance(series.dtype, pd.CategoricalDtype):
+            return pd.Series(
+                self._replace_values(series).to_numpy(), index=series.index
+            )
+        categories = self._replace_values(series.cat.categories)
+        if categories.is_unique:
+            return series.cat.rename_categories(categories.tolist())
+        # Different categories can end up as the same text
+        category_codes, categories = pd.factorize(categories)
+        codes = series.cat.codes.to_numpy()
+        codes = np.where(codes < 0, -1, category_codes[codes])
+        return pd.Series(
+            pd.Categorical.from_codes(codes, categories=categories), index=series.index
+        )
+
+    def get_modified_columns(self):
+        """Get the columns whose values the step changes.
+
+        Returns
+        -------
+        list
+            The column with the result.
+
+        """
+        return [self.replace_column or self.column]
 
     def run(self):
-        """Short summary.
+        """Replace the pattern in the column and save the result.
 
         Parameters
         ----------
@@ -941,14 +2549,16 @@ class ReplaceText(TransformationRule):
 
         Returns
         -------
-        type
-            Description of returned object.
 
         """
-        pass
+        df = DataFlow.get_output_df(self.input_data_sets[-1], virtual_columns=True)
+        df[self.replace_column or self.column] = self._replace_column(df[self.column])
+        self.output_data_set = self.save_output(df)
 
 
 class SelectColumns(TransformationRule):
+    keeps_row_order = True
+    row_local = True
     keep_columns = None
 
     def __init__(self, keep_columns):
@@ -969,7 +2579,7 @@ class SelectColumns(TransformationRule):
         return "SelectColumns: {}".format(self.keep_columns)
 
     def run(self):
-        """Keep the columns of the DF in the list
+        """Keep the columns of the DF in the list, only those are read and written
 
         Parameters
         ----------
@@ -979,28 +2589,72 @@ class SelectColumns(TransformationRule):
         -------
 
         """
-        df = DataFlow.get_output_df(self.input_data_sets[-1])
-        df = df[self.keep_columns]
-        self.output_data_set = DataFlow.save_output_df(df, self.name)
+        columns = DataFlow.get_output_columns(self.input_data_sets[-1])
+        for col in self.keep_columns:
+            if col not in columns:
+                raise Exception(
+                    "{0} is an invalid column, needs to be one of {1}".format(
+                        col, ", ".join(columns)
+                    )
+                )
+        self.output_data_set = self.save_projection(self.keep_columns)
+
+
+class _Descending:
+    """Sort key that compares in reverse order."""
+
+    __slots__ = ("value",)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __eq__(self, other):
+        return self.value == other.value
+
+    def __lt__(self, other):
+        return other.value < self.value
 
 
 class SortValuesBy(TransformationRule):
+    chunk_size = 100000
+    limit = None
+    memory_budget = None
     sort_columns = None
     sort_ascending = None
 
-    def __init__(self, sort_columns, sort_ascending):
-        """Short summary.
+    def __init__(
+        self,
+        sort_columns,
+        sort_ascending,
+        chunk_size=100000,
+        limit=None,
+        memory_budget=None,
+    ):
+        """Sort the rows by some columns.
 
         Parameters
         ----------
-
+        sort_columns : list
+            Columns to sort by, the first one is the most significant.
+        sort_ascending : bool or list
+            Direction of all the columns or of each one.
+        chunk_size : int
+            Rows read at a time when memory_budget is set.
+        limit : int
+            If set only the first rows are kept, they are selected without
+            sorting all the rows.
+        memory_budget : int
+            If set the input is streamed, sorted in runs of about this many
+            bytes that are saved to disk and merged.
 
         Returns
         -------
-        type
-            Description of returned object.
+        None
 
         """
+        self.chunk_size = chunk_size
+        self.limit = limit
+        self.memory_budget = memory_budget
         self.sort_columns = sort_columns
         self.sort_ascending = sort_ascending
 
@@ -1009,8 +2663,303 @@ class SortValuesBy(TransformationRule):
             self.sort_columns, self.sort_ascending
         )
 
+    def _get_ascending(self):
+        if isinstance(self.sort_ascending, (list, tuple)):
+            return list(self.sort_ascending)
+        return [self.sort_ascending is not False] * len(self.sort_columns)
+
+    def get_output_properties(self):
+        """Get the physical properties of the input kept after sorting.
+
+        Returns
+        -------
+        dict
+            The unique keys of the input.
+
+        """
+        metadata = DataFlow.get_output_metadata(self.input_data_sets[-1])
+        properties = keep_valid_properties(
+            metadata, DataFlow.get_output_columns(self.input_data_sets[-1])
+        )
+        return {"unique_keys": properties.get("unique_keys", [])}
+
+    def _get_sort_metadata(self):
+        return {
+            "sort_keys": [
+                [column, ascending]
+                for column, ascending in zip(self.sort_columns, self._get_ascending())
+            ]
+        }
+
+    def _add_sort_keys(self, df, position, constants):
+        """Add the columns the rows are sorted by.
+
+        Categoricals are compared by value, since chunks can have their
+        categories in different orders, and the position of each row breaks
+        ties so that the sort is stable.
+
+        Parameters
+        ----------
+        df : Data Frame
+            Rows to sort.
+        position : int
+            Position of the first row in the input.
+        constants : dict
+            Virtual constant columns, they do not change the order.
+
+        Returns
+        -------
+        Data Frame
+            The rows with _sort_key_N and _row columns.
+
+        """
+        sort_keys = {}
+        for key, column in enumerate(self.sort_columns):
+            if column in constants:
+                continue
+            values = df[column]
+            if isinstance(values.dtype, pd.CategoricalDtype):
+                values = values.astype(values.cat.categories.dtype)
+            sort_keys["_sort_key_{0}".format(key)] = values
+        sort_keys["_row"] = np.arange(position, position + len(df))
+        return df.assign(**sort_keys)
+
+    @staticmethod
+    def _drop_sort_keys(df):
+        return df.drop(
+            columns=[
+                column
+                for column in df.columns
+                if column == "_row" or column.startswith("_sort_key_")
+            ]
+        )
+
+    def _sort_keyed(self, df):
+        """Sort rows with the columns added by _add_sort_keys.
+
+        Parameters
+        ----------
+        df : Data Frame
+            Rows with sort keys.
+
+        Returns
+        -------
+        Data Frame
+            The sorted rows.
+
+        """
+        columns = []
+        ascending = []
+        for key, column_ascending in enumerate(self._get_ascending()):
+            if "_sort_key_{0}".format(key) in df.columns:
+                columns.append("_sort_key_{0}".format(key))
+                ascending.append(column_ascending)
+        return df.sort_values(columns + ["_row"], ascending=ascending + [True])
+
+    def _get_top_rows(self, df):
+        """Select the first limit rows of some rows with sort keys.
+
+        On numeric and date first keys only the rows up to the limit-th value
+        (found with a partial selection) are sorted.
+
+        Parameters
+        ----------
+        df : Data Frame
+            Rows with sort keys.
+
+        Returns
+        -------
+        Data Frame
+            The first limit rows, sorted.
+
+        """
+        first_key = next(
+            (column for column in df.columns if column.startswith("_sort_key_")),
+            None,
+        )
+        if len(df) > self.limit and first_key is not None:
+            series = df[first_key]
+            values = None
+            if pd.api.types.is_datetime64_any_dtype(series):
+                values = series.to_numpy().view(np.int64).astype(np.float64)
+                values[series.isna().to_numpy()] = np.nan
+            elif pd.api.types.is_numeric_dtype(series):
+                values = series.to_numpy(dtype=np.float64, na_value=np.nan)
+            if values is not None:
+                if not self._get_ascending()[int(first_key[len("_sort_key_") :])]:
+                    values = -values
+                # Empty values go last
+                values = np.where(np.isnan(values), np.inf, values)
+                threshold = np.partition(values, self.limit - 1)[self.limit - 1]
+                df = df[values <= threshold]
+        return self._sort_keyed(df).head(self.limit)
+
+    def _write_runs(self, run_dir, constants):
+        """Sort the input in runs that fit in memory_budget and save them.
+
+        Parameters
+        ----------
+        run_dir : str
+            Directory for the runs.
+        constants : dict
+            Virtual constant columns of the input.
+
+        Returns
+        -------
+        list
+            For each run, the paths of its blocks of chunk_size rows.
+
+        """
+        runs = []
+        buffered = []
+        buffered_size = 0
+        position = 0
+        chunks = DataFlow.iter_output_df(self.input_data_sets[-1], self.chunk_size)
+        for chunk in chunks:
+            buffered.append(self._add_sort_keys(chunk, position, constants))
+            buffered_size += get_memory_usage(buffered[-1])
+            position += len(chunk)
+            if buffered_size <= self.memory_budget:
+                continue
+            runs.append(self._write_run(run_dir, len(runs), buffered))
+            buffered = []
+            buffered_size = 0
+        if buffered:
+            runs.append(self._write_run(run_dir, len(runs), buffered))
+        return runs
+
+    def _write_run(self, run_dir, run, chunks):
+        df = self._sort_keyed(pd.concat(chunks))
+        paths = []
+        for start in range(0, len(df), self.chunk_size):
+            paths.append(
+                os.path.join(run_dir, "{0:06d}_{1:08d}.pkl".format(run, len(paths)))
+            )
+            df.iloc[start : start + self.chunk_size].to_pickle(paths[-1])
+        return paths
+
+    def _get_row_keys(self, df):
+        """Get the key each row is merged by.
+
+        Keys compare like _sort_keyed sorts: by the sort keys in their
+        direction with empty values last, then by the position of the row.
+
+        Parameters
+        ----------
+        df : Data Frame
+            Rows with sort keys.
+
+        Returns
+        -------
+        iterator
+            The key of each row.
+
+        """
+        keys = []
+        for key, ascending in enumerate(self._get_ascending()):
+            column = "_sort_key_{0}".format(key)
+            if column not in df.columns:
+                continue
+            values = df[column].tolist()
+            missing = df[column].isna().tolist()
+            direction = (lambda value: value) if ascending else _Descending
+            keys.append(
+                [
+                    (1, 0) if is_missing else (0, direction(value))
+                    for value, is_missing in zip(values, missing)
+                ]
+            )
+        keys.append(df["_row"].tolist())
+        return zip(*keys)
+
+    def _iter_run(self, paths):
+        for path in paths:
+            block = pd.read_pickle(path)
+            for position, key in enumerate(self._get_row_keys(block)):
+                yield key, block, position
+
+    def _merge_runs(self, runs):
+        """Merge sorted runs holding one block of each run in memory.
+
+        The heads of the runs are merged with heapq.merge (a k-way merge on a
+        heap), the consecutive rows of a block are taken as a single slice.
+
+        Parameters
+        ----------
+        runs : list
+            Paths of the blocks of each run.
+
+        Yields
+        ------
+        Data Frame
+            The next chunk_size sorted rows.
+
+        """
+        rows = heapq.merge(
+            *[self._iter_run(paths) for paths in runs], key=operator.itemgetter(0)
+        )
+        slices = []
+        block = None
+        start = end = size = 0
+        for _, row_block, position in rows:
+            if row_block is not block or position != end:
+                if block is not None:
+                    slices.append(block.iloc[start:end])
+                block = row_block
+                start = position
+            end = position + 1
+            size += 1
+            if size == self.chunk_size:
+                slices.append(block.iloc[start:end])
+                yield pd.concat(slices)
+                slices = []
+                block = None
+                size = 0
+        if block is not None:
+            slices.append(block.iloc[start:end])
+        if slices:
+            yield pd.concat(slices)
+
+    def _run_external(self):
+        """Sort the input without loading it in memory.
+
+        Returns
+        -------
+        str
+            Name of the output Data Set.
+
+        """
+        metadata = DataFlow.get_output_metadata(self.input_data_sets[-1])
+        constants = metadata.get("constants", {})
+        metadata = self._get_output_metadata(
+            DataFlow.get_output_columns(self.input_data_sets[-1]),
+            dict(metadata, **self._get_sort_metadata()),
+        )
+        schema = pq.read_schema(DataFlow.get_output_path(self.input_data_sets[-1]))
+        with tempfile.TemporaryDirectory() as run_dir, OutputWriter(
+            self.name, metadata, schema=schema
+        ) as writer:
+            # Keeps the columns if there are no rows
+            writer.write(schema.empty_table().to_pandas())
+            if self.limit is not None:
+                top_rows = None
+                position = 0
+                for chunk in DataFlow.iter_output_df(
+                    self.input_data_sets[-1], self.chunk_size
+                ):
+                    chunk = self._add_sort_keys(chunk, position, constants)
+                    position += len(chunk)
+                    top_rows = self._get_top_rows(pd.concat([top_rows, chunk]))
+                chunks = [top_rows] if top_rows is not None else []
+            else:
+                runs = self._write_runs(run_dir, constants)
+                chunks = self._merge_runs(runs) if runs else []
+            for chunk in chunks:
+                writer.write(self._drop_sort_keys(chunk))
+        return self.name
+
     def run(self):
-        """Short summary.
+        """Sort the previous output, or keep only its first rows with limit.
 
         Parameters
         ----------
@@ -1018,10 +2967,17 @@ class SortValuesBy(TransformationRule):
 
         Returns
         -------
-        type
-            Description of returned object.
+        None
 
         """
+        if self.memory_budget is not None:
+            self.output_data_set = self._run_external()
+            return
         df = DataFlow.get_output_df(self.input_data_sets[-1])
-        df = df.sort_values(by=self.sort_columns, ascending=self.sort_ascending)
-        self.output_data_set = DataFlow.save_output_df(df, self.name)
+        if self.limit is not None:
+            df = self._drop_sort_keys(
+                self._get_top_rows(self._add_sort_keys(df, 0, {}))
+            )
+        else:
+            df = df.sort_values(by=self.sort_columns, ascending=self.sort_ascending)
+        self.output_data_set = self.save_output(df, metadata=self._get_sort_metadata())
@@ -3,5 +3,5 @@ from setuptools import find_packages, setup
 setup(
     name='panditas',
     packages=find_packages(),
-    python_requires='>=3.5'
+    python_requires='>=3.6'
 )